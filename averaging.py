@@ -0,0 +1,180 @@
+import json
+import os
+
+import mne
+import numpy as np
+
+# ============================================================================
+# RUNNING AVERAGES
+# ============================================================================
+#
+# Condition averages are accumulated a batch of epochs at a time with
+# Welford's running mean and sum of squared deviations (M2), in the pairwise
+# form of Chan et al., so two partial results merge exactly. The state per
+# condition is a count plus two channels x times arrays, so memory does not
+# grow with the number of epochs. The mean equals Epochs.average() to float64
+# rounding, and M2 gives the variance and standard error without a second
+# pass over the epochs.
+
+CONDITIONS = ('Target', 'Non-Target')
+
+# Epochs averaged per vectorized update in add_epochs()
+EPOCH_BATCH_SIZE = 64
+
+
+class RunningStats:
+    """Count, mean and M2 of equally shaped arrays seen so far."""
+
+    def __init__(self, shape, count: int = 0, mean: np.ndarray = None, m2: np.ndarray = None):
+        self.count = count
+        self.mean = np.zeros(shape) if mean is None else mean
+        self.m2 = np.zeros(shape) if m2 is None else m2
+
+    def add(self, samples: np.ndarray):
+        """Add samples stacked along the first axis."""
+        samples = np.asarray(samples, dtype=np.float64)
+        if len(samples) == 0:
+            return
+        mean = samples.mean(axis=0)
+        m2 = np.square(samples - mean).sum(axis=0)
+        self._combine(len(samples), mean, m2)
+
+    def merge(self, other: 'RunningStats'):
+        """Fold in the statistics of another set of samples."""
+        self._combine(other.count, other.mean, other.m2)
+
+    def _combine(self, count: int, mean: np.ndarray, m2: np.ndarray):
+        if count == 0:
+            return
+        if self.count == 0:
+            self.count, self.mean, self.m2 = count, np.array(mean), np.array(m2)
+            return
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean = self.mean + delta * (count / total)
+        self.m2 = self.m2 + m2 + np.square(delta) * (self.count * count / total)
+        self.count = total
+
+    def variance(self):
+        """Sample variance (ddof=1), or None below two samples."""
+        if self.count < 2:
+            return None
+        return self.m2 / (self.count - 1)
+
+    def std_error(self):
+        """Standard error of the mean, or None below two samples."""
+        variance = self.variance()
+        if variance is None:
+            return None
+        return np.sqrt(variance / self.count)
+
+
+class EvokedAccumulator:
+    """Running statistics per condition for epochs sharing one channel layout."""
+
+    def __init__(self, info, tmin: float, n_times: int, conditions=CONDITIONS):
+        self.info = info
+        self.tmin = float(tmin)
+        self.n_times = n_times
+        self.stats = {condition: RunningStats((len(info['ch_names']), n_times))
+                      for condition in conditions}
+
+    @classmethod
+    def from_epochs(cls, epochs, keep: np.ndarray = None, batch_size: int = EPOCH_BATCH_SIZE):
+        """Accumulate every condition of ``epochs.event_id``."""
+        accumulator = cls(epochs.info, epochs.tmin, len(epochs.times), tuple(epochs.event_id))
+        accumulator.add_epochs(epochs, keep, batch_size)
+        return accumulator
+
+    @property
+    def conditions(self):
+        return tuple(self.stats)
+
+    @property
+    def ch_names(self):
+        return self.info['ch_names']
+
+    @property
+    def times(self) -> np.ndarray:
+        return self.tmin + np.arange(self.n_times) / self.info['sfreq']
+
+    def count(self, condition: str) -> int:
+        return self.stats[condition].count
+
+    def add(self, condition: str, data: np.ndarray):
+        """Add one (channels x times) epoch or a stack of them."""
+        data = np.asarray(data)
+        if data.ndim == 2:
+            data = data[np.newaxis]
+        if data.shape[1:] != self.stats[condition].mean.shape:
+            raise ValueError(f"Epoch shape {data.shape[1:]} does not match "
+                             f"{self.stats[condition].mean.shape}")
+        self.stats[condition].add(data)
+
+    def add_epochs(self, epochs, keep: np.ndarray = None, batch_size: int = EPOCH_BATCH_SIZE):
+        """Add preloaded epochs ``batch_size`` at a time, by event_id condition.
+
+        ``keep`` is an optional boolean mask of the epochs to include (see
+        rejection.reject_epochs); the others are skipped without copying.
+        """
+        data = epochs.get_data(copy=False)
+        for condition, code in epochs.event_id.items():
+            if condition not in self.stats:
+                continue
+            selected = epochs.events[:, 2] == code
+            if keep is not None:
+                selected &= keep
+            indices = np.flatnonzero(selected)
+            for start in range(0, len(indices), batch_size):
+                self.add(condition, data[indices[start:start + batch_size]])
+
+    def merge(self, other: 'EvokedAccumulator'):
+        """Fold in another accumulator over the same channels and times."""
+        if other.ch_names != self.ch_names or other.n_times != self.n_times:
+            raise ValueError("Accumulators cover different channels or times")
+        for condition, stats in other.stats.items():
+            if condition in self.stats:
+                self.stats[condition].merge(stats)
+
+    def evoked(self, condition: str):
+        """The condition's average as an EvokedArray, or None if it is empty."""
+        stats = self.stats[condition]
+        if stats.count == 0:
+            return None
+        return mne.EvokedArray(np.array(stats.mean), self.info, tmin=self.tmin,
+                               nave=stats.count, comment=condition, verbose=False)
+
+    def stacked_means(self, conditions=None) -> np.ndarray:
+        """(conditions x channels x times) averages; NaN for empty conditions."""
+        conditions = self.conditions if conditions is None else conditions
+        return np.stack([self.stats[c].mean if self.stats[c].count else
+                         np.full(self.stats[c].mean.shape, np.nan) for c in conditions])
+
+    def std_error(self, condition: str):
+        """Standard error of the condition's average (channels x times), or None."""
+        return self.stats[condition].std_error()
+
+    def save(self, directory: str):
+        """Write the state as .npy arrays, an info file and averages.json."""
+        conditions = list(self.stats)
+        np.save(os.path.join(directory, 'mean.npy'),
+                np.stack([self.stats[c].mean for c in conditions]))
+        np.save(os.path.join(directory, 'm2.npy'),
+                np.stack([self.stats[c].m2 for c in conditions]))
+        mne.io.write_info(os.path.join(directory, 'averages-info.fif'), self.info)
+        with open(os.path.join(directory, 'averages.json'), 'w', encoding='utf-8') as f:
+            json.dump({'tmin': self.tmin, 'conditions': conditions,
+                       'counts': [self.stats[c].count for c in conditions]}, f)
+
+    @classmethod
+    def load(cls, directory: str, mmap_mode: str = None):
+        """Read a saved state; ``mmap_mode='r'`` maps the arrays read-only."""
+        with open(os.path.join(directory, 'averages.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        mean = np.load(os.path.join(directory, 'mean.npy'), mmap_mode=mmap_mode)
+        m2 = np.load(os.path.join(directory, 'm2.npy'), mmap_mode=mmap_mode)
+        info = mne.io.read_info(os.path.join(directory, 'averages-info.fif'), verbose=False)
+        accumulator = cls(info, meta['tmin'], mean.shape[2], ())
+        for i, (condition, count) in enumerate(zip(meta['conditions'], meta['counts'])):
+            accumulator.stats[condition] = RunningStats(mean.shape[1:], count, mean[i], m2[i])
+        return accumulator
@@ -0,0 +1,134 @@
+"""Accuracy and speed of filtering.filter_data() against MNE's filtering.
+
+Every engine bandpasses the same synthetic EEG (random-walk drift plus white
+noise, in volts) with CONFIG['filter']'s band:
+
+    mne_fir      mne.filter.filter_data(), the previous per-channel path
+    fft_fir      batched FFT FIR, float64
+    fft_fir_f32  batched FFT FIR, float32
+    iir          zero-phase 4th-order Butterworth
+
+Accuracy is the largest absolute difference from MNE's result with the same
+method (FIR engines against mne_fir, iir against MNE's method='iir'), also
+relative to the signal's largest filtered value. Timing is the best of
+``--repeats`` runs for every channel count x recording length; the filter
+design is cached before timing, and its one-off cost reported separately.
+
+    python -m benchmarks.filtering [--channels 16 32 64] [--durations 60 300 1200]
+"""
+import argparse
+import json
+import time
+
+import mne
+import numpy as np
+
+import filtering
+import main
+
+ENGINES = {
+    'mne_fir': lambda data, sfreq, low, high, n_jobs: mne.filter.filter_data(
+        data, sfreq, low, high, copy=False, verbose=False),
+    'fft_fir': lambda data, sfreq, low, high, n_jobs: filtering.filter_data(
+        data, sfreq, low, high, 'fir', 'float64', n_jobs),
+    'fft_fir_f32': lambda data, sfreq, low, high, n_jobs: filtering.filter_data(
+        data, sfreq, low, high, 'fir', 'float32', n_jobs),
+    'iir': lambda data, sfreq, low, high, n_jobs: filtering.filter_data(
+        data, sfreq, low, high, 'iir', 'float64', n_jobs),
+}
+
+
+def make_signal(n_channels: int, n_times: int, seed: int = 0) -> np.ndarray:
+    """EEG-like test data: slow drift plus 10 uV white noise."""
+    rng = np.random.default_rng(seed)
+    drift = np.cumsum(rng.standard_normal((n_channels, n_times)), axis=1) * 0.5e-6
+    return drift + rng.standard_normal((n_channels, n_times)) * 10e-6
+
+
+def accuracy(sfreq: float, low: float, high: float, duration: float) -> dict:
+    """Largest deviation of every engine from MNE's result."""
+    data = make_signal(8, int(duration * sfreq), seed=1)
+    references = {
+        'fir': mne.filter.filter_data(data, sfreq, low, high, verbose=False),
+        'iir': mne.filter.filter_data(data, sfreq, low, high, method='iir', verbose=False)
+    }
+    results = {}
+    for name, engine in ENGINES.items():
+        reference = references['iir' if name == 'iir' else 'fir']
+        error = np.abs(engine(data.copy(), sfreq, low, high, 1) - reference).max()
+        results[name] = {'max_abs_error_v': float(error),
+                         'relative_error': float(error / np.abs(reference).max())}
+    return results
+
+
+def timing(sfreq: float, low: float, high: float, n_channels: int, duration: float,
+           repeats: int, n_jobs: int) -> dict:
+    """Best wall time of every engine on one recording size."""
+    data = make_signal(n_channels, int(duration * sfreq))
+    results = {}
+    for name, engine in ENGINES.items():
+        times = []
+        for _ in range(repeats):
+            work = data.copy()
+            start = time.perf_counter()
+            engine(work, sfreq, low, high, n_jobs)
+            times.append(time.perf_counter() - start)
+        results[name] = round(min(times), 4)
+    return results
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--channels', type=int, nargs='+', default=[16, 32, 64])
+    parser.add_argument('--durations', type=float, nargs='+', default=[60.0, 300.0, 1200.0],
+                        help="recording lengths in seconds")
+    parser.add_argument('--sfreq', type=float, default=500.0)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--n-jobs', type=int, default=1, help="FFT threads")
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    low, high = main.CONFIG['filter']['low'], main.CONFIG['filter']['high']
+    start = time.perf_counter()
+    n_taps = len(filtering.design_filter(args.sfreq, low, high, 'fir'))
+    filtering.design_filter(args.sfreq, low, high, 'iir')
+    design_s = time.perf_counter() - start
+    start = time.perf_counter()
+    filtering.design_filter(args.sfreq, low, high, 'fir')
+    filtering.design_filter(args.sfreq, low, high, 'iir')
+    cached_s = time.perf_counter() - start
+
+    results = {
+        'band': [low, high],
+        'sfreq': args.sfreq,
+        'fir_taps': n_taps,
+        'fft_length': filtering.fft_length(n_taps),
+        'design_s': {'first': round(design_s, 4), 'cached': round(cached_s, 6)},
+        'accuracy': accuracy(args.sfreq, low, high, 60.0),
+        'timing': []
+    }
+    print(f"Designs: {design_s * 1e3:.1f} ms, cached {cached_s * 1e6:.1f} us "
+          f"({n_taps} FIR taps, FFT length {results['fft_length']})")
+    for name, values in results['accuracy'].items():
+        print(f"  {name:<12} max error {values['max_abs_error_v']:.2e} V "
+              f"({values['relative_error']:.1e} relative)")
+
+    print(f"{'channels':>8} {'seconds':>8} " + ' '.join(f"{name:>12}" for name in ENGINES))
+    for n_channels in args.channels:
+        for duration in args.durations:
+            times = timing(args.sfreq, low, high, n_channels, duration, args.repeats,
+                           args.n_jobs)
+            results['timing'].append({'channels': n_channels, 'duration_s': duration,
+                                      'seconds': times})
+            print(f"{n_channels:>8} {duration:>8.0f} "
+                  + ' '.join(f"{times[name]:>11.3f}s" for name in ENGINES))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"SUCCESS: Wrote results to {args.output}")
+    return results
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,275 @@
+"""Per-stage timing and memory of the analysis pipeline on synthetic recordings.
+
+Each scenario writes a synthetic .cnt/.exp pair and runs run_analysis() on
+it with the stage cache disabled. The pipeline's progress callback marks the
+stage boundaries; for every stage the wall time, CPU time of this process and
+peak resident memory are recorded. Results go to a JSON file that a later run
+can be compared against:
+
+    python -m benchmarks.pipeline --output before.json
+    python -m benchmarks.pipeline --output after.json --baseline before.json
+
+CPU time covers the analysis process, including the FFT threads used for
+filtering (EEG_CPU_BUDGET > EEG_MAX_WORKERS); helper processes used for the
+bootstrap statistics are not included.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import threading
+import time
+
+# Every stage must actually run instead of being served from the stage cache
+os.environ['EEG_CACHE_ENABLED'] = '0'
+
+import mne
+import numpy as np
+
+import main
+from synthetic import make_recording
+
+# ============================================================================
+# SCENARIOS
+# ============================================================================
+#
+# One axis varies at a time around BASE_SCENARIO, so a regression can be
+# traced to channel count, recording length, sampling rate or event density.
+
+BASE_SCENARIO = {'n_channels': 32, 'duration': 300.0, 'sfreq': 500, 'trials_per_minute': 30}
+
+SCENARIO_AXES = {
+    'n_channels': [16, 32, 64],
+    'duration': [60.0, 300.0, 900.0],
+    'sfreq': [250, 500, 1000],
+    'trials_per_minute': [10, 30, 120]
+}
+
+QUICK_SCENARIO_AXES = {
+    'n_channels': [16, 64],
+    'duration': [60.0]
+}
+
+REGRESSION_THRESHOLD = 1.2
+
+
+def scenario_name(params: dict) -> str:
+    return (f"{params['n_channels']}ch-{params['duration']:g}s-"
+            f"{params['sfreq']}Hz-{params['trials_per_minute']}tpm")
+
+
+def build_scenarios(axes: dict):
+    """BASE_SCENARIO plus one variation per axis value, without duplicates."""
+    scenarios = {}
+    for axis, values in axes.items():
+        for value in values:
+            params = dict(BASE_SCENARIO, **{axis: value})
+            scenarios.setdefault(scenario_name(params), params)
+    return [dict(params, name=name) for name, params in scenarios.items()]
+
+
+# ============================================================================
+# STAGE MEASUREMENT
+# ============================================================================
+
+def _read_hwm_kb():
+    """Peak RSS since the last reset, in kB (Linux /proc), or None."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _reset_hwm() -> bool:
+    """Reset the kernel's peak RSS counter for this process."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+class StageRecorder:
+    """Progress callback that measures the time between stage changes.
+
+    Peak RSS per stage uses the kernel high-water mark, reset at every stage
+    boundary. Where that is unavailable it falls back to the process-lifetime
+    maximum from getrusage, which only ever grows.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self._current = None
+        self._lock = threading.Lock()
+        self.exact_rss = _reset_hwm()
+
+    def __call__(self, stage: str):
+        with self._lock:
+            if stage != self._current:
+                self._close()
+                self._open(stage)
+
+    def _open(self, stage: str):
+        self._current = stage
+        if self.exact_rss:
+            _reset_hwm()
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+
+    def _close(self):
+        if self._current is None:
+            return
+        if self.exact_rss:
+            peak_kb = _read_hwm_kb()
+        else:
+            peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        entry = self.stages.setdefault(self._current, {'wall_s': 0.0, 'cpu_s': 0.0,
+                                                       'peak_rss_mb': 0.0})
+        entry['wall_s'] += time.perf_counter() - self._wall
+        entry['cpu_s'] += time.process_time() - self._cpu
+        entry['peak_rss_mb'] = max(entry['peak_rss_mb'], peak_kb / 1024)
+        self._current = None
+
+    def finish(self) -> dict:
+        with self._lock:
+            self._close()
+        return {stage: {k: round(v, 4) for k, v in values.items()}
+                for stage, values in self.stages.items()}
+
+
+def run_scenario(params: dict, directory: str, repeats: int, output_format: str) -> dict:
+    """Benchmark one scenario; per stage keep the fastest wall/CPU and highest RSS."""
+    cnt_path = os.path.join(directory, f"{params['name']}.cnt")
+    exp_path = os.path.join(directory, f"{params['name']}.exp")
+    n_trials = max(1, int(params['trials_per_minute'] * params['duration'] / 60))
+    recording = make_recording(cnt_path, exp_path, n_channels=params['n_channels'],
+                               duration=params['duration'], sfreq=params['sfreq'],
+                               n_trials=n_trials)
+    recording['cnt_mb'] = round(os.path.getsize(cnt_path) / 1e6, 2)
+    try:
+        runs = []
+        for _ in range(repeats):
+            recorder = StageRecorder()
+            start = time.perf_counter()
+            main.run_analysis(cnt_path, exp_path, progress=recorder,
+                              output_format=output_format)
+            total = time.perf_counter() - start
+            runs.append((total, recorder.finish()))
+    finally:
+        os.remove(cnt_path)
+        os.remove(exp_path)
+
+    stages = {}
+    for _, run in runs:
+        for stage, values in run.items():
+            best = stages.setdefault(stage, dict(values))
+            best['wall_s'] = min(best['wall_s'], values['wall_s'])
+            best['cpu_s'] = min(best['cpu_s'], values['cpu_s'])
+            best['peak_rss_mb'] = max(best['peak_rss_mb'], values['peak_rss_mb'])
+    return {
+        'name': params['name'],
+        'params': {k: v for k, v in params.items() if k != 'name'},
+        'recording': recording,
+        'total_wall_s': round(min(total for total, _ in runs), 4),
+        'stages': {stage: stages[stage] for stage in main.PIPELINE_STAGES if stage in stages}
+    }
+
+
+# ============================================================================
+# REPORTING
+# ============================================================================
+
+def environment() -> dict:
+    return {
+        'pipeline_version': main.PIPELINE_VERSION,
+        'python': platform.python_version(),
+        'mne': mne.__version__,
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'cpu_budget': main.CONFIG['cpu']['budget'],
+        'filter_n_jobs': main.filter_n_jobs(),
+        'filter_method': main.CONFIG['filter']['method'],
+        'filter_precision': main.CONFIG['filter']['precision'],
+        'channel_mode': main.CONFIG['channels']['mode'],
+        'streaming': main.streaming_enabled()
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float = REGRESSION_THRESHOLD):
+    """Stage wall times that got slower than ``threshold`` x the baseline."""
+    previous = {s['name']: s for s in baseline.get('scenarios', [])}
+    regressions = []
+    for scenario in results['scenarios']:
+        before = previous.get(scenario['name'])
+        if before is None:
+            continue
+        for stage, values in scenario['stages'].items():
+            old = before['stages'].get(stage)
+            # Sub-10 ms stages are too noisy to compare
+            if old is None or old['wall_s'] < 0.01:
+                continue
+            ratio = values['wall_s'] / old['wall_s']
+            if ratio > threshold:
+                regressions.append({'scenario': scenario['name'], 'stage': stage,
+                                    'before_s': old['wall_s'], 'after_s': values['wall_s'],
+                                    'ratio': round(ratio, 2)})
+    return regressions
+
+
+def print_scenario(scenario: dict):
+    print(f"{scenario['name']}: {scenario['total_wall_s']:.2f} s")
+    for stage, values in scenario['stages'].items():
+        print(f"  {stage:<15} {values['wall_s']:8.3f} s wall {values['cpu_s']:8.3f} s cpu "
+              f"{values['peak_rss_mb']:9.1f} MB peak")
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--output', default='benchmark_results.json',
+                        help="JSON file for the results")
+    parser.add_argument('--baseline', help="earlier results to compare against")
+    parser.add_argument('--repeats', type=int, default=1)
+    parser.add_argument('--quick', action='store_true',
+                        help="two short scenarios, for a smoke test")
+    parser.add_argument('--format', choices=main.REPORT_FORMATS, default='png',
+                        help="report format rendered in the last stage")
+    args = parser.parse_args()
+
+    scenarios = build_scenarios(QUICK_SCENARIO_AXES if args.quick else SCENARIO_AXES)
+    results = {'created_at': time.time(), 'environment': environment(), 'scenarios': []}
+
+    with tempfile.TemporaryDirectory() as directory:
+        # Pay the one-off costs (lazy imports, report template) outside the timings
+        warmup = dict(BASE_SCENARIO, duration=10.0, trials_per_minute=120, name='warmup')
+        run_scenario(warmup, directory, 1, args.format)
+
+        for params in scenarios:
+            scenario = run_scenario(params, directory, args.repeats, args.format)
+            results['scenarios'].append(scenario)
+            print_scenario(scenario)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"SUCCESS: Wrote {len(results['scenarios'])} scenarios to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f))
+        for r in regressions:
+            print(f"WARNING: {r['scenario']} {r['stage']} took {r['after_s']:.3f} s "
+                  f"(was {r['before_s']:.3f} s, x{r['ratio']})")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,117 @@
+"""Per-request memory of building the report from a 64-channel recording.
+
+Compares the report path (one-channel EvokedViews) with the previous
+behaviour, where every section copied both full evokeds before handing them
+to plot_compare_evokeds, which deep-copies its inputs again. Allocations are
+measured with tracemalloc after one warm-up render, so the cached figure
+template is not counted.
+
+    python -m benchmarks.report_memory [--channels 64] [--sfreq 1000] [--repeats 3]
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+# Full montage and no stage cache, so the evokeds keep every channel
+os.environ['EEG_CHANNEL_MODE'] = 'full'
+os.environ['EEG_CACHE_ENABLED'] = '0'
+
+import main
+from synthetic import make_recording
+
+
+class FullCopyViews(main.EvokedViews):
+    """EvokedViews that hands out full copies, as the report used to."""
+
+    def __init__(self, evoked_target, evoked_nontarget, sections, std_errors=None):
+        super().__init__(evoked_target, evoked_nontarget, sections, std_errors)
+        self._full = (evoked_target, evoked_nontarget)
+
+    def channel(self, channel: str):
+        return self._full[0].copy(), self._full[1].copy()
+
+
+def render(views_class, evoked_target, evoked_nontarget, std_errors, summary, output_format):
+    """Build one report the way create_report_figure() does."""
+    sections = main.ANALYSIS_SECTIONS
+    views = views_class(evoked_target, evoked_nontarget, sections, std_errors)
+    rows, _ = main.report_rows(views, sections)
+    footer = main.report_footer(summary['rejection_stats'], summary['target_count'],
+                                summary['nontarget_count'])
+    if output_format == 'json':
+        return main.create_report_series(views, rows, footer)
+    dpi = main.CONFIG['figure']['dpi']
+    return main.get_report_template(sections, dpi).render(views, rows, footer, output_format)
+
+
+def measure(views_class, evokeds, output_format: str, repeats: int) -> dict:
+    """Peak traced allocation and best wall time of one report.
+
+    Timing runs without tracemalloc, which slows allocation-heavy code.
+    """
+    render(views_class, *evokeds, output_format)
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        render(views_class, *evokeds, output_format)
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        render(views_class, *evokeds, output_format)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {'peak_bytes': peak, 'seconds': round(min(times), 4)}
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--channels', type=int, default=64)
+    parser.add_argument('--sfreq', type=int, default=1000)
+    parser.add_argument('--duration', type=float, default=120.0)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cnt_path = os.path.join(tmp, 'bench.cnt')
+        exp_path = os.path.join(tmp, 'bench.exp')
+        recording = make_recording(cnt_path, exp_path, n_channels=args.channels,
+                                   duration=args.duration, sfreq=args.sfreq)
+        averages, summary, _ = main.compute_evokeds(
+            cnt_path, exp_path, main.stage_keys('bench', 'bench'), []
+        )
+
+    evoked_target = averages.evoked('Target')
+    std_errors = (averages.std_error('Target'), averages.std_error('Non-Target'))
+    evokeds = (evoked_target, averages.evoked('Non-Target'), std_errors, summary)
+    results = {
+        'recording': recording,
+        'evoked_shape': list(evoked_target.data.shape),
+        'evoked_bytes': evoked_target.data.nbytes,
+        'formats': {}
+    }
+    for output_format in ('json', 'png'):
+        views = measure(main.EvokedViews, evokeds, output_format, args.repeats)
+        full = measure(FullCopyViews, evokeds, output_format, args.repeats)
+        results['formats'][output_format] = {
+            'views': views,
+            'full_copies': full,
+            'peak_saved_bytes': full['peak_bytes'] - views['peak_bytes']
+        }
+        print(f"{output_format:>5}: peak {views['peak_bytes'] / 1e6:8.2f} MB with views, "
+              f"{full['peak_bytes'] / 1e6:8.2f} MB with full copies "
+              f"({views['seconds']:.3f} s vs {full['seconds']:.3f} s)")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    return results
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,142 @@
+"""Start-up time of the API: module import, health, readiness and the first job.
+
+Import times are measured in fresh interpreters, best of ``--repeats``:
+
+    lazy   import main, as the server does
+    eager  import main, then the modules main.py used to import at the top
+           (pyplot, PIL, scipy.signal/stats/fft, the .cnt reader)
+
+Each server scenario starts uvicorn in a subprocess and records the seconds
+from launch until GET /health answers, until GET /ready answers 200, and
+how long the first analysis of a synthetic recording takes once ready.
+'warm' pre-starts and warms up the workers (EEG_WORKER_WARMUP=1); 'cold'
+starts a worker with the first job, as before. The stage cache is off, so
+the first job really runs.
+
+    python -m benchmarks.startup [--repeats 3] [--output startup.json]
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from synthetic import make_recording
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+EAGER_MODULES = ('matplotlib.pyplot', 'matplotlib.gridspec', 'matplotlib.backends.backend_agg',
+                 'PIL.Image', 'scipy.fft', 'scipy.signal', 'scipy.stats', 'cntreader')
+
+IMPORT_SCRIPT = """
+import importlib, sys, time
+start = time.perf_counter()
+import main
+for name in sys.argv[1:]:
+    importlib.import_module(name)
+print(time.perf_counter() - start)
+"""
+
+
+def import_seconds(modules, repeats: int) -> float:
+    """Best time to import main (and ``modules``) in a fresh interpreter."""
+    times = []
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, '-c', IMPORT_SCRIPT, *modules], cwd=ROOT,
+                                capture_output=True, text=True, check=True).stdout
+        times.append(float(output.strip().splitlines()[-1]))
+    return round(min(times), 3)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for(client: httpx.Client, path: str, deadline: float) -> float:
+    """Poll ``path`` until it answers 200; returns the time it did."""
+    while time.perf_counter() < deadline:
+        try:
+            if client.get(path).status_code == 200:
+                return time.perf_counter()
+        except httpx.TransportError:
+            pass
+        time.sleep(0.02)
+    raise TimeoutError(f"{path} did not answer 200 in time")
+
+
+def run_server(warmup: bool, cnt_path: str, exp_path: str, timeout: float) -> dict:
+    """Launch the API and time health, readiness and the first analysis."""
+    port = free_port()
+    env = dict(os.environ, EEG_WORKER_WARMUP='1' if warmup else '0', EEG_CACHE_ENABLED='0')
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'main:app', '--port', str(port),
+         '--log-level', 'warning'],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        with httpx.Client(base_url=f'http://127.0.0.1:{port}', timeout=30) as client:
+            deadline = start + timeout
+            health = wait_for(client, '/health', deadline)
+            ready = wait_for(client, '/ready', deadline)
+
+            submitted = time.perf_counter()
+            with open(cnt_path, 'rb') as cnt, open(exp_path, 'rb') as exp:
+                task = client.post('/analyze', files={'cnt_file': cnt, 'exp_file': exp}).json()
+            while client.get(task['status_url']).json()['status'] not in ('done', 'failed'):
+                if time.perf_counter() > deadline:
+                    raise TimeoutError("The first analysis did not finish in time")
+                time.sleep(0.02)
+            finished = time.perf_counter()
+            status = client.get(task['status_url']).json()['status']
+    finally:
+        server.terminate()
+        server.wait(30)
+    return {
+        'health_s': round(health - start, 3),
+        'ready_s': round(ready - start, 3),
+        'first_job_s': round(finished - submitted, 3),
+        'first_job_status': status
+    }
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--timeout', type=float, default=300.0,
+                        help="seconds a server scenario may take")
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = {'import_s': {'lazy': import_seconds((), args.repeats),
+                            'eager': import_seconds(EAGER_MODULES, args.repeats)},
+               'servers': {}}
+    print(f"import main: {results['import_s']['lazy']:.3f} s lazy, "
+          f"{results['import_s']['eager']:.3f} s with the eager imports")
+
+    with tempfile.TemporaryDirectory() as directory:
+        cnt_path = os.path.join(directory, 'first.cnt')
+        exp_path = os.path.join(directory, 'first.exp')
+        make_recording(cnt_path, exp_path, n_channels=32, duration=120.0)
+        for name, warmup in (('cold', False), ('warm', True)):
+            server = run_server(warmup, cnt_path, exp_path, args.timeout)
+            results['servers'][name] = server
+            print(f"{name:>5}: health {server['health_s']:.2f} s, ready {server['ready_s']:.2f} s, "
+                  f"first job {server['first_job_s']:.2f} s ({server['first_job_status']})")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"SUCCESS: Wrote results to {args.output}")
+    return results
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,217 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+
+# ============================================================================
+# RESULT CACHE
+# ============================================================================
+#
+# Finished analysis payloads are stored on disk under a key derived from the
+# uploaded bytes and the analysis configuration. Entries live in a directory
+# named after the configuration digest, so changing any setting moves lookups
+# to a fresh namespace and the stale one is purged.
+
+
+def canonical_digest(*objects) -> str:
+    """Stable SHA-256 of JSON-compatible objects (tuples hash like lists)."""
+    payload = json.dumps(objects, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def combine_digests(*digests: str) -> str:
+    """Combine several hex digests into a single cache key."""
+    h = hashlib.sha256()
+    for digest in digests:
+        h.update(digest.encode('ascii'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+class ResultCache:
+    """On-disk JSON result store with a size cap and LRU eviction."""
+
+    def __init__(self, directory: str, max_bytes: int, namespace: str):
+        self.root = directory
+        self.directory = os.path.join(directory, namespace)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def purge_stale_namespaces(self):
+        """Delete entries written under any other configuration digest."""
+        current = os.path.basename(self.directory)
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name != current and os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key: str):
+        """Return the cached payload for ``key``, or None on a miss."""
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                payload = json.load(f)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        # Touch the entry so eviction treats it as recently used
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+        return payload
+
+    def put(self, key: str, payload: dict):
+        """Store ``payload`` atomically, then evict down to the size cap."""
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(payload, f)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def entries(self):
+        """List ``(mtime, size, path)`` for every stored entry."""
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def evict(self):
+        """Remove least recently used entries until under ``max_bytes``."""
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+    def stats(self) -> dict:
+        entries = self.entries()
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        lookups = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / lookups, 4) if lookups else 0.0,
+            'entries': len(entries),
+            'bytes': sum(size for _, size, _ in entries),
+            'max_bytes': self.max_bytes,
+            'namespace': os.path.basename(self.directory),
+            'checked_at': time.time()
+        }
+
+
+# ============================================================================
+# STAGE CACHE
+# ============================================================================
+#
+# Pipeline intermediates (decoded raw, filtered raw, epochs, evokeds, report)
+# are stored one directory per entry, keyed on the parent stage key and the
+# CONFIG slice the stage uses. Callers write .npy/.json files into the entry
+# directory and memory-map them back on reload.
+
+
+class StageCache:
+    """Directory-per-entry store for pipeline intermediates with LRU eviction."""
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def key(stage: str, parent: str, config) -> str:
+        """Key for ``stage`` given its upstream key and CONFIG slice."""
+        return combine_digests(stage, parent, canonical_digest(config))
+
+    def _path(self, stage: str, key: str) -> str:
+        return os.path.join(self.directory, f"{stage}-{key}")
+
+    def lookup(self, stage: str, key: str):
+        """Return the entry directory for a stored stage, or None."""
+        path = self._path(stage, key)
+        if not os.path.isdir(path):
+            return None
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return path
+
+    @contextmanager
+    def writing(self, stage: str, key: str):
+        """Yield a scratch directory that becomes the entry on success."""
+        final_path = self._path(stage, key)
+        tmp_path = f"{final_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        os.makedirs(tmp_path, exist_ok=True)
+        try:
+            yield tmp_path
+            try:
+                os.rename(tmp_path, final_path)
+            except OSError:
+                # Another worker stored the same stage first
+                shutil.rmtree(tmp_path, ignore_errors=True)
+        except BaseException:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+        self.evict()
+
+    def entries(self):
+        """List ``(mtime, size, path)`` for every complete entry."""
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith('.tmp') or not os.path.isdir(path):
+                continue
+            try:
+                mtime = os.stat(path).st_mtime
+                size = sum(os.path.getsize(os.path.join(path, f))
+                           for f in os.listdir(path))
+            except OSError:
+                continue
+            entries.append((mtime, size, path))
+        return entries
+
+    def evict(self):
+        """Remove least recently used entries until under ``max_bytes``."""
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def stats(self) -> dict:
+        entries = self.entries()
+        return {
+            'entries': len(entries),
+            'bytes': sum(size for _, size, _ in entries),
+            'max_bytes': self.max_bytes
+        }
@@ -0,0 +1,267 @@
+import os
+from datetime import datetime, timezone
+
+import mne
+import numpy as np
+from mne.io import BaseRaw
+
+# ============================================================================
+# NEUROSCAN .CNT READER
+# ============================================================================
+#
+# A Neuroscan .cnt file is a 900-byte SETUP header, one 75-byte ELECTLOC
+# record per channel, the samples as little-endian int16 or int32 counts
+# (multiplexed: all channels of sample 0, then sample 1, ...; older files
+# interleave blocks of ``channel_offset`` samples per channel), and finally
+# the event table. Every channel's volts are ``(count - baseline) * cal``.
+#
+# CntFile parses the header and the event table once, decoding the table in
+# one np.frombuffer call, and maps the samples with np.memmap without reading
+# them. Callers take any channel subset and time range (read()), or only the
+# events (annotations()), and nothing else is decoded. RawCNTMap wraps it as
+# an mne Raw, so picking channels before load_data() reads only those
+# channels, and streaming reads block by block.
+#
+# The header fields, byte-width detection, event positions and bad-span
+# handling follow mne.io.read_raw_cnt (MNE 1.6), so data, annotations,
+# channel names, calibrations, bads and measurement date match it. Channel
+# positions are not read; the pipeline never uses them.
+
+CNT_SETUP_BYTES = 900
+CNT_ELECTRODE_BYTES = 75
+
+# Files past 2 GB overflow the header's event table offset
+LARGE_FILE_BYTES = 2e9
+
+# Event table records (TEEG types 1, 2 and 3), packed like the C structs
+_EVENT1_FIELDS = [('stim_type', '<u2'), ('keyboard', 'u1'), ('keypad_accept', 'u1'),
+                  ('offset', '<i4')]
+_EVENT2_FIELDS = _EVENT1_FIELDS + [('type', '<i2'), ('code', '<i2'), ('latency', '<f4'),
+                                   ('epoch_event', 'i1'), ('accept2', 'i1'),
+                                   ('accuracy', 'i1')]
+EVENT_DTYPES = {1: np.dtype(_EVENT1_FIELDS), 2: np.dtype(_EVENT2_FIELDS),
+                3: np.dtype(_EVENT2_FIELDS)}
+TEEG_DTYPE = np.dtype([('event_type', 'u1'), ('total_length', '<i4'), ('offset', '<i4')])
+
+# KeyPad_Accept high nibble: 0xd0 accepts, 0xc0 rejects (starts a bad span)
+KEYPAD_ACCEPT = 0xd0
+KEYPAD_REJECT = 0xc0
+
+
+def _read_str(header: bytes, offset: int, count: int) -> str:
+    """A NUL-terminated ASCII field of the header."""
+    return header[offset:offset + count].split(b'\0')[0].decode('ascii', errors='replace')
+
+
+def _field(header: bytes, offset: int, dtype: str):
+    return np.frombuffer(header, dtype=dtype, count=1, offset=offset).item()
+
+
+def _meas_date(header: bytes):
+    """Session date and time of the header as a UTC datetime, or None."""
+    session = f"{_read_str(header, 225, 10)} {_read_str(header, 235, 12)}"
+    try:
+        # Like mne, the header time is taken as local time
+        timestamp = datetime.strptime(session, '%m/%d/%y %H:%M:%S').timestamp()
+    except ValueError:
+        return None
+    return datetime.fromtimestamp(timestamp, timezone.utc)
+
+
+class CntFile:
+    """Header, event table and memory-mapped samples of a Neuroscan .cnt file.
+
+    Raises ValueError if the file is not a readable .cnt recording.
+    """
+
+    def __init__(self, path: str):
+        self.path = os.path.abspath(path)
+        self.file_size = os.path.getsize(self.path)
+        with open(self.path, 'rb') as f:
+            header = f.read(CNT_SETUP_BYTES)
+            if len(header) < CNT_SETUP_BYTES:
+                raise ValueError("File is too short for a Neuroscan .cnt header")
+            self.n_channels = _field(header, 370, '<u2')
+            self.sfreq = float(_field(header, 376, '<u2'))
+            if self.n_channels == 0 or self.sfreq == 0:
+                raise ValueError("Header declares no channels or a zero sampling rate")
+            electrodes = f.read(CNT_ELECTRODE_BYTES * self.n_channels)
+            if len(electrodes) < CNT_ELECTRODE_BYTES * self.n_channels:
+                raise ValueError("File is too short for its electrode table")
+
+        self.data_offset = CNT_SETUP_BYTES + CNT_ELECTRODE_BYTES * self.n_channels
+        self.meas_date = _meas_date(header)
+        self.lowpass = _field(header, 875, '<f4') if _field(header, 438, 'i1') == 1 else None
+        self.highpass = _field(header, 869, '<f4') if _field(header, 439, 'i1') == 1 else None
+
+        # Byte width from the space between the electrodes and the event table
+        n_samples = _field(header, 864, '<i4')
+        event_table = self._event_table_position(header, n_bytes=4)
+        if event_table < CNT_SETUP_BYTES:
+            data_size = n_samples * self.n_channels
+        else:
+            data_size = event_table - self.data_offset
+        if n_samples > 0 and data_size // (n_samples * self.n_channels) in (2, 4):
+            self.n_bytes = data_size // (n_samples * self.n_channels)
+        else:
+            self.n_bytes = 2
+            n_samples = data_size // (self.n_bytes * self.n_channels)
+        self.n_samples = int(n_samples)
+        self.event_table = self._event_table_position(header, self.n_bytes)
+
+        channel_offset = _field(header, 894, '<i4')
+        self.channel_offset = channel_offset // self.n_bytes if channel_offset > 1 else 1
+
+        records = np.frombuffer(electrodes, dtype=np.uint8).reshape(self.n_channels,
+                                                                    CNT_ELECTRODE_BYTES)
+        self.ch_names = [_read_str(electrodes, CNT_ELECTRODE_BYTES * i, 10)
+                         for i in range(self.n_channels)]
+        # Old and new headers flag bad channels at different bytes
+        self.bads = [name for name, new, old in zip(self.ch_names, records[:, 14], records[:, 4])
+                     if new or old]
+        self.baselines = records[:, 47:49].copy().view('<i2')[:, 0].astype(np.float64)
+        sensitivity = records[:, 59:63].copy().view('<f4')[:, 0].astype(np.float64)
+        cal = records[:, 71:75].copy().view('<f4')[:, 0].astype(np.float64)
+        self.cals = cal * sensitivity * 1e-6 / 204.8
+
+        self.samples = self._map_samples()
+
+    def _event_table_position(self, header: bytes, n_bytes: int) -> int:
+        """Event table offset, recomputed for files too large for the header field."""
+        if self.file_size < LARGE_FILE_BYTES:
+            return _field(header, 886, '<i4')
+        return self.data_offset + n_bytes * self.n_channels * _field(header, 864, '<i4')
+
+    def _map_samples(self) -> np.memmap:
+        """(samples x channels), or (blocks x channels x channel_offset) counts."""
+        dtype = np.dtype('<i4' if self.n_bytes == 4 else '<i2')
+        available = (self.file_size - self.data_offset) // (dtype.itemsize * self.n_channels)
+        if self.n_samples <= 0 or available <= 0:
+            raise ValueError("Recording holds no samples")
+        if self.channel_offset == 1:
+            shape = (min(self.n_samples, available), self.n_channels)
+        else:
+            n_blocks = -(-self.n_samples // self.channel_offset)
+            shape = (min(n_blocks, available // self.channel_offset), self.n_channels,
+                     self.channel_offset)
+        self.n_samples = min(self.n_samples, shape[0] * (shape[2] if len(shape) == 3 else 1))
+        return np.memmap(self.path, dtype=dtype, mode='r', offset=self.data_offset, shape=shape)
+
+    def counts(self, picks=None, start: int = 0, stop: int = None) -> np.ndarray:
+        """(channels x samples) baseline-corrected counts, as float64."""
+        picks = np.arange(self.n_channels) if picks is None else picks
+        stop = self.n_samples if stop is None else stop
+        if self.channel_offset == 1:
+            block = self.samples[start:stop, picks].T
+        else:
+            first, size = start // self.channel_offset, self.channel_offset
+            last = -(-stop // size)
+            blocks = self.samples[first:last][:, picks]
+            block = blocks.transpose(1, 0, 2).reshape(blocks.shape[1], -1)
+            block = block[:, start - first * size:stop - first * size]
+        counts = block.astype(np.float64)
+        counts -= self.baselines[picks, np.newaxis]
+        return counts
+
+    def read(self, picks=None, start: int = 0, stop: int = None) -> np.ndarray:
+        """(channels x samples) data in volts for channel indices ``picks``."""
+        picks = np.arange(self.n_channels) if picks is None else np.asarray(picks)
+        return self.counts(picks, start, stop) * self.cals[picks, np.newaxis]
+
+    def read_events(self):
+        """``(table type, records)`` of the event table; records follow EVENT_DTYPES."""
+        with open(self.path, 'rb') as f:
+            f.seek(self.event_table)
+            teeg = np.frombuffer(f.read(TEEG_DTYPE.itemsize), dtype=TEEG_DTYPE)
+            if self.event_table < CNT_SETUP_BYTES or len(teeg) == 0:
+                return 2, np.empty(0, dtype=EVENT_DTYPES[2])
+            event_type = int(teeg['event_type'][0])
+            if event_type not in EVENT_DTYPES:
+                raise ValueError(f"Unknown .cnt event table type {event_type}")
+            dtype = EVENT_DTYPES[event_type]
+            table = f.read(max(int(teeg['total_length'][0]), 0))
+        return event_type, np.frombuffer(table[:len(table) - len(table) % dtype.itemsize],
+                                         dtype=dtype)
+
+    def annotations(self) -> mne.Annotations:
+        """Events as annotations named by stimulus code, like read_raw_cnt().
+
+        A rejected (0xc0) event marks a "BAD_" span that lasts until the
+        next accept (0xd0) event; accept markers themselves are dropped.
+        """
+        event_type, events = self.read_events()
+        if len(events) == 0:
+            return mne.Annotations([], [], [], orig_time=None)
+
+        offsets = events['offset'].astype(np.int64)
+        frame = self.n_bytes * self.n_channels
+        if event_type == 3:
+            # Type 3 tables store sample numbers instead of byte offsets
+            offsets = offsets * frame
+        onset = np.clip((offsets - self.data_offset) // frame - 1, 0, None) / self.sfreq
+        duration = np.zeros(len(events))
+        description = events['stim_type'].astype(str).astype(object)
+
+        accept = events['keypad_accept']
+        bad = np.flatnonzero(accept == KEYPAD_REJECT)
+        if len(bad):
+            markers = np.flatnonzero((accept == KEYPAD_REJECT) | (accept == KEYPAD_ACCEPT))
+            marker_onsets = onset[markers]
+            # Spans run from every second marker, starting at the first reject
+            first = int(np.searchsorted(markers, bad[0]))
+            spans = np.diff(marker_onsets[first:])[::2]
+            duration[bad[:len(spans)]] = spans
+            description[bad] = ['BAD_' + d for d in description[bad]]
+            kept = accept != KEYPAD_ACCEPT
+            onset, duration, description = onset[kept], duration[kept], description[kept]
+        return mne.Annotations(onset=onset, duration=duration,
+                               description=description.astype(str), orig_time=None)
+
+    def create_info(self):
+        """mne.Info of the recording's channels (all EEG), without positions."""
+        info = mne.create_info(self.ch_names, self.sfreq, 'eeg')
+        with info._unlock():
+            if self.lowpass is not None:
+                info['lowpass'] = self.lowpass
+            if self.highpass is not None:
+                info['highpass'] = self.highpass
+        for ch, cal in zip(info['chs'], self.cals):
+            ch['cal'] = float(cal)
+        info['bads'] = list(dict.fromkeys(self.bads))
+        info.set_meas_date(self.meas_date)
+        return info
+
+
+class RawCNTMap(BaseRaw):
+    """mne Raw over a memory-mapped CntFile; see read_cnt()."""
+
+    def __init__(self, cnt: CntFile, preload: bool = False):
+        super().__init__(
+            cnt.create_info(),
+            preload,
+            filenames=[cnt.path],
+            raw_extras=[{'cnt': cnt}],
+            last_samps=[cnt.n_samples - 1],
+            orig_format='int',
+            verbose=False
+        )
+        self.set_annotations(cnt.annotations())
+
+    def _read_segment_file(self, data, idx, fi, start, stop, cals, mult):
+        """Read only the channels ``idx`` of samples ``start:stop``."""
+        cnt = self._raw_extras[fi]['cnt']
+        if mult is not None:
+            data[:] = mult @ cnt.counts(np.arange(cnt.n_channels)[idx], start, stop)
+        else:
+            counts = cnt.counts(np.arange(cnt.n_channels)[idx], start, stop)
+            data[:] = counts
+            data *= cals
+
+
+def read_cnt(path: str, preload: bool = False) -> RawCNTMap:
+    """Open a Neuroscan .cnt file; a drop-in for mne.io.read_raw_cnt().
+
+    Only the header and the event table are read up front. Pick channels
+    before ``load_data()`` to decode just those.
+    """
+    return RawCNTMap(CntFile(path), preload=preload)
@@ -0,0 +1,421 @@
+import argparse
+import base64
+import json
+import multiprocessing
+import os
+import threading
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor, wait
+
+import mne
+import numpy as np
+
+from averaging import EvokedAccumulator
+from jobs import QueueFullError
+
+# ============================================================================
+# COHORT ANALYSIS
+# ============================================================================
+#
+# A batch is a directory holding manifest.json (per-subject state) and one
+# folder of averaged evokeds per finished subject. Subjects are handed to the
+# job pool at most ``max_in_flight`` at a time, so peak memory follows the
+# worker count rather than the cohort size. The manifest is rewritten after
+# every subject, so a failed or interrupted batch is resumed by running it
+# again: subjects already marked done are skipped.
+
+BATCH_STATUSES = ('queued', 'running', 'aggregating', 'done', 'partial', 'failed')
+
+
+def pair_subject_files(cnt_names, exp_names):
+    """Pair .cnt and .exp files by file stem.
+
+    Returns ``[(subject, cnt_name, exp_name), ...]`` sorted by subject and
+    raises ValueError if a stem repeats or has no partner.
+    """
+    def by_stem(names, kind):
+        stems = {}
+        for name in names:
+            stem = os.path.splitext(os.path.basename(name))[0]
+            if stem in stems:
+                raise ValueError(f"Duplicate {kind} file for subject '{stem}'")
+            stems[stem] = name
+        return stems
+
+    cnt_by_stem = by_stem(cnt_names, '.cnt')
+    exp_by_stem = by_stem(exp_names, '.exp')
+
+    unpaired = sorted(set(cnt_by_stem) ^ set(exp_by_stem))
+    if unpaired:
+        raise ValueError(f"Subjects without a matching .cnt/.exp pair: {', '.join(unpaired)}")
+    if not cnt_by_stem:
+        raise ValueError("No .cnt/.exp pairs given")
+
+    return [(stem, cnt_by_stem[stem], exp_by_stem[stem]) for stem in sorted(cnt_by_stem)]
+
+
+def file_signature(path: str):
+    """Size and mtime of an input, used to notice a replaced recording."""
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+
+class BatchStore:
+    """Manifest and per-subject output folders of one cohort batch."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._manifest = None
+        path = self._manifest_path()
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self._manifest = json.load(f)
+
+    @classmethod
+    def create(cls, directory: str, batch_id: str, subjects):
+        """Start a batch in ``directory``, or extend the one already there.
+
+        ``subjects`` is ``[(subject, cnt_path, exp_path), ...]``. A subject
+        whose input files changed since it was analyzed is queued again.
+        """
+        os.makedirs(directory, exist_ok=True)
+        store = cls(directory)
+        with store._lock:
+            if store._manifest is None:
+                store._manifest = {
+                    'batch_id': batch_id,
+                    'created_at': time.time(),
+                    'status': 'queued',
+                    'error': None,
+                    'subjects': {}
+                }
+            records = store._manifest['subjects']
+            for subject, cnt_path, exp_path in subjects:
+                signature = [file_signature(cnt_path), file_signature(exp_path)]
+                record = records.get(subject)
+                if (record is None or record['cnt'] != cnt_path or
+                        record['exp'] != exp_path or record['signature'] != signature):
+                    records[subject] = {
+                        'cnt': cnt_path,
+                        'exp': exp_path,
+                        'signature': signature,
+                        'status': 'pending',
+                        'task_id': None,
+                        'error': None,
+                        'result': None
+                    }
+            store._save()
+        return store
+
+    @classmethod
+    def load(cls, directory: str):
+        """Open an existing batch, or return None if there is none."""
+        store = cls(directory)
+        return store if store._manifest is not None else None
+
+    def _manifest_path(self) -> str:
+        return os.path.join(self.directory, 'manifest.json')
+
+    def _save(self):
+        path = self._manifest_path()
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._manifest, f, indent=1)
+        os.replace(tmp_path, path)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return json.loads(json.dumps(self._manifest))
+
+    def update(self, **fields):
+        with self._lock:
+            self._manifest.update(fields)
+            self._save()
+
+    def update_subject(self, subject: str, **fields):
+        with self._lock:
+            self._manifest['subjects'][subject].update(fields)
+            self._save()
+
+    def subject_dir(self, subject: str) -> str:
+        return os.path.join(self.directory, 'subjects', subject)
+
+    def subjects_with_status(self, *statuses):
+        with self._lock:
+            return [s for s, r in sorted(self._manifest['subjects'].items())
+                    if r['status'] in statuses]
+
+    def result_path(self) -> str:
+        return os.path.join(self.directory, 'result.json')
+
+    def write_result(self, result: dict):
+        path = self.result_path()
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(result, f)
+        os.replace(tmp_path, path)
+
+    def read_result(self):
+        try:
+            with open(self.result_path(), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+
+def common_channels(subjects):
+    """Channels present in every subject, in the first subject's order."""
+    common = [ch for ch in subjects[0].ch_names
+              if all(ch in s.ch_names for s in subjects[1:])]
+    if not common:
+        raise ValueError("Subjects have no channels in common")
+    return common
+
+
+def grand_average(subjects):
+    """Equal-weight average of every condition across subjects.
+
+    ``subjects`` are per-subject EvokedAccumulators. Each subject's condition
+    average counts as one observation, as in mne.grand_average, so the
+    result's standard error is the spread between subjects. Subjects are
+    reduced to their common channels first, so a channel missing from one
+    recording drops out rather than failing the cohort.
+    """
+    first = subjects[0]
+    common = common_channels(subjects)
+    grand = EvokedAccumulator(mne.pick_info(first.info, [first.ch_names.index(ch) for ch in common]),
+                              first.tmin, first.n_times, first.conditions)
+    for subject in subjects:
+        picks = [subject.ch_names.index(ch) for ch in common]
+        for condition in grand.conditions:
+            if subject.count(condition):
+                grand.add(condition, subject.stats[condition].mean[picks])
+    return grand
+
+
+def stack_subject_means(subjects, ch_names, conditions):
+    """(subjects x conditions x channels x times) array of subject averages.
+
+    Channels are picked by name from each subject; a condition a subject
+    has no epochs for is NaN.
+    """
+    return np.stack([
+        subject.stacked_means(conditions)[:, [subject.ch_names.index(ch) for ch in ch_names]]
+        for subject in subjects
+    ])
+
+
+def measure_spread(measures: dict):
+    """Mean and SD across subjects (first axis) of per-subject measure arrays.
+
+    NaN entries (e.g. no P300 area) are skipped; the SD is None below two
+    subjects.
+    """
+    with warnings.catch_warnings():
+        # All-NaN slices give NaN, which is what the tables expect
+        warnings.simplefilter('ignore', RuntimeWarning)
+        mean = {name: np.nanmean(values, axis=0) for name, values in measures.items()}
+        sd = None
+        if len(next(iter(measures.values()))) > 1:
+            sd = {name: np.nanstd(values, axis=0, ddof=1) for name, values in measures.items()}
+    return mean, sd
+
+
+def pool_rejection_stats(summaries):
+    """Sum per-subject rejection statistics into cohort totals."""
+    total_events = sum(s['rejection_stats']['total_events'] for s in summaries)
+    good_epochs = sum(s['rejection_stats']['good_epochs'] for s in summaries)
+    dropped_epochs = total_events - good_epochs
+    return {
+        'total_events': total_events,
+        'good_epochs': good_epochs,
+        'dropped_epochs': dropped_epochs,
+        'drop_percentage': (dropped_epochs / total_events * 100) if total_events > 0 else 0
+    }
+
+
+def latency_summary(records):
+    """Cohort mean/SD/median of the per-subject P300 latencies and scores."""
+    p300 = [r['result']['p300'] for r in records
+            if r.get('result') and r['result'].get('p300')]
+    if not p300:
+        return {'subjects_with_p300': 0}
+
+    latencies = np.array([p['latency_ms'] for p in p300])
+    scores = np.array([p['score'] for p in p300])
+    return {
+        'subjects_with_p300': len(p300),
+        'mean_latency_ms': round(float(latencies.mean()), 1),
+        'sd_latency_ms': round(float(latencies.std(ddof=1)), 1) if len(p300) > 1 else 0.0,
+        'median_latency_ms': round(float(np.median(latencies)), 1),
+        'mean_score': round(float(scores.mean()), 1)
+    }
+
+
+def subject_table(manifest: dict, components: dict = None):
+    """Per-subject status and P300 measures for the cohort response.
+
+    ``components`` maps subjects to their component measures, if any.
+    """
+    components = components or {}
+    rows = []
+    for subject, record in sorted(manifest['subjects'].items()):
+        result = record.get('result') or {}
+        p300 = result.get('p300') or {}
+        rows.append({
+            'subject': subject,
+            'status': record['status'],
+            'error': record['error'],
+            'target_epochs': result.get('target_epochs'),
+            'nontarget_epochs': result.get('nontarget_epochs'),
+            'drop_percentage': result.get('drop_percentage'),
+            'p300_latency_ms': p300.get('latency_ms'),
+            'p300_score': p300.get('score'),
+            'components': components.get(subject),
+            'analysis_id': result.get('analysis_id')
+        })
+    return rows
+
+
+def _submit_when_accepted(submit, func, *args, retry_delay: float = 5.0):
+    """Submit a job, waiting while the shared queue is full."""
+    while True:
+        try:
+            return submit(func, *args)
+        except QueueFullError:
+            time.sleep(retry_delay)
+
+
+def run_batch(store: BatchStore, submit, subject_job, cohort_job, max_in_flight: int):
+    """Analyze every subject not yet done, then build the cohort report.
+
+    ``submit(func, *args)`` must return a Future; ``subject_job(cnt, exp,
+    output_dir)`` returns a subject's summary after writing its evokeds to
+    ``output_dir``, and ``cohort_job(subject_dirs)`` returns the cohort
+    payload, with optional "subject_components" keyed by subject folder
+    name. A failing subject is recorded and skipped; the batch ends as
+    'partial' and can be run again to retry it.
+    """
+    store.update(status='running', error=None)
+    slots = threading.Semaphore(max(1, max_in_flight))
+    futures = []
+
+    def finished(subject: str, future):
+        try:
+            store.update_subject(subject, status='done', error=None,
+                                 result=future.result())
+        except Exception as e:
+            store.update_subject(subject, status='failed', error=str(e))
+        finally:
+            slots.release()
+
+    for subject in store.subjects_with_status('pending', 'running', 'failed'):
+        slots.acquire()
+        record = store.snapshot()['subjects'][subject]
+        try:
+            future = _submit_when_accepted(submit, subject_job, record['cnt'],
+                                           record['exp'], store.subject_dir(subject))
+        except Exception as e:
+            store.update_subject(subject, status='failed', error=str(e))
+            slots.release()
+            continue
+        store.update_subject(subject, status='running', error=None,
+                             task_id=getattr(future, 'task_id', None))
+        future.add_done_callback(lambda f, s=subject: finished(s, f))
+        futures.append(future)
+
+    wait(futures)
+
+    done = store.subjects_with_status('done')
+    if not done:
+        store.update(status='failed', error="No subject could be analyzed")
+        return store.snapshot()
+
+    store.update(status='aggregating')
+    try:
+        future = _submit_when_accepted(submit, cohort_job,
+                                       [store.subject_dir(s) for s in done])
+        result = future.result()
+    except Exception as e:
+        store.update(status='failed', error=f"Cohort report failed: {e}")
+        return store.snapshot()
+
+    manifest = store.snapshot()
+    records = [manifest['subjects'][s] for s in done]
+    result['subjects'] = subject_table(manifest, result.pop('subject_components', None))
+    result['metadata'].update(latency_summary(records))
+    result['metadata']['subjects_total'] = len(manifest['subjects'])
+    result['metadata']['subjects_analyzed'] = len(done)
+    store.write_result(result)
+
+    failed = len(done) < len(manifest['subjects'])
+    store.update(status='partial' if failed else 'done')
+    return store.snapshot()
+
+# ============================================================================
+# COMMAND LINE
+# ============================================================================
+
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Analyze every .cnt/.exp pair in a folder and write a "
+                    "grand-average cohort report. Re-running with the same "
+                    "output folder resumes an interrupted or partial batch."
+    )
+    parser.add_argument('data_dir', help="folder with <subject>.cnt and <subject>.exp files")
+    parser.add_argument('-o', '--output', default='cohort',
+                        help="batch folder for per-subject results and the report")
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help="subjects analyzed at once (default: CONFIG jobs.max_workers)")
+    args = parser.parse_args(argv)
+
+    # main imports this module, so load the pipeline only when run as a tool
+    import main as pipeline
+
+    names = sorted(os.listdir(args.data_dir))
+    try:
+        subjects = pair_subject_files(
+            [n for n in names if n.lower().endswith('.cnt')],
+            [n for n in names if n.lower().endswith('.exp')]
+        )
+    except ValueError as e:
+        parser.error(str(e))
+    data_dir = os.path.abspath(args.data_dir)
+    subjects = [(s, os.path.join(data_dir, c), os.path.join(data_dir, e))
+                for s, c, e in subjects]
+
+    store = BatchStore.create(args.output, os.path.basename(os.path.abspath(args.output)),
+                              subjects)
+    workers = args.workers or pipeline.CONFIG['jobs']['max_workers']
+    pending = len(store.subjects_with_status('pending', 'running', 'failed'))
+    print(f"{len(subjects)} subjects, {len(subjects) - pending} already done, "
+          f"{workers} workers")
+
+    with ProcessPoolExecutor(max_workers=workers,
+                             mp_context=multiprocessing.get_context('spawn')) as pool:
+        manifest = run_batch(store, pool.submit, pipeline.subject_job,
+                             pipeline.cohort_job, workers)
+
+    for row in subject_table(manifest):
+        latency = row['p300_latency_ms']
+        detail = f"P300 {latency:.0f} ms" if latency is not None else (row['error'] or '')
+        print(f"  {row['subject']:<20} {row['status']:<8} {detail}")
+
+    result = store.read_result() if manifest['status'] in ('done', 'partial') else None
+    if result is None:
+        print(f"Batch {manifest['status']}: {manifest['error']}")
+        return 1
+
+    report_path = os.path.join(args.output, 'report.png')
+    with open(report_path, 'wb') as f:
+        f.write(base64.b64decode(result['image']))
+    print(f"Batch {manifest['status']}: grand-average score "
+          f"{result['neural_confidence_score']}, report written to {report_path}")
+    return 0 if manifest['status'] == 'done' else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(cli())
@@ -0,0 +1,212 @@
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import mne
+import numpy as np
+import scipy
+
+# ============================================================================
+# HELPER POOL
+# ============================================================================
+#
+# A process pool for batched CPU-bound work (reliability.py's bootstrap).
+# It lives for the lifetime of the calling process so its start-up cost is
+# paid once, not per analysis.
+
+_pool = None
+_pool_size = 0
+
+
+def get_helper_pool(n_jobs: int) -> ProcessPoolExecutor:
+    """The process-wide helper pool, resized to ``n_jobs`` workers if needed."""
+    global _pool, _pool_size
+    if _pool is None or _pool_size != n_jobs:
+        if _pool is not None:
+            _pool.shutdown(wait=True)
+        _pool = ProcessPoolExecutor(
+            max_workers=n_jobs,
+            mp_context=multiprocessing.get_context('spawn')
+        )
+        _pool_size = n_jobs
+    return _pool
+
+
+def shutdown_pool():
+    """Stop the helper processes (they are restarted on next use)."""
+    global _pool, _pool_size
+    if _pool is not None:
+        _pool.shutdown(wait=True)
+        _pool = None
+        _pool_size = 0
+
+
+# ============================================================================
+# FILTER DESIGNS
+# ============================================================================
+#
+# Every analysis filters with the same band at the same sampling rate, so the
+# designs are made once per process and shared (read-only) by later requests,
+# the streaming epocher and live sessions:
+# - 'fir': the linear-phase kernel raw.filter(low, high) designs, applied
+#   zero-phase (delay compensated). 3301 taps at 500 Hz for a 0.5 Hz edge.
+# - 'iir': a 4th-order Butterworth as second-order sections, applied forwards
+#   and backwards (zero phase, squared magnitude), as raw.filter(low, high,
+#   method='iir') does. Its impulse response, and so the edge padding and
+#   the transient after a discontinuity, is about half the FIR length.
+#   Coefficients stay float64 whatever the precision: rounding the sections
+#   of a 0.5 Hz highpass to float32 moves the result by about 1e-3.
+
+FILTER_METHODS = ('fir', 'iir')
+FILTER_PRECISIONS = ('float64', 'float32')
+
+
+@functools.lru_cache(maxsize=16)
+def design_filter(sfreq: float, low: float, high: float, method: str = 'fir'):
+    """FIR taps, or the IIR parameters (``sos``, ``padlen``), for a bandpass.
+
+    Identical to what raw.filter(low, high, method=method) designs. Cached
+    per process; the returned arrays are read-only.
+    """
+    if method == 'fir':
+        design = mne.filter.create_filter(None, sfreq, low, high, verbose=False)
+        design.flags.writeable = False
+        return design
+    if method == 'iir':
+        design = mne.filter.create_filter(None, sfreq, low, high, method='iir', verbose=False)
+        design['sos'].flags.writeable = False
+        return design
+    raise ValueError(f"Unknown filter method '{method}' (expected one of {FILTER_METHODS})")
+
+
+@functools.lru_cache(maxsize=16)
+def _fir_spectrum(sfreq: float, low: float, high: float, n_fft: int, precision: str):
+    """rfft of the cached FIR kernel at length ``n_fft``."""
+    spectrum = scipy.fft.rfft(design_filter(sfreq, low, high).astype(precision), n_fft)
+    spectrum.flags.writeable = False
+    return spectrum
+
+
+# ============================================================================
+# BATCHED FILTERING
+# ============================================================================
+#
+# All channels are filtered together on one 2-D array, in place.
+#
+# FIR runs as overlap-save FFT convolution over blocks of time: one rfft,
+# a multiply by the cached kernel spectrum and one irfft per block cover
+# every channel, and scipy.fft spreads those over ``workers`` threads. The
+# edges are padded like MNE's 'reflect_limited' mode, so the result equals
+# mne.filter.filter_data() to float64 rounding. Writing a block's output is
+# held back until the next block has been read, because each block reads
+# half a kernel past its own end; that keeps the filtering in place with no
+# second copy of the recording.
+#
+# float32 precision halves the FFT work and memory; its error (about 1e-7
+# of the signal range) is far below EEG noise.
+
+# FFT length per block as a multiple of the kernel length: longer blocks
+# waste less of each FFT on overlap, shorter ones keep temporaries small
+FIR_BLOCK_FACTOR = 8
+
+
+def fft_length(n_taps: int) -> int:
+    """FFT size of one overlap-save block for a kernel of ``n_taps``."""
+    return scipy.fft.next_fast_len(FIR_BLOCK_FACTOR * n_taps, real=True)
+
+
+def _padded_slice(data: np.ndarray, left: np.ndarray, right: np.ndarray,
+                  start: int, stop: int) -> np.ndarray:
+    """Columns ``start:stop`` of ``[left, data, right]`` without building it."""
+    n_edge, n_times = left.shape[1], data.shape[1]
+    pieces = []
+    if start < n_edge:
+        pieces.append(left[:, start:min(stop, n_edge)])
+    inner_start, inner_stop = max(start - n_edge, 0), min(stop - n_edge, n_times)
+    if inner_stop > inner_start:
+        pieces.append(data[:, inner_start:inner_stop])
+    if stop > n_edge + n_times:
+        pieces.append(right[:, max(start - n_edge - n_times, 0):stop - n_edge - n_times])
+    return pieces[0] if len(pieces) == 1 else np.concatenate(pieces, axis=1)
+
+
+def _fir_filter(data: np.ndarray, sfreq: float, low: float, high: float,
+                precision: str, workers: int):
+    """Zero-phase FIR filtering of the rows of ``data``, in place."""
+    n_taps = len(design_filter(sfreq, low, high))
+    n_edge, delay = n_taps - 1, (n_taps - 1) // 2
+    n_fft = fft_length(n_taps)
+    spectrum = _fir_spectrum(sfreq, low, high, n_fft, precision)
+    step = n_fft - n_edge
+
+    # Odd reflection about the end samples, taken before anything is written
+    left = 2 * data[:, :1] - data[:, n_edge:0:-1]
+    right = 2 * data[:, -1:] - data[:, -2:-n_edge - 2:-1]
+
+    pending = None
+    for start in range(0, data.shape[1], step):
+        stop = min(start + step, data.shape[1])
+        # Output sample i needs inputs i - delay .. i + delay, i.e. columns
+        # i + n_edge - delay .. i + n_edge + delay of the padded signal
+        segment = _padded_slice(data, left, right, start + n_edge - delay,
+                                stop + n_edge + delay)
+        block = scipy.fft.rfft(segment.astype(precision, copy=False), n_fft, axis=1,
+                               workers=workers)
+        if pending is not None:
+            data[:, pending[0]:pending[0] + pending[1].shape[1]] = pending[1]
+        block *= spectrum
+        filtered = scipy.fft.irfft(block, n_fft, axis=1, workers=workers)
+        pending = (start, filtered[:, n_edge:n_edge + stop - start])
+    data[:, pending[0]:pending[0] + pending[1].shape[1]] = pending[1]
+
+
+def _iir_filter(data: np.ndarray, sfreq: float, low: float, high: float):
+    """Zero-phase (forward-backward) IIR filtering of the rows of ``data``, in place."""
+    design = design_filter(sfreq, low, high, 'iir')
+    padlen = min(design['padlen'], data.shape[1] - 1)
+    # sosfilt needs writable coefficients; the cached ones are read-only
+    data[:] = scipy.signal.sosfiltfilt(design['sos'].copy(), data, axis=1, padlen=padlen)
+
+
+def filter_data(data: np.ndarray, sfreq: float, low: float, high: float,
+                method: str = 'fir', precision: str = 'float64', workers: int = 1) -> np.ndarray:
+    """Bandpass every row of a 2-D array in place and return it.
+
+    Matches ``mne.filter.filter_data(data, sfreq, low, high, method=method)``
+    (to float64 rounding with ``precision='float64'``). ``precision`` and
+    ``workers`` (threads sharing the FFTs) only apply to FIR.
+    """
+    if method not in FILTER_METHODS:
+        raise ValueError(f"Unknown filter method '{method}' (expected one of {FILTER_METHODS})")
+    if precision not in FILTER_PRECISIONS:
+        raise ValueError(f"Unknown filter precision '{precision}' "
+                         f"(expected one of {FILTER_PRECISIONS})")
+    if method == 'iir':
+        _iir_filter(data, sfreq, low, high)
+    elif data.shape[1] < len(design_filter(sfreq, low, high)):
+        # Shorter than the kernel: MNE pads differently, let it handle this
+        data[:] = mne.filter.filter_data(data, sfreq, low, high, verbose=False)
+    else:
+        _fir_filter(data, sfreq, low, high, precision, workers)
+    return data
+
+
+def filter_raw(raw, low: float, high: float, method: str = 'fir',
+               precision: str = 'float64', n_jobs: int = 1):
+    """Bandpass the EEG channels of a preloaded Raw in place, like raw.filter."""
+    picks = mne.pick_types(raw.info, eeg=True, exclude=[])
+    sfreq = raw.info['sfreq']
+    if np.array_equal(picks, np.arange(len(raw.ch_names))):
+        # raw._data is filtered directly; get_data() would return a copy
+        filter_data(raw._data, sfreq, low, high, method, precision, n_jobs)
+    else:
+        raw._data[picks] = filter_data(raw._data[picks], sfreq, low, high, method,
+                                       precision, n_jobs)
+
+    # Mirror the info bookkeeping raw.filter() does
+    with raw.info._unlock():
+        if raw.info['highpass'] is None or low > raw.info['highpass']:
+            raw.info['highpass'] = float(low)
+        if raw.info['lowpass'] is None or high < raw.info['lowpass']:
+            raw.info['lowpass'] = float(high)
+    return raw
@@ -8,6 +8,7 @@ import { CTASection } from './components/CTASection';
 import { Navigation } from './components/Navigation';
 import { FileUploadZone } from './components/FileUploadZone';
 import { ResultsDisplay } from './components/ResultsDisplay';
+import { ErpSeries } from './components/ErpReport';
 import { Brain, Activity, RotateCcw, ArrowLeft } from 'lucide-react';
 import { Button } from './components/ui/button';
 
@@ -18,6 +19,7 @@ export default function App() {
   const [videoFile, setVideoFile] = useState<File | null>(null);
   const [isAnalyzing, setIsAnalyzing] = useState(false);
   const [resultImage, setResultImage] = useState<string | null>(null);
+  const [resultSeries, setResultSeries] = useState<ErpSeries | null>(null);
   const [error, setError] = useState<string | null>(null);
 
   // Set up navigation functions on window object for child components
@@ -32,29 +34,52 @@ export default function App() {
     setIsAnalyzing(true);
     setError(null);
     setResultImage(null);
+    setResultSeries(null);
 
     try {
       const formData = new FormData();
       formData.append('cnt_file', cntFile);
       formData.append('exp_file', expFile);
+      // Ask for the ERP time series and plot them here instead of a server-rendered PNG
+      formData.append('format', 'json');
       if (videoFile) {
         formData.append('video_file', videoFile);
       }
 
-      const API_URL = (window.location.hostname === "localhost" && "http://localhost:8000/analyze") || "https://backend.onrender.com/analyze";
+      const API_BASE = (window.location.hostname === "localhost" && "http://localhost:8000") || "https://backend.onrender.com";
 
-      const response = await fetch(API_URL, {
+      const response = await fetch(`${API_BASE}/analyze`, {
         method: 'POST',
         body: formData,
       });
 
+      if (response.status === 503) {
+        throw new Error('The analysis server is busy. Please try again in a moment.');
+      }
       if (!response.ok) {
         throw new Error(`Analysis failed: ${response.statusText}`);
       }
 
-      const data = await response.json();
+      // The server queues the job; poll its status until it finishes
+      const { task_id } = await response.json();
+      let status = 'queued';
+      while (status === 'queued' || status === 'running') {
+        await new Promise((resolve) => setTimeout(resolve, 1000));
+        const statusResponse = await fetch(`${API_BASE}/status/${task_id}`);
+        if (!statusResponse.ok) {
+          throw new Error(`Analysis failed: ${statusResponse.statusText}`);
+        }
+        status = (await statusResponse.json()).status;
+      }
+
+      const data = await (await fetch(`${API_BASE}/results/${task_id}`)).json();
       
-      if (data.status === 'success' && data.image) {
+      if (data.error) {
+        throw new Error(data.error);
+      }
+      if (data.status === 'success' && data.series) {
+        setResultSeries(data.series);
+      } else if (data.status === 'success' && data.image) {
         setResultImage(data.image);
       } else {
         throw new Error('Invalid response from server');
@@ -71,6 +96,7 @@ export default function App() {
     setExpFile(null);
     setVideoFile(null);
     setResultImage(null);
+    setResultSeries(null);
     setError(null);
   };
 
@@ -154,7 +180,7 @@ export default function App() {
                 {isAnalyzing ? 'Analyzing Brainwaves...' : 'Start Free Analysis'}
               </Button>
               
-              {(resultImage || error) && !isAnalyzing && (
+              {(resultImage || resultSeries || error) && !isAnalyzing && (
                 <Button
                   onClick={handleReset}
                   variant="outline"
@@ -171,6 +197,7 @@ export default function App() {
           <ResultsDisplay 
             isAnalyzing={isAnalyzing} 
             resultImage={resultImage}
+            resultSeries={resultSeries}
             error={error}
           />
         </main>
@@ -0,0 +1,153 @@
+import {
+  Area,
+  CartesianGrid,
+  ComposedChart,
+  Legend,
+  Line,
+  ReferenceArea,
+  ReferenceLine,
+  ResponsiveContainer,
+  Tooltip,
+  XAxis,
+  YAxis,
+} from 'recharts';
+
+// Component measures of one condition on the section's channel
+export interface ComponentMeasures {
+  peak_latency_ms: number | null;
+  peak_amplitude_uv: number | null;
+  mean_amplitude_uv: number | null;
+  fractional_area_latency_ms: number | null;
+}
+
+export interface ErpSection {
+  comp: string;
+  ch: string;
+  title: string;
+  desc: string;
+  color: string;
+  window: [number, number];
+  p300: {
+    score: number;
+    latency_ms: number;
+    // Bootstrap confidence intervals and cluster test, when computed
+    confidence?: number;
+    latency_ci_ms?: [number, number];
+    score_ci?: [number, number];
+    cluster_p_value?: number;
+  } | null;
+  measures: {
+    window_ms: [number, number];
+    polarity: 'positive' | 'negative';
+    target: ComponentMeasures | null;
+    nontarget: ComponentMeasures | null;
+  } | null;
+  target_uv: number[] | null;
+  nontarget_uv: number[] | null;
+  // Standard error of each average (null below two epochs)
+  target_sem_uv: number[] | null;
+  nontarget_sem_uv: number[] | null;
+}
+
+// Shape of the "series" payload returned by /results for format=json
+export interface ErpSeries {
+  title: string;
+  summary: string;
+  times: number[];
+  sections: ErpSection[];
+  footer: string[];
+}
+
+function band(mean: number[] | null, sem: number[] | null, i: number) {
+  if (!mean || !sem) return undefined;
+  return [mean[i] - sem[i], mean[i] + sem[i]];
+}
+
+function formatMeasure(value: number | null, unit: string) {
+  if (value === null) return 'n/a';
+  return unit === 'ms' ? `${value.toFixed(0)} ms` : `${value.toFixed(1)} ${unit}`;
+}
+
+function sectionPoints(times: number[], section: ErpSection) {
+  return times.map((t, i) => ({
+    ms: Math.round(t * 1000),
+    target: section.target_uv?.[i],
+    nontarget: section.nontarget_uv?.[i],
+    targetBand: band(section.target_uv, section.target_sem_uv, i),
+    nontargetBand: band(section.nontarget_uv, section.nontarget_sem_uv, i),
+  }));
+}
+
+export function ErpReport({ series }: { series: ErpSeries }) {
+  return (
+    <div className="space-y-8">
+      <div>
+        <h3 style={{ color: 'var(--text-heading)' }}>{series.title}</h3>
+        <p className="text-sm mt-2" style={{ color: 'var(--text-muted)' }}>{series.summary}</p>
+      </div>
+
+      {series.sections.map((section) => (
+        <div key={section.comp} className="space-y-3">
+          <h4 style={{ color: 'var(--text-heading)' }}>{section.title}</h4>
+          <p className="text-sm" style={{ color: 'var(--text-muted)' }}>{section.desc}</p>
+
+          {section.target_uv ? (
+            <ResponsiveContainer width="100%" height={280}>
+              <ComposedChart data={sectionPoints(series.times, section)}>
+                <CartesianGrid strokeDasharray="3 3" />
+                <XAxis dataKey="ms" type="number" domain={['dataMin', 'dataMax']} unit=" ms" />
+                <YAxis unit=" µV" width={70} />
+                <Tooltip />
+                <Legend />
+                <ReferenceArea
+                  x1={Math.round(section.window[0] * 1000)}
+                  x2={Math.round(section.window[1] * 1000)}
+                  fill={section.color}
+                  fillOpacity={0.2}
+                />
+                <ReferenceLine x={0} stroke="var(--text-muted)" />
+                <Area dataKey="targetBand" stroke="none" fill="#d62728" fillOpacity={0.2} legendType="none" tooltipType="none" isAnimationActive={false} />
+                <Area dataKey="nontargetBand" stroke="none" fill="#1f77b4" fillOpacity={0.2} legendType="none" tooltipType="none" isAnimationActive={false} />
+                <Line dataKey="target" name="Target" stroke="#d62728" dot={false} isAnimationActive={false} />
+                <Line dataKey="nontarget" name="Non-Target" stroke="#1f77b4" dot={false} isAnimationActive={false} />
+              </ComposedChart>
+            </ResponsiveContainer>
+          ) : (
+            <p className="text-sm" style={{ color: 'var(--error)' }}>Channel {section.ch} not found</p>
+          )}
+
+          {section.measures?.target && section.measures.nontarget && (
+            <p className="text-sm" style={{ color: 'var(--text-muted)' }}>
+              {section.comp} peak: Target {formatMeasure(section.measures.target.peak_amplitude_uv, 'µV')} at{' '}
+              {formatMeasure(section.measures.target.peak_latency_ms, 'ms')}, Non-Target{' '}
+              {formatMeasure(section.measures.nontarget.peak_amplitude_uv, 'µV')} at{' '}
+              {formatMeasure(section.measures.nontarget.peak_latency_ms, 'ms')}
+            </p>
+          )}
+
+          {section.p300 && (
+            <p className="text-sm" style={{ color: 'var(--text-heading)' }}>
+              Neural Confidence Score: {section.p300.score.toFixed(0)}% (peak at {section.p300.latency_ms.toFixed(0)} ms)
+              {section.p300.latency_ci_ms && section.p300.score_ci && section.p300.confidence && (
+                <>
+                  {' '}— {(section.p300.confidence * 100).toFixed(0)}% CI {section.p300.score_ci[0].toFixed(0)}–
+                  {section.p300.score_ci[1].toFixed(0)}%, {section.p300.latency_ci_ms[0].toFixed(0)}–
+                  {section.p300.latency_ci_ms[1].toFixed(0)} ms
+                </>
+              )}
+              {section.p300.cluster_p_value !== undefined && (
+                <> · Target vs Non-Target p = {section.p300.cluster_p_value.toFixed(3)}</>
+              )}
+            </p>
+          )}
+        </div>
+      ))}
+
+      <div className="pt-4 border-t text-sm" style={{ borderColor: 'var(--border)', color: 'var(--text-muted)' }}>
+        {series.footer.map((line) => (
+          <p key={line}>{line}</p>
+        ))}
+      </div>
+    </div>
+  );
+}
@@ -1,13 +1,16 @@
 import { Loader2, BarChart3, AlertCircle } from 'lucide-react';
+import { ErpReport, ErpSeries } from './ErpReport';
 
 interface ResultsDisplayProps {
   isAnalyzing: boolean;
   resultImage: string | null;
+  resultSeries?: ErpSeries | null;
+  imageType?: string;
   error: string | null;
 }
 
-export function ResultsDisplay({ isAnalyzing, resultImage, error }: ResultsDisplayProps) {
-  if (!isAnalyzing && !resultImage && !error) {
+export function ResultsDisplay({ isAnalyzing, resultImage, resultSeries = null, imageType = 'image/png', error }: ResultsDisplayProps) {
+  if (!isAnalyzing && !resultImage && !resultSeries && !error) {
     return null;
   }
 
@@ -46,8 +49,8 @@ export function ResultsDisplay({ isAnalyzing, resultImage, error }: ResultsDispl
           </div>
         )}
 
-        {/* Success State with Result Image */}
-        {resultImage && !isAnalyzing && (
+        {/* Success State with Result Image or Chart */}
+        {(resultImage || resultSeries) && !isAnalyzing && (
           <div className="space-y-4">
             <div className="flex items-center gap-2 pb-4 border-b" style={{
               borderColor: 'var(--border)'
@@ -57,14 +60,18 @@ export function ResultsDisplay({ isAnalyzing, resultImage, error }: ResultsDispl
               }} />
               <p className="text-sm" style={{ color: 'var(--success)' }}>Analysis Complete</p>
             </div>
-            <div className="flex justify-center">
-              <img 
-                src={`data:image/png;base64,${resultImage}`}
-                alt="EEG Cognitive Load Analysis Results"
-                className="max-w-full h-auto rounded-lg border"
-                style={{ borderColor: 'var(--border-strong)' }}
-              />
-            </div>
+            {resultSeries ? (
+              <ErpReport series={resultSeries} />
+            ) : (
+              <div className="flex justify-center">
+                <img 
+                  src={`data:${imageType};base64,${resultImage}`}
+                  alt="EEG Cognitive Load Analysis Results"
+                  className="max-w-full h-auto rounded-lg border"
+                  style={{ borderColor: 'var(--border-strong)' }}
+                />
+              </div>
+            )}
           </div>
         )}
       </div>
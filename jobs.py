@@ -0,0 +1,739 @@
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+import traceback
+import uuid
+from collections import deque
+from multiprocessing.connection import wait
+
+# ============================================================================
+# JOB RUNNER
+# ============================================================================
+#
+# Analyses run in supervised worker processes so a long recording never ties
+# up a web worker, and a job that misbehaves never takes the API with it.
+# Each worker has its own pipe to the supervisor thread in the API process,
+# carrying jobs one way and stage changes and results the other, so killing
+# a worker cannot break another worker's channel.
+#
+# The supervisor owns every worker and enforces, per job:
+# - a memory ceiling: the resident memory of the worker and its helper
+#   processes (one process group) is sampled every ``poll_interval``; a job
+#   above ``max_rss`` is killed and fails with reason 'memory_limit'
+# - a hard timeout: a job running longer than ``timeout`` seconds is killed
+#   and fails with reason 'timeout'
+# Both apply from the moment the worker reports the job running, so the
+# warm-up of a worker that takes a job before it is warm is not charged to it.
+# The warm-up has its own deadline, ``warmup_timeout``, and the same memory
+# ceiling; a worker past either is killed and its job, if it already took
+# one, fails with reason 'warmup_timeout' or 'memory_limit'.
+# Killing a worker fails only its own job; a fresh worker replaces it.
+#
+# Workers are recycled (stopped and later restarted) after
+# ``worker_max_jobs`` jobs or when one holds more than ``recycle_rss`` bytes
+# once its job is done, which returns fragmented heaps and leaked figures
+# to the system.
+#
+# A queued job is only dispatched when its ceiling fits in the memory
+# headroom: the available memory (cgroup limit or MemAvailable) minus what
+# the running jobs may still grow into before reaching their own ceilings.
+# With nothing running the next job always starts.
+#
+# With ``prestart`` the runner keeps ``max_workers`` workers alive, starting
+# replacements for recycled or killed ones right away. Each new worker first
+# runs ``warmup`` (imports, caches, a small analysis) and reports its timings;
+# jobs go to warmed-up idle workers first. ready() turns true once the first
+# set of workers has warmed up. A worker whose warm-up fails (reports an
+# error, hangs, or exits) is not warm: it is replaced so the next one tries
+# again, up to ``warmup_retries`` failures in a row. After that the workers
+# stay cold (they still run jobs), new ones start without a warm-up, and
+# ready() stays false.
+
+logger = logging.getLogger('eeg_analyzer.jobs')
+
+_conn = None
+_send_lock = threading.Lock()
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+
+class QueueFullError(Exception):
+    """Raised when the runner already holds as many jobs as it accepts."""
+
+
+def _read_int(path: str):
+    try:
+        with open(path) as f:
+            return int(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _read_stat(path: str, key: str):
+    try:
+        with open(path) as f:
+            for line in f:
+                name, value = line.split()[:2]
+                if name == key:
+                    return int(value)
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def available_memory():
+    """Bytes that can still be allocated before the OOM killer steps in.
+
+    The smaller of the cgroup's remaining limit (v2 or v1; reclaimable page
+    cache counts as free) and the system's MemAvailable. None if unknown.
+    """
+    candidates = []
+    mem_available = _read_stat('/proc/meminfo', 'MemAvailable:')
+    if mem_available is not None:
+        candidates.append(mem_available * 1024)
+
+    for limit_file, usage_file, stat_file, inactive_key in (
+            ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory.current',
+             '/sys/fs/cgroup/memory.stat', 'inactive_file'),
+            ('/sys/fs/cgroup/memory/memory.limit_in_bytes',
+             '/sys/fs/cgroup/memory/memory.usage_in_bytes',
+             '/sys/fs/cgroup/memory/memory.stat', 'total_inactive_file')):
+        limit = _read_int(limit_file)
+        usage = _read_int(usage_file)
+        # 'max' (v2) fails to parse; v1 reports "unlimited" as a huge number
+        if limit is None or usage is None or limit >= 1 << 60:
+            continue
+        usage -= _read_stat(stat_file, inactive_key) or 0
+        candidates.append(max(0, limit - usage))
+        break
+    return min(candidates) if candidates else None
+
+
+def process_group_rss() -> dict:
+    """Resident bytes per process group id, from one pass over /proc."""
+    totals = {}
+    try:
+        pids = [name for name in os.listdir('/proc') if name.isdigit()]
+    except OSError:
+        return totals
+    for pid in pids:
+        try:
+            with open(f'/proc/{pid}/stat') as f:
+                # The command name may contain spaces; fields follow its ')'
+                fields = f.read().rsplit(')', 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        pgrp, rss_pages = int(fields[2]), int(fields[21])
+        totals[pgrp] = totals.get(pgrp, 0) + rss_pages * _PAGE_SIZE
+    return totals
+
+
+def _send(message):
+    # Jobs may report progress from several threads
+    with _send_lock:
+        _conn.send(message)
+
+
+def _worker_main(conn, worker_env, warmup):
+    """Worker process: warm up, then run jobs received on ``conn`` until told to stop.
+
+    Applies the worker environment before any job module is imported, so
+    variables such as OMP_NUM_THREADS take effect for numerical libraries.
+    """
+    global _conn
+    # Own process group, so the supervisor can stop helper processes too
+    os.setpgrp()
+    os.environ.update(worker_env)
+    _conn = conn
+
+    if warmup is not None:
+        start = time.perf_counter()
+        try:
+            info, error = warmup(), None
+        except Exception as e:
+            info, error = None, f"{type(e).__name__}: {e}"
+        try:
+            _send(('ready', {'seconds': round(time.perf_counter() - start, 3),
+                             'steps': info, 'error': error}))
+        except (EOFError, OSError):
+            return
+
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, OSError):
+            return
+        if job is None:
+            return
+        task_id, func, args = job
+        try:
+            message = ('done', _run_job(task_id, func, args))
+        except BaseException as e:
+            message = ('failed', str(e), getattr(e, 'details', None) or traceback.format_exc())
+        try:
+            _send(message)
+        except (EOFError, OSError):
+            return
+        except Exception as e:
+            _send(('failed', f"Job result could not be returned: {e}", traceback.format_exc()))
+
+
+def _run_job(task_id: str, func, args: tuple):
+    """Execute a job inside a worker, reporting each stage to the parent."""
+    def progress(stage: str):
+        _send(('progress', stage, time.time()))
+
+    progress('running')
+    return func(*args, progress=progress)
+
+
+class _Worker:
+    """A worker process as seen by the supervisor."""
+
+    def __init__(self, ctx, worker_env: dict, warmup=None):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child_conn, worker_env, warmup))
+        self.process.start()
+        child_conn.close()
+        self.warm = warmup is None
+        # Until the worker reports its warm-up
+        self.warming = warmup is not None
+        self.spawned_at = time.monotonic()
+        self.task_id = None
+        self.started_at = None
+        self.jobs_done = 0
+        self.rss = 0
+        self.peak_rss = 0
+
+    def kill(self):
+        """Kill the worker and any helper processes it started."""
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            self.process.kill()
+        self.process.join(5)
+        self.conn.close()
+
+    def stop(self):
+        """Ask an idle worker to exit."""
+        try:
+            self.conn.send(None)
+        except (EOFError, OSError):
+            pass
+
+
+class JobRunner:
+    """Supervised worker-process job runner with per-task status tracking."""
+
+    def __init__(self, max_workers: int, queue_depth: int, stages,
+                 result_ttl: float = 3600, worker_env: dict = None,
+                 max_rss: int = 0, timeout: float = 0, worker_max_jobs: int = 0,
+                 recycle_rss: int = 0, poll_interval: float = 0.5,
+                 prestart: bool = False, warmup=None, warmup_retries: int = 2,
+                 warmup_timeout: float = 0):
+        self.max_workers = max_workers
+        self.queue_depth = queue_depth
+        self.stages = list(stages)
+        self.result_ttl = result_ttl
+        # 0 disables the respective limit
+        self.max_rss = max_rss
+        self.timeout = timeout
+        self.worker_max_jobs = worker_max_jobs
+        self.recycle_rss = recycle_rss
+        self.poll_interval = poll_interval
+        self.prestart = prestart
+        # Picklable callable run by every new worker before its first job
+        self.warmup = warmup
+        self.warmup_retries = warmup_retries
+        self.warmup_timeout = warmup_timeout
+
+        self._ctx = multiprocessing.get_context('spawn')
+        self._worker_env = dict(worker_env or {})
+        self._workers = []
+        self._retiring = []
+        self._pending = deque()
+        self._tasks = {}
+        self._lock = threading.Lock()
+        self._stopping = False
+        # Set once the first set of prestarted workers has warmed up
+        self._warmed = not prestart
+        self._last_warmup = None
+        self._warmup_failures = 0
+        self._memory = {'available_bytes': None, 'reserved_bytes': 0, 'headroom_bytes': None}
+        self._events = {'recycled': dict.fromkeys(('max_jobs', 'max_rss'), 0),
+                        'killed': dict.fromkeys(('memory_limit', 'timeout',
+                                                 'warmup_timeout'), 0),
+                        # Jobs lost to a worker that died on its own
+                        'exited': 0,
+                        'warmup_failed': 0}
+        self._wake_reader, self._wake_writer = self._ctx.Pipe(duplex=False)
+        self._supervisor = threading.Thread(target=self._supervise, daemon=True)
+        self._supervisor.start()
+        if prestart:
+            self._wake()
+
+    @property
+    def capacity(self) -> int:
+        return self.max_workers + self.queue_depth
+
+    def active_count(self) -> int:
+        with self._lock:
+            return sum(1 for t in self._tasks.values()
+                       if t['status'] in ('queued', 'running'))
+
+    def counts(self) -> dict:
+        """Number of tracked tasks per status."""
+        counts = dict.fromkeys(('queued', 'running', 'done', 'failed'), 0)
+        with self._lock:
+            for task in self._tasks.values():
+                counts[task['status']] += 1
+        return counts
+
+    def has_capacity(self) -> bool:
+        return self.active_count() < self.capacity
+
+    def ready(self) -> bool:
+        """Whether the prestarted workers have finished their first warm-up."""
+        return self._warmed
+
+    def worker_stats(self) -> dict:
+        """Workers, their memory, the memory headroom and recycling counts."""
+        with self._lock:
+            return {
+                'workers': len(self._workers),
+                'busy': sum(1 for w in self._workers if w.task_id is not None),
+                'warm': sum(1 for w in self._workers if w.warm),
+                'last_warmup': self._last_warmup,
+                'rss_bytes': sum(w.rss for w in self._workers),
+                'memory': dict(self._memory),
+                'recycled': dict(self._events['recycled']),
+                'killed': dict(self._events['killed']),
+                'exited': self._events['exited'],
+                'warmup_failed': self._events['warmup_failed']
+            }
+
+    def submit(self, func, *args, on_done=None) -> str:
+        """Queue ``func(*args, progress=...)`` and return its task id.
+
+        ``on_done``, if given, is called with a copy of the task record once
+        the job has finished or failed.
+        """
+        self._prune()
+        task_id = uuid.uuid4().hex
+
+        with self._lock:
+            active = sum(1 for t in self._tasks.values()
+                         if t['status'] in ('queued', 'running'))
+            if active >= self.capacity:
+                raise QueueFullError(
+                    f"Analysis queue is full ({active}/{self.capacity} jobs)"
+                )
+            self._tasks[task_id] = {
+                'status': 'queued',
+                'stage': 'queued',
+                'submitted_at': time.time(),
+                'started_at': None,
+                'finished_at': None,
+                'result': None,
+                'error': None,
+                'failure': None,
+                'on_done': on_done,
+                'job': (func, args)
+            }
+            self._pending.append(task_id)
+
+        self._wake()
+        return task_id
+
+    def add_completed(self, result) -> str:
+        """Register an already finished task (e.g. served from cache)."""
+        self._prune()
+        task_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._tasks[task_id] = {
+                'status': 'done',
+                'stage': 'done',
+                'submitted_at': now,
+                'started_at': now,
+                'finished_at': now,
+                'result': result,
+                'error': None,
+                'failure': None,
+                'on_done': None
+            }
+        return task_id
+
+    def status(self, task_id: str):
+        """Return a JSON-serialisable status snapshot, or None if unknown."""
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if task is None:
+                return None
+            task = dict(task)
+
+        stage = task['stage']
+        if task['status'] == 'done':
+            progress = 100.0
+        elif stage in self.stages:
+            progress = 100.0 * self.stages.index(stage) / len(self.stages)
+        else:
+            progress = 0.0
+
+        return {
+            'task_id': task_id,
+            'status': task['status'],
+            'stage': stage,
+            'stage_index': self.stages.index(stage) + 1 if stage in self.stages else 0,
+            'total_stages': len(self.stages),
+            'progress': round(progress, 1),
+            'submitted_at': task['submitted_at'],
+            'started_at': task['started_at'],
+            'finished_at': task['finished_at'],
+            'error': task['error'],
+            'failure': task['failure']
+        }
+
+    def result(self, task_id: str):
+        """Return the raw task record (status, result, error), or None."""
+        with self._lock:
+            task = self._tasks.get(task_id)
+            return dict(task) if task is not None else None
+
+    def shutdown(self):
+        """Stop the workers; queued and running jobs fail as cancelled."""
+        with self._lock:
+            self._stopping = True
+        self._wake()
+        self._supervisor.join(10)
+
+        for worker in self._workers:
+            if worker.task_id is not None:
+                worker.kill()
+                self._finish(worker.task_id, 'failed', error='Task was cancelled',
+                             failure={'reason': 'cancelled'})
+            else:
+                worker.stop()
+        for worker in self._workers + self._retiring:
+            worker.process.join(5)
+            if worker.process.is_alive():
+                worker.kill()
+        self._workers, self._retiring = [], []
+        while self._pending:
+            self._finish(self._pending.popleft(), 'failed', error='Task was cancelled',
+                         failure={'reason': 'cancelled'})
+
+    def _wake(self):
+        """Make the supervisor look at the queue now instead of at its next poll."""
+        try:
+            self._wake_writer.send(None)
+        except OSError:
+            pass
+
+    def _finish(self, task_id: str, status: str, result=None, error: str = None,
+                details: str = None, failure: dict = None):
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if task is None or task['status'] in ('done', 'failed'):
+                return
+            task['finished_at'] = time.time()
+            task['status'] = status
+            task.pop('job', None)
+            if status == 'done':
+                task['stage'] = 'done'
+                task['result'] = result
+            else:
+                task['error'] = error
+                task['details'] = details
+                task['failure'] = failure
+            on_done = task['on_done']
+            snapshot = dict(task)
+
+        if on_done is not None:
+            on_done(snapshot)
+
+    def _supervise(self):
+        """Collect results, enforce the limits and dispatch queued jobs."""
+        while True:
+            workers = self._workers + self._retiring
+            handles = [self._wake_reader]
+            for worker in workers:
+                handles += [worker.conn, worker.process.sentinel]
+            wait(handles, timeout=self.poll_interval)
+            while self._wake_reader.poll():
+                self._wake_reader.recv()
+            if self._stopping:
+                return
+
+            try:
+                self._collect()
+                self._enforce_limits()
+                self._replenish()
+                self._dispatch()
+            except Exception:
+                logger.exception("Job supervisor failed")
+
+    def _collect(self):
+        """Finish jobs whose worker answered, or whose worker died."""
+        for worker in list(self._workers):
+            message = None
+            replaced = False
+            try:
+                while worker.conn.poll():
+                    message = worker.conn.recv()
+                    if message[0] == 'progress':
+                        if message[1] == 'running':
+                            self._started(worker)
+                        self._progress(worker.task_id, *message[1:])
+                    elif message[0] == 'ready':
+                        replaced = not self._warmed_up(worker, message[1])
+                        if replaced:
+                            break
+                    else:
+                        break
+                    message = None
+            except (EOFError, OSError):
+                pass
+            if replaced:
+                continue
+
+            if message is not None:
+                task_id, worker.task_id = worker.task_id, None
+                worker.jobs_done += 1
+                if message[0] == 'done':
+                    self._finish(task_id, 'done', result=message[1])
+                else:
+                    self._finish(task_id, 'failed', error=message[1], details=message[2])
+                self._recycle_if_due(worker)
+            elif not worker.process.is_alive():
+                self._remove(worker)
+                worker.kill()
+                if worker.warming:
+                    error = f"Worker exited during warm-up (exit code {worker.process.exitcode})"
+                    logger.warning("Worker %d: %s", worker.process.pid, error)
+                    self._warmup_failed(worker, error)
+                if worker.task_id is not None:
+                    with self._lock:
+                        self._events['exited'] += 1
+                    exitcode = worker.process.exitcode
+                    logger.warning("Worker %d exited with code %s", worker.process.pid, exitcode)
+                    self._finish(worker.task_id, 'failed',
+                                 error=f"Analysis worker exited unexpectedly (exit code {exitcode})",
+                                 failure={'reason': 'worker_exited', 'exit_code': exitcode})
+
+        for worker in list(self._retiring):
+            if not worker.process.is_alive():
+                worker.process.join()
+                worker.conn.close()
+                self._retiring.remove(worker)
+
+    def _started(self, worker: _Worker):
+        """Start the job's clock and memory watch once the worker begins it."""
+        worker.started_at = time.monotonic()
+        worker.peak_rss = worker.rss
+
+    def _warmed_up(self, worker: _Worker, info: dict) -> bool:
+        """Record a worker's warm-up; False if it failed and the worker is being replaced."""
+        worker.warming = False
+        if not info['error']:
+            with self._lock:
+                self._last_warmup = info
+                worker.warm = True
+                self._warmup_failures = 0
+                if sum(1 for w in self._workers if w.warm) >= self.max_workers:
+                    self._warmed = True
+            return True
+        retry = self._warmup_failed(worker, info['error'], info)
+
+        # An idle worker is replaced; one already given a job runs it cold
+        replace = retry and worker.task_id is None
+        logger.warning("Worker %d warm-up failed%s: %s", worker.process.pid,
+                       " (replacing it)" if replace else "", info['error'])
+        if replace:
+            self._remove(worker)
+            worker.stop()
+            self._retiring.append(worker)
+        return not replace
+
+    def _warmup_failed(self, worker: _Worker, error: str, info: dict = None) -> bool:
+        """Count a failed warm-up; True while another worker may try again."""
+        worker.warming = False
+        if info is None:
+            info = {'seconds': round(time.monotonic() - worker.spawned_at, 3),
+                    'steps': None, 'error': error}
+        with self._lock:
+            self._last_warmup = info
+            self._events['warmup_failed'] += 1
+            self._warmup_failures += 1
+            return self._warmup_failures <= self.warmup_retries
+
+    def _spawn(self) -> _Worker:
+        """Start a worker, without the warm-up once it has failed too often in a row."""
+        if self.warmup is not None and self._warmup_failures > self.warmup_retries:
+            worker = _Worker(self._ctx, self._worker_env)
+            worker.warm = False
+        else:
+            worker = _Worker(self._ctx, self._worker_env, self.warmup)
+        self._add(worker)
+        return worker
+
+    def _replenish(self):
+        """Keep ``max_workers`` workers running when prestarting."""
+        while self.prestart and not self._stopping and len(self._workers) < self.max_workers:
+            self._spawn()
+
+    def _recycle_if_due(self, worker: _Worker):
+        rss = process_group_rss().get(worker.process.pid, 0)
+        worker.rss = rss
+        reason = None
+        if self.worker_max_jobs and worker.jobs_done >= self.worker_max_jobs:
+            reason = 'max_jobs'
+        elif self.recycle_rss and rss > self.recycle_rss:
+            reason = 'max_rss'
+        if reason is None:
+            return
+        with self._lock:
+            self._events['recycled'][reason] += 1
+        self._remove(worker)
+        worker.stop()
+        self._retiring.append(worker)
+
+    def _enforce_limits(self):
+        """Sample memory, kill jobs over their ceiling or past the timeout."""
+        rss = process_group_rss()
+        now = time.monotonic()
+        for worker in list(self._workers):
+            worker.rss = rss.get(worker.process.pid, 0)
+            if worker.warming:
+                self._check_warmup(worker, now)
+                continue
+            if worker.task_id is None or worker.started_at is None:
+                continue
+            worker.peak_rss = max(worker.peak_rss, worker.rss)
+
+            failure = None
+            if self.max_rss and worker.rss > self.max_rss:
+                failure = {'reason': 'memory_limit', 'limit_bytes': self.max_rss,
+                           'rss_bytes': worker.rss}
+                error = (f"Analysis exceeded its memory limit "
+                         f"({worker.rss / 2**20:.0f} MB > {self.max_rss / 2**20:.0f} MB)")
+            elif self.timeout and now - worker.started_at > self.timeout:
+                failure = {'reason': 'timeout', 'timeout_s': self.timeout,
+                           'peak_rss_bytes': worker.peak_rss}
+                error = f"Analysis exceeded its time limit ({self.timeout:.0f} s)"
+            if failure is None:
+                continue
+
+            logger.warning("Stopping worker %d: %s", worker.process.pid, error)
+            self._remove(worker)
+            worker.kill()
+            with self._lock:
+                self._events['killed'][failure['reason']] += 1
+            self._finish(worker.task_id, 'failed', error=error, failure=failure)
+        # Keep the reported headroom current even with nothing to dispatch
+        self._headroom()
+
+    def _check_warmup(self, worker: _Worker, now: float):
+        """Kill a worker whose warm-up runs past its deadline or memory ceiling."""
+        failure = None
+        if self.warmup_timeout and now - worker.spawned_at > self.warmup_timeout:
+            failure = {'reason': 'warmup_timeout', 'timeout_s': self.warmup_timeout}
+            error = f"Worker warm-up exceeded its time limit ({self.warmup_timeout:.0f} s)"
+        elif self.max_rss and worker.rss > self.max_rss:
+            failure = {'reason': 'memory_limit', 'limit_bytes': self.max_rss,
+                       'rss_bytes': worker.rss, 'during': 'warmup'}
+            error = (f"Worker warm-up exceeded the memory limit "
+                     f"({worker.rss / 2**20:.0f} MB > {self.max_rss / 2**20:.0f} MB)")
+        if failure is None:
+            return
+
+        logger.warning("Stopping worker %d: %s", worker.process.pid, error)
+        self._remove(worker)
+        worker.kill()
+        self._warmup_failed(worker, error)
+        # A job waiting for this worker fails instead of waiting forever
+        if worker.task_id is not None:
+            with self._lock:
+                self._events['killed'][failure['reason']] += 1
+            self._finish(worker.task_id, 'failed', error=error, failure=failure)
+
+    def _headroom(self):
+        """Memory left for a new job, after what running jobs may still claim."""
+        available = available_memory()
+        reserved = 0
+        if self.max_rss:
+            reserved = sum(max(0, self.max_rss - w.rss)
+                           for w in self._workers if w.task_id is not None)
+        headroom = None if available is None else available - reserved
+        with self._lock:
+            self._memory = {'available_bytes': available, 'reserved_bytes': reserved,
+                            'headroom_bytes': headroom}
+        return headroom
+
+    def _dispatch(self):
+        """Hand queued jobs to idle workers while they fit in memory."""
+        while self._pending and not self._stopping:
+            busy = sum(1 for w in self._workers if w.task_id is not None)
+            if busy >= self.max_workers:
+                return
+            headroom = self._headroom()
+            if busy and self.max_rss and headroom is not None and headroom < self.max_rss:
+                return
+
+            with self._lock:
+                task_id = self._pending.popleft()
+                task = self._tasks.get(task_id)
+                job = task.pop('job', None) if task is not None else None
+            if job is None:
+                continue
+
+            # A worker still warming up takes the job after its warm-up
+            idle = sorted((w for w in self._workers if w.task_id is None),
+                          key=lambda w: not w.warm)
+            worker = idle[0] if idle else None
+            if worker is None:
+                worker = self._spawn()
+            try:
+                worker.conn.send((task_id, job[0], job[1]))
+            except (EOFError, OSError):
+                # The worker died while idle; the next pass replaces it
+                with self._lock:
+                    task['job'] = job
+                    self._pending.appendleft(task_id)
+                return
+            except Exception as e:
+                self._finish(task_id, 'failed', error=f"Job could not be started: {e}")
+                continue
+            worker.task_id = task_id
+            # Set by _started() when the worker reports the job running
+            worker.started_at = None
+
+    def _add(self, worker: _Worker):
+        with self._lock:
+            self._workers.append(worker)
+
+    def _remove(self, worker: _Worker):
+        with self._lock:
+            self._workers.remove(worker)
+
+    def _progress(self, task_id: str, stage: str, timestamp: float):
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if task is None or task['status'] in ('done', 'failed'):
+                return
+            if stage == 'running':
+                task['status'] = 'running'
+                task['started_at'] = timestamp
+            task['stage'] = stage
+
+    def _prune(self):
+        """Drop finished tasks older than ``result_ttl`` seconds."""
+        cutoff = time.time() - self.result_ttl
+        with self._lock:
+            expired = [tid for tid, t in self._tasks.items()
+                       if t['finished_at'] is not None and t['finished_at'] < cutoff]
+            for tid in expired:
+                del self._tasks[tid]
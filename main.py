@@ -1,21 +1,70 @@
-import matplotlib
-matplotlib.use('Agg')
+import os
+# Set before anything imports matplotlib; workers inherit it
+os.environ['MPLBACKEND'] = 'Agg'
+
+# ============================================================================
+# IMPORTS
+# ============================================================================
+#
+# Only the web stack, numpy and the pipeline modules load with this module, so
+# the API answers health checks in under a second. mne and scipy
+# load their submodules on first use, and matplotlib, PIL and the .cnt reader
+# (which subclasses mne's Raw) are imported where they are used. Warm-up
+# (see WARM-UP below) loads all of them in the background.
 
 import uvicorn
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 import mne
-import matplotlib.pyplot as plt
-import matplotlib.gridspec as gridspec
 import numpy as np
-from scipy.signal import find_peaks
 import tempfile
-import os
+import sys
 import base64
 import textwrap
 from io import BytesIO
-import shutil
 import gc
+import importlib
+import hashlib
+import json
+import logging
+import re
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+
+import cohort
+import metrics
+import realtime
+import reliability
+import trialquery
+from averaging import CONDITIONS, EvokedAccumulator
+from cache import ResultCache, StageCache, canonical_digest, combine_digests
+from epochstore import EpochStore
+from filtering import filter_raw
+from jobs import JobRunner, QueueFullError
+from metrics import StageTimings
+from peaks import measure_components, peak_index
+from rejection import epoch_features, reject_epochs
+from starlette.concurrency import run_in_threadpool
+from streaming import stream_epochs
+from synthetic import make_recording
+from uploads import (UploadRejected, check_cnt_head, check_text_head, file_rule,
+                     purge_stale_requests, receive_uploads, remove_request_dirs,
+                     spool_usage, CNT_HEADER_BYTES)
+
+# Service messages (workers import this module too, so they log the same
+# way); jobs.py logs under 'eeg_analyzer.jobs'
+logger = logging.getLogger('eeg_analyzer')
+if not logger.handlers:
+    _log_handler = logging.StreamHandler()
+    _log_handler.setFormatter(
+        logging.Formatter('%(asctime)s %(levelname)s %(name)s[%(process)d]: %(message)s')
+    )
+    logger.addHandler(_log_handler)
+    logger.setLevel(os.environ.get('EEG_LOG_LEVEL', 'INFO').upper())
 
 # ============================================================================
 # CONFIGURATION
@@ -25,7 +74,13 @@ CONFIG = {
     'filter': {
         'low': 0.5,
         'high': 30.0,
-        'n_jobs': 1
+        # 'fir' (MNE's default design) or 'iir' (4th-order Butterworth);
+        # both are applied zero-phase, see filtering.py
+        'method': os.environ.get('EEG_FILTER_METHOD', 'fir'),
+        # 'float32' roughly halves FIR filtering time
+        'precision': os.environ.get('EEG_FILTER_PRECISION', 'float64'),
+        # 'auto' uses this job's share of CONFIG['cpu']['budget']
+        'n_jobs': 'auto'
     },
     'epoch': {
         'tmin': -0.2,
@@ -33,7 +88,12 @@ CONFIG = {
         'baseline': (None, 0)
     },
     'rejection': {
-        'eeg': 100e-6
+        # Maximum peak-to-peak amplitude per channel (V)
+        'eeg': 100e-6,
+        # Minimum peak-to-peak amplitude (V), catches disconnected electrodes
+        'flat': None,
+        # Maximum sample-to-sample step (V/s; 50 µV/ms is 0.05)
+        'gradient': None
     },
     'p300': {
         'search_window': (0.25, 0.6),
@@ -41,9 +101,28 @@ CONFIG = {
         'window_duration': 0.2,
         'peak_prominence': 0.5e-6
     },
+    'statistics': {
+        # Bootstrap resamples of the Target epochs for P300 latency/score
+        # confidence intervals (0 disables)
+        'bootstrap_resamples': 2000,
+        'confidence': 0.95,
+        # Target vs Non-Target cluster permutation test in the P300 search
+        # window (0 disables)
+        'permutations': 1000,
+        # Two-sided p-value of the t-test that forms clusters
+        'cluster_alpha': 0.05,
+        'seed': 0,
+        # 'auto' uses this job's share of CONFIG['cpu']['budget']
+        'n_jobs': 'auto'
+    },
+    'components': {
+        # Fraction of the window's area that sets the fractional area latency
+        'fractional_area': 0.5
+    },
     'figure': {
         'size': (12, 32),
         'dpi': 150,
+        'preview_dpi': 50,
         'hspace': 0.75
     },
     'text': {
@@ -53,15 +132,113 @@ CONFIG = {
     'thresholds': {
         'min_trial_count': 10,
         'low_trial_warning': 15
+    },
+    'channels': {
+        # 'report' loads only the plotted channels plus rejection_channels;
+        # 'full' processes the whole montage
+        'mode': os.environ.get('EEG_CHANNEL_MODE', 'report'),
+        'rejection_channels': ['FP1', 'FP2']
+    },
+    'streaming': {
+        # Filter and epoch block by block instead of preloading the recording
+        'enabled': os.environ.get('EEG_STREAMING', '0') == '1',
+        'chunk_seconds': 10.0
+    },
+    'cpu': {
+        # Cores shared by all concurrent analyses
+        'budget': int(os.environ.get('EEG_CPU_BUDGET', os.cpu_count() or 1))
+    },
+    'jobs': {
+        'max_workers': int(os.environ.get('EEG_MAX_WORKERS', 2)),
+        'queue_depth': int(os.environ.get('EEG_QUEUE_DEPTH', 8)),
+        'result_ttl': int(os.environ.get('EEG_RESULT_TTL', 3600)),
+        # Per-job ceilings (0 disables): resident memory of the worker and its
+        # helper processes, and wall time
+        'max_rss': int(os.environ.get('EEG_JOB_MAX_RSS_MB', 4096)) * 1024 * 1024,
+        'timeout': int(os.environ.get('EEG_JOB_TIMEOUT', 1800)),
+        # Workers are replaced after this many jobs, or when they keep more
+        # than this much memory between jobs
+        'worker_max_jobs': int(os.environ.get('EEG_WORKER_MAX_JOBS', 50)),
+        'worker_recycle_rss': int(os.environ.get('EEG_WORKER_RECYCLE_MB', 1024)) * 1024 * 1024,
+        # Start the workers with the API and warm them up before the first job
+        'warmup': os.environ.get('EEG_WORKER_WARMUP', '1') == '1',
+        'warmup_timeout': int(os.environ.get('EEG_WORKER_WARMUP_TIMEOUT', 300))
+    },
+    'cache': {
+        'enabled': os.environ.get('EEG_CACHE_ENABLED', '1') == '1',
+        'directory': os.environ.get('EEG_CACHE_DIR',
+                                    os.path.join(tempfile.gettempdir(), 'eeg_cache')),
+        'max_bytes': int(os.environ.get('EEG_CACHE_MAX_MB', 512)) * 1024 * 1024,
+        'stage_max_bytes': int(os.environ.get('EEG_STAGE_CACHE_MAX_MB', 4096)) * 1024 * 1024
+    },
+    'uploads': {
+        # Uploads are written once, here, and read in place by the analysis
+        'spool_dir': os.environ.get('EEG_SPOOL_DIR',
+                                    os.path.join(tempfile.gettempdir(), 'eeg_spool')),
+        # Memory-backed directory for the small .exp files (None: use spool_dir)
+        'memory_dir': os.environ.get('EEG_MEMORY_SPOOL_DIR',
+                                     '/dev/shm/eeg_spool' if os.path.isdir('/dev/shm') else None),
+        'max_cnt_bytes': int(os.environ.get('EEG_MAX_CNT_MB', 1024)) * 1024 * 1024,
+        'max_exp_bytes': int(os.environ.get('EEG_MAX_EXP_MB', 16)) * 1024 * 1024,
+        # Request directories older than this are leftovers of a crash
+        'stale_seconds': 6 * 3600
+    },
+    'batch': {
+        # Cohort batches: manifests, kept uploads and per-subject evokeds
+        'directory': os.environ.get('EEG_BATCH_DIR',
+                                    os.path.join(tempfile.gettempdir(), 'eeg_batches')),
+        # Subjects (.cnt/.exp pairs) and total upload size per /batch request
+        'max_subjects': int(os.environ.get('EEG_BATCH_MAX_SUBJECTS', 64)),
+        'max_bytes': int(os.environ.get('EEG_BATCH_MAX_MB', 8192)) * 1024 * 1024
+    },
+    'realtime': {
+        # Concurrent live sessions on /realtime
+        'max_sessions': int(os.environ.get('EEG_REALTIME_SESSIONS', 4)),
+        # Seconds between updates pushed to the client, unless it asks otherwise
+        'update_interval': 1.0,
+        'min_update_interval': 0.1,
+        # How long after its sample a trigger event may still arrive
+        'event_lag_seconds': 2.0
     }
 }
 
+# Bump when a code change alters the analysis output, to invalidate caches
+PIPELINE_VERSION = 7
+
+# CONFIG sections that tune the service rather than the analysis output
+OPERATIONAL_CONFIG_KEYS = ('jobs', 'cache', 'cpu', 'uploads', 'batch', 'realtime')
+
+# Settings inside analysis sections that change speed, not output
+OPERATIONAL_SETTINGS = {'filter': ('n_jobs',), 'statistics': ('n_jobs',),
+                        'streaming': ('chunk_seconds',)}
+
+# Stages reported by GET /status/{task_id}, in pipeline order
+PIPELINE_STAGES = [
+    'parsing',
+    'loading',
+    'filtering',
+    'mapping_events',
+    'epoching',
+    'averaging',
+    'statistics',
+    'rendering'
+]
+
+# CONFIG keys a request may override for "what-if" analyses
+OVERRIDABLE_CONFIG = {
+    'filter': ('low', 'high'),
+    'epoch': ('tmin', 'tmax', 'baseline'),
+    'rejection': ('eeg', 'flat', 'gradient'),
+    'p300': ('search_window', 'score_range', 'window_duration', 'peak_prominence')
+}
+
 ANALYSIS_SECTIONS = [
     {
         "comp": "P100",
         "ch": "OZ",
         "color": "green",
         "window": (0.08, 0.14),
+        "polarity": "positive",
         "bg_color": "#f0f8ff",
         "title": "A. P100 (The 'First Glance' Test)",
         "desc": "This test measures the brain's immediate, subconscious reaction to seeing the screen. It tells us if the visual elements are striking enough to instantaneously grab the brain's attention—much like the primary visual cortex's swift response to early attention tasks—to ensure the design registers immediately."
@@ -71,6 +248,7 @@ ANALYSIS_SECTIONS = [
         "ch": "FZ",
         "color": "yellow",
         "window": (0.20, 0.30),
+        "polarity": "negative",
         "bg_color": "#fffef0",
         "title": "B. N200 (The 'Mental Roadblock' Test)",
         "desc": "This measures mental friction by revealing the precise moment a user hits a cognitive barrier or is momentarily stuck. It shows whether the user is struggling or experiencing frustration because they cannot instantly recognize or classify the insight they need in complex data. This aligns with objective indicators of a high cognitive load or poor experience."
@@ -80,6 +258,7 @@ ANALYSIS_SECTIONS = [
         "ch": "PZ",
         "color": "red",
         "window": (0.30, 0.50),
+        "polarity": "positive",
         "bg_color": "#fff5f5",
         "title": "C. P300 (The 'Confirmation' Test)",
         "desc": "This component marks the ultimate 'Aha!' moment of successful understanding. It confirms that the user has fully processed the key information and is cognitively ready to make a confident decision or take action, rather than hesitating due to uncertainty."
@@ -100,112 +279,420 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+_job_runner = None
+
+
+def cores_per_job() -> int:
+    """Share of the CPU budget each concurrently running analysis may use."""
+    return max(1, CONFIG['cpu']['budget'] // CONFIG['jobs']['max_workers'])
+
+
+def filter_n_jobs() -> int:
+    """Threads used to filter one recording, capped by the CPU budget."""
+    n_jobs = CONFIG['filter']['n_jobs']
+    if n_jobs == 'auto':
+        return cores_per_job()
+    return max(1, min(int(n_jobs), cores_per_job()))
+
+
+def statistics_n_jobs() -> int:
+    """Processes used for bootstrap resampling, capped by the CPU budget."""
+    n_jobs = CONFIG['statistics']['n_jobs']
+    if n_jobs == 'auto':
+        return cores_per_job()
+    return max(1, min(int(n_jobs), cores_per_job()))
+
+
+def get_job_runner() -> JobRunner:
+    """Return the process-wide job runner, starting it on first use."""
+    global _job_runner
+    if _job_runner is None:
+        # Keep numerical libraries inside each worker's CPU share
+        threads = str(cores_per_job())
+        _job_runner = JobRunner(
+            max_workers=CONFIG['jobs']['max_workers'],
+            queue_depth=CONFIG['jobs']['queue_depth'],
+            stages=PIPELINE_STAGES,
+            result_ttl=CONFIG['jobs']['result_ttl'],
+            max_rss=CONFIG['jobs']['max_rss'],
+            timeout=CONFIG['jobs']['timeout'],
+            worker_max_jobs=CONFIG['jobs']['worker_max_jobs'],
+            recycle_rss=CONFIG['jobs']['worker_recycle_rss'],
+            prestart=CONFIG['jobs']['warmup'],
+            warmup=warm_up_worker if CONFIG['jobs']['warmup'] else None,
+            warmup_timeout=CONFIG['jobs']['warmup_timeout'],
+            worker_env={
+                'OMP_NUM_THREADS': threads,
+                'OPENBLAS_NUM_THREADS': threads,
+                'MKL_NUM_THREADS': threads
+            }
+        )
+    return _job_runner
+
+
+_result_cache = None
+
+
+def config_digest() -> str:
+    """Digest of every setting that influences the analysis output."""
+    analysis_config = {
+        section: {k: v for k, v in values.items()
+                  if k not in OPERATIONAL_SETTINGS.get(section, ())}
+        for section, values in CONFIG.items() if section not in OPERATIONAL_CONFIG_KEYS
+    }
+    return canonical_digest(PIPELINE_VERSION, analysis_config, ANALYSIS_SECTIONS)
+
+
+def get_result_cache():
+    """Return the result cache for the current CONFIG, or None if disabled."""
+    global _result_cache
+    if not CONFIG['cache']['enabled']:
+        return None
+    namespace = config_digest()
+    if _result_cache is None or os.path.basename(_result_cache.directory) != namespace:
+        _result_cache = ResultCache(
+            os.path.join(CONFIG['cache']['directory'], 'results'),
+            CONFIG['cache']['max_bytes'],
+            namespace
+        )
+        _result_cache.purge_stale_namespaces()
+    return _result_cache
+
+
+def result_cache_key(cnt_digest: str, exp_digest: str, overrides: dict = None,
+                     output_format: str = 'png') -> str:
+    """Result cache key for an upload pair, CONFIG overrides and report format."""
+    return combine_digests(cnt_digest, exp_digest,
+                           canonical_digest(overrides or {}, output_format))
+
+
+_stage_cache = None
+
+
+def get_stage_cache():
+    """Return the intermediate stage cache, or None if caching is disabled."""
+    global _stage_cache
+    if not CONFIG['cache']['enabled']:
+        return None
+    if _stage_cache is None:
+        _stage_cache = StageCache(
+            os.path.join(CONFIG['cache']['directory'], 'stages'),
+            CONFIG['cache']['stage_max_bytes']
+        )
+    return _stage_cache
+
+
+@app.on_event("shutdown")
+def shutdown_job_runner():
+    global _job_runner
+    if _job_runner is not None:
+        _job_runner.shutdown()
+        _job_runner = None
+
 # ============================================================================
 # HELPER FUNCTIONS
 # ============================================================================
 
-def validate_uploaded_files(cnt_file: UploadFile, exp_file: UploadFile):
-    """Validate that uploaded files have correct extensions."""
-    if not cnt_file.filename.endswith('.cnt'):
-        raise HTTPException(status_code=400, detail="Invalid file type. Expected .cnt file")
-    if not exp_file.filename.endswith('.exp'):
-        raise HTTPException(status_code=400, detail="Invalid file type. Expected .exp file")
+class AnalysisError(Exception):
+    """Raised when the uploaded data cannot produce a report."""
+
+
+def upload_rules(cnt_dir: str, exp_dir: str, cnt_field: str = 'cnt_file',
+                 exp_field: str = 'exp_file', max_files: int = 1) -> dict:
+    """Size, type and header rules for ``max_files`` .cnt/.exp uploads."""
+    return {
+        cnt_field: file_rule('.cnt', CONFIG['uploads']['max_cnt_bytes'], check_cnt_head,
+                             cnt_dir, min_bytes=CNT_HEADER_BYTES, max_files=max_files),
+        exp_field: file_rule('.exp', CONFIG['uploads']['max_exp_bytes'], check_text_head,
+                             exp_dir, max_files=max_files)
+    }
+
+
+def request_spool_dirs(request_id: str):
+    """Spool directories for one /analyze request's .cnt and .exp files."""
+    spool_dir = CONFIG['uploads']['spool_dir']
+    memory_dir = CONFIG['uploads']['memory_dir'] or spool_dir
+    for directory in {spool_dir, memory_dir}:
+        purge_stale_requests(directory, CONFIG['uploads']['stale_seconds'])
+    return os.path.join(spool_dir, request_id), os.path.join(memory_dir, request_id)
+
 
+async def receive_or_reject(request: Request, rules: dict, max_body_bytes: int = None,
+                            timings: StageTimings = None):
+    """Spool a multipart upload, turning rule violations into HTTP errors.
 
-def save_upload_to_temp(upload_file: UploadFile, suffix: str) -> str:
-    """Save an uploaded file to a temporary location and return the path."""
-    tmp_file = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
-    tmp_file.close()
+    The time spent receiving is recorded as the 'upload_spool' stage, both
+    in ``timings`` and directly in the metrics.
+    """
+    timings = timings or StageTimings()
+    metrics.UPLOADS_IN_FLIGHT.inc()
+    try:
+        with timings.probe('upload_spool'):
+            return await receive_uploads(request, rules, max_body_bytes)
+    except UploadRejected as e:
+        metrics.UPLOADS_REJECTED.labels(e.status_code).inc()
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    finally:
+        metrics.UPLOADS_IN_FLIGHT.dec()
+        if 'upload_spool' in timings.stages:
+            metrics.observe_stage('upload_spool', timings.stages['upload_spool'])
+
+
+def file_digest(path: str) -> str:
+    """SHA-256 hex digest of a file on disk."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def parse_config_overrides(text: str) -> dict:
+    """Validate a JSON object of per-request CONFIG overrides."""
+    if not text:
+        return {}
+    try:
+        overrides = json.loads(text)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="config_overrides must be valid JSON")
+    return validate_config_overrides(overrides)
+
+
+def validate_config_overrides(overrides, sections=None) -> dict:
+    """Check parsed CONFIG overrides, optionally limited to some ``sections``."""
+    if not isinstance(overrides, dict):
+        raise HTTPException(status_code=400, detail="config_overrides must be a JSON object")
     
-    with open(tmp_file.name, "wb") as buffer:
-        shutil.copyfileobj(upload_file.file, buffer)
+    for section, values in overrides.items():
+        allowed = OVERRIDABLE_CONFIG.get(section)
+        if (allowed is None or not isinstance(values, dict)
+                or (sections is not None and section not in sections)):
+            raise HTTPException(status_code=400, detail=f"Cannot override CONFIG['{section}']")
+        for key, value in values.items():
+            if key not in allowed:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Cannot override CONFIG['{section}']['{key}']"
+                )
+            # Windows and ranges are pairs, everything else is a scalar
+            expects_pair = isinstance(CONFIG[section][key], tuple)
+            if expects_pair != isinstance(value, list) or (expects_pair and len(value) != 2):
+                shape = "a [start, end] pair" if expects_pair else "a single number"
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"CONFIG['{section}']['{key}'] must be {shape}"
+                )
+            items = value if expects_pair else [value]
+            for item in items:
+                if isinstance(item, bool) or not isinstance(item, (int, float, type(None))):
+                    raise HTTPException(
+                        status_code=400,
+                        detail=f"CONFIG['{section}']['{key}'] must be numeric"
+                    )
+    return overrides
+
+
+@contextmanager
+def config_overrides_applied(overrides: dict):
+    """Temporarily apply per-request CONFIG overrides.
+
+    Only used inside job-runner workers, which run one analysis at a time.
+    """
+    saved = {section: dict(CONFIG[section]) for section in overrides}
+    try:
+        for section, values in overrides.items():
+            for key, value in values.items():
+                CONFIG[section][key] = tuple(value) if isinstance(value, list) else value
+        yield
+    finally:
+        for section, values in saved.items():
+            CONFIG[section].clear()
+            CONFIG[section].update(values)
+
+
+def report_channels():
+    """Channels the report plots, followed by the extra rejection channels."""
+    channels = [section['ch'] for section in ANALYSIS_SECTIONS]
+    for ch in CONFIG['channels']['rejection_channels']:
+        if ch not in channels:
+            channels.append(ch)
+    return channels
+
+
+def pick_analysis_channels(raw):
+    """Restrict a (non-preloaded) Raw to the channels the analysis needs.
+
+    In 'report' mode only report_channels() present in the recording are
+    kept, so later loading, filtering and epoching skip the rest of the
+    montage. Falls back to the full montage if none of them are present.
+    """
+    if CONFIG['channels']['mode'] != 'report':
+        return raw
     
-    return tmp_file.name
+    wanted = [ch for ch in report_channels() if ch in raw.ch_names]
+    if not wanted:
+        logger.warning("None of %s found, using all channels", report_channels())
+        return raw
+    return raw.pick(wanted)
+
+
+# Columns of a parsed .exp file; latency is NaN where it could not be read
+EXP_TRIAL_DTYPE = np.dtype([
+    ('trial_id', object),
+    ('name', object),
+    ('type', object),
+    ('trigger_code', object),
+    ('latency', np.float64)
+])
+
+EXP_MIN_FIELDS = 7
+
+
+def split_exp_row(line: str):
+    """Split an .exp row on tabs, falling back to any whitespace."""
+    line = line.strip()
+    parts = line.split('\t')
+    if len(parts) < EXP_MIN_FIELDS:
+        parts = line.split()
+    return parts
 
 
 def parse_experiment_file(exp_path: str):
     """
-    Parse the .exp file to extract trial mappings and reaction times.
-    FIXED: Maps BOTH Trial IDs and Trigger Codes to handle format mismatches.
+    Parse the .exp file into one record per trial.
+
+    The file is read line by line. Header lines are whatever precedes the
+    first trial row (one with all columns and an integer trigger code), so
+    their number is detected rather than assumed. Returns ``(trials,
+    stats)``: a structured array with EXP_TRIAL_DTYPE columns (trial id,
+    name, type, trigger code, latency in ms) and counts of header lines,
+    unparseable rows and unreadable latencies.
     """
-    trial_type_map = {}
-    reaction_times = []
+    trial_ids, names, types, codes, latencies = [], [], [], [], []
+    header_lines = 0
+    unparseable_rows = 0
+    invalid_latencies = 0
     
-    with open(exp_path, 'r') as f:
-        lines = f.readlines()
-        
-        for line in lines[8:]:
-            parts = line.strip().split('\t')
-            if len(parts) < 7:
-                parts = line.strip().split()
+    with open(exp_path, 'r', errors='replace') as f:
+        for line in f:
+            parts = split_exp_row(line)
+            if len(parts) < EXP_MIN_FIELDS or not parts[5].strip().lstrip('-').isdigit():
+                if not parts:
+                    continue
+                if trial_ids:
+                    unparseable_rows += 1
+                else:
+                    header_lines += 1
+                continue
             
-            if len(parts) >= 7:
-                trial_id = parts[0].strip()
-                trial_name = parts[1].strip()
-                trial_type = parts[3].strip()
-                
-                try:
-                    latency = int(parts[6].strip())
-                except:
-                    latency = 1000
-                
-                # Map trial ID (e.g., "0", "1", "2")
-                trial_type_map[trial_id] = trial_type
-                
-                # CRITICAL FIX: Also map trigger code (column 5, e.g., "12001", "12502")
-                # EEG files often use these codes instead of trial IDs
-                try:
-                    trigger_code = parts[5].strip()
-                    trial_type_map[trigger_code] = trial_type
-                except:
-                    pass
-                
-                if trial_type == 'R' and latency < 1000:
-                    reaction_times.append((latency, trial_id, trial_name))
+            try:
+                latencies.append(int(parts[6]))
+            except ValueError:
+                latencies.append(np.nan)
+                invalid_latencies += 1
+            trial_ids.append(parts[0].strip())
+            names.append(parts[1].strip())
+            types.append(parts[3].strip())
+            codes.append(parts[5].strip())
+    
+    trials = np.empty(len(trial_ids), dtype=EXP_TRIAL_DTYPE)
+    trials['trial_id'] = trial_ids
+    trials['name'] = names
+    trials['type'] = types
+    trials['trigger_code'] = codes
+    trials['latency'] = latencies
     
-    return trial_type_map, reaction_times
+    stats = {
+        'trials': len(trials),
+        'header_lines': header_lines,
+        'unparseable_rows': unparseable_rows,
+        'invalid_latencies': invalid_latencies
+    }
+    if unparseable_rows or invalid_latencies:
+        logger.warning(".exp file has %d unparseable rows and %d rows without a readable "
+                       "latency", unparseable_rows, invalid_latencies)
+    
+    return trials, stats
+
+
+def trial_type_lookup(trials) -> dict:
+    """Trial type keyed on both trial id and trigger code.
+
+    EEG files use either one as the annotation text, so both are mapped.
+    Later rows win, as do trigger codes over an equal trial id in the same row.
+    """
+    lookup = {}
+    for trial_id, trigger_code, trial_type in zip(trials['trial_id'].tolist(),
+                                                  trials['trigger_code'].tolist(),
+                                                  trials['type'].tolist()):
+        lookup[trial_id] = trial_type
+        lookup[trigger_code] = trial_type
+    return lookup
+
+
+def answered_mask(trials) -> np.ndarray:
+    """Mask of the Target trials answered within the 1000 ms response window.
+
+    Only these carry a reaction time; other latencies are timeouts or
+    belong to Non-Target trials.
+    """
+    return (trials['type'] == 'R') & (trials['latency'] < 1000)
 
 
-def calculate_task_extremes(reaction_times):
+def calculate_task_extremes(trials):
     """Identify easiest and toughest tasks based on reaction times."""
-    if not reaction_times:
+    answered = answered_mask(trials)
+    if not np.any(answered):
         return "N/A", "N/A"
     
-    best = min(reaction_times, key=lambda x: x[0])
-    worst = max(reaction_times, key=lambda x: x[0])
+    answered_trials = trials[answered]
+    best = answered_trials[np.argmin(answered_trials['latency'])]
+    worst = answered_trials[np.argmax(answered_trials['latency'])]
     
-    easiest_txt = f"Trial {best[1]}: '{best[2]}' ({best[0]}ms)"
-    toughest_txt = f"Trial {worst[1]}: '{worst[2]}' ({worst[0]}ms)"
+    easiest_txt = f"Trial {best['trial_id']}: '{best['name']}' ({best['latency']:.0f}ms)"
+    toughest_txt = f"Trial {worst['trial_id']}: '{worst['name']}' ({worst['latency']:.0f}ms)"
     
     return easiest_txt, toughest_txt
 
 
-def map_events_to_codes(raw, trial_type_map):
+def normalize_annotation_code(description: str) -> str:
+    """Strip the "Stimulus/" prefix: "Stimulus/12001" and "12001" both give "12001"."""
+    return description.replace('Stimulus/', '').replace('Stimulus', '').strip()
+
+
+def map_events_to_codes(raw, trials):
     """
     Map raw annotations to event codes based on trial type.
-    FIXED: Improved error messages with debug information.
+
+    Works on all annotations at once: each distinct description is
+    normalized and looked up a single time, codes are spread back with an
+    index array, and matched onsets go through one time_as_index call.
+
+    Returns ``(custom_events, event_ids, unmatched)`` where ``unmatched``
+    counts the annotations per code that the .exp file does not list.
     """
-    new_events_list = []
-    found_descriptions = set()
+    trial_type_map = trial_type_lookup(trials)
+    descriptions = np.asarray(raw.annotations.description, dtype=str)
+    unique_descriptions, inverse = np.unique(descriptions, return_inverse=True)
+    clean_ids = [normalize_annotation_code(d) for d in unique_descriptions]
     
-    for annot in raw.annotations:
-        raw_desc = str(annot['description'])
-        # Handle both "Stimulus/12001" and "12001" formats
-        clean_id = raw_desc.replace('Stimulus/', '').replace('Stimulus', '').strip()
-        found_descriptions.add(clean_id)
-        
-        trial_type = trial_type_map.get(clean_id, "Unknown")
-        
-        if trial_type == "Unknown":
-            continue
-        
-        code = 1 if trial_type == 'R' else 2
-        event_sample = raw.time_as_index(annot['onset'])[0]
-        new_events_list.append([event_sample, 0, code])
+    # Code table over the distinct descriptions: 1 Target, 2 Non-Target, 0 unknown
+    code_table = np.array([
+        0 if clean_id not in trial_type_map else (1 if trial_type_map[clean_id] == 'R' else 2)
+        for clean_id in clean_ids
+    ], dtype=int)
+    codes = code_table[inverse]
+    matched = codes > 0
     
-    if not new_events_list:
+    unmatched = {}
+    unmatched_counts = np.bincount(inverse[~matched], minlength=len(unique_descriptions))
+    for clean_id, count in zip(clean_ids, unmatched_counts):
+        if count:
+            unmatched[clean_id] = unmatched.get(clean_id, 0) + int(count)
+    
+    if not np.any(matched):
         # Provide helpful debug information
-        sample_eeg = list(found_descriptions)[:5]
+        sample_eeg = sorted(set(clean_ids))[:5]
         sample_map = list(trial_type_map.keys())[:10]
         error_msg = (
             f"No matching events found between EEG and experiment file.\n"
@@ -213,20 +700,79 @@ def map_events_to_codes(raw, trial_type_map):
             f"Expected mappings from .exp file: {sample_map}...\n"
             f"Check if trigger codes match between files."
         )
-        print(f"ERROR: {error_msg}")
-        return None, None
+        logger.error(error_msg)
+        return None, None, unmatched
     
-    custom_events = np.array(new_events_list)
+    samples = raw.time_as_index(raw.annotations.onset[matched])
+    custom_events = np.column_stack([
+        samples,
+        np.zeros(len(samples), dtype=int),
+        codes[matched]
+    ])
     event_ids = {'Target': 1, 'Non-Target': 2}
     
-    print(f"SUCCESS: Mapped {len(new_events_list)} events (Target: {sum(custom_events[:, 2] == 1)}, Non-Target: {sum(custom_events[:, 2] == 2)})")
+    logger.info("Mapped %d events (Target: %d, Non-Target: %d)", len(custom_events),
+                np.count_nonzero(custom_events[:, 2] == 1),
+                np.count_nonzero(custom_events[:, 2] == 2))
+    if unmatched:
+        # Also counted in eeg_events_unmatched_total once the job returns
+        logger.warning("%d annotations had codes missing from the .exp file (%d distinct codes)",
+                       sum(unmatched.values()), len(unmatched))
+    
+    return custom_events, event_ids, unmatched
+
+
+def event_trial_rows(raw, trials) -> np.ndarray:
+    """Row of ``trials`` behind each event of map_events_to_codes(), or -1.
+
+    An annotation names its trial by trial id or by trigger code. Trigger
+    codes repeat, so the k-th annotation with a given text is paired with
+    the k-th .exp row carrying it (by id or code).
+    """
+    rows_by_key = {}
+    for row, (trial_id, trigger_code) in enumerate(zip(trials['trial_id'].tolist(),
+                                                       trials['trigger_code'].tolist())):
+        rows_by_key.setdefault(trial_id, []).append(row)
+        if trigger_code != trial_id:
+            rows_by_key.setdefault(trigger_code, []).append(row)
     
-    return custom_events, event_ids
+    rows = []
+    seen = {}
+    for description in raw.annotations.description:
+        key = normalize_annotation_code(description)
+        candidates = rows_by_key.get(key)
+        if candidates is None:
+            # Unmatched annotations produce no event
+            continue
+        k = seen.get(key, 0)
+        seen[key] = k + 1
+        rows.append(candidates[k] if k < len(candidates) else -1)
+    return np.array(rows, dtype=int)
+
+
+def epoch_index(epochs, trials, trial_rows: np.ndarray, features: dict) -> dict:
+    """Per-epoch .exp trial columns and rejection features for the EpochStore."""
+    rows = trial_rows[epochs.selection]
+    linked = rows >= 0
+    trial_ids = np.full(len(rows), '', dtype=object)
+    trial_ids[linked] = trials['trial_id'][rows[linked]]
+    trial_names = np.full(len(rows), '', dtype=object)
+    trial_names[linked] = trials['name'][rows[linked]]
+    # NaN unless the epoch's trial was answered (see answered_mask)
+    latencies = np.where(answered_mask(trials), trials['latency'], np.nan)
+    reaction_times = np.full(len(rows), np.nan)
+    reaction_times[linked] = latencies[rows[linked]]
+    return {
+        'trial_row': rows,
+        'trial_id': trial_ids.astype(str),
+        'trial_name': trial_names.astype(str),
+        'reaction_time': reaction_times,
+        **features
+    }
 
 
-def calculate_rejection_stats(total_events: int, epochs):
+def calculate_rejection_stats(total_events: int, good_epochs: int):
     """Calculate epoch rejection statistics."""
-    good_epochs = len(epochs)
     dropped_epochs = total_events - good_epochs
     drop_percentage = (dropped_epochs / total_events) * 100 if total_events > 0 else 0
     
@@ -238,54 +784,208 @@ def calculate_rejection_stats(total_events: int, epochs):
     }
 
 
-def detect_p300_peak(evoked_target, channel: str):
-    """Detect P300 peak using robust peak-finding algorithm."""
+def time_window_slice(times: np.ndarray, start: float, end: float) -> slice:
+    """Index range of ``start <= times <= end`` in an ascending time axis."""
+    return slice(int(np.searchsorted(times, start, side='left')),
+                 int(np.searchsorted(times, end, side='right')))
+
+
+def detect_p300_peak(evoked_target, channel: str, search: slice = None):
+    """Detect P300 peak using robust peak-finding algorithm.
+    
+    ``search`` is the precomputed index range of the P300 search window
+    (see EvokedViews); it is derived from CONFIG when omitted.
+    """
     if channel not in evoked_target.ch_names:
         return None
     
     ch_idx = evoked_target.ch_names.index(channel)
-    data = evoked_target.data[ch_idx, :]
     times = evoked_target.times
+    if search is None:
+        search = time_window_slice(times, *CONFIG['p300']['search_window'])
     
-    window_start, window_end = CONFIG['p300']['search_window']
-    mask = (times >= window_start) & (times <= window_end)
-    
-    if not np.any(mask):
+    if search.start >= search.stop:
         return None
     
-    window_data = data[mask]
-    window_times = times[mask]
-    
-    # Try to find peaks with prominence to avoid noise
-    try:
-        peaks, properties = find_peaks(
-            window_data,
-            prominence=CONFIG['p300']['peak_prominence']
-        )
-        
-        if len(peaks) > 0:
-            peak_idx = peaks[np.argmax(properties['prominences'])]
-            return window_times[peak_idx]
-    except:
-        pass
-    
-    # Fallback to simple max
-    peak_idx = np.argmax(window_data)
-    return window_times[peak_idx]
+    # Basic slicing returns views, so nothing is copied here
+    window_data = evoked_target.data[ch_idx, search]
+    window_times = times[search]
+    return window_times[peak_index(window_data, CONFIG['p300']['peak_prominence'])]
 
 
-def calculate_p300_score(peak_latency_seconds: float):
-    """Calculate Neural Confidence Score based on P300 latency."""
-    latency_ms = peak_latency_seconds * 1000
+def calculate_p300_score(peak_latency_seconds):
+    """Calculate Neural Confidence Score based on P300 latency.
+    
+    Also accepts an array of latencies, e.g. bootstrap resamples.
+    """
+    latency_ms = np.asarray(peak_latency_seconds) * 1000
     min_lat, max_lat = CONFIG['p300']['score_range']
     
     # Linear scoring: faster = better
     raw_score = 100 - ((latency_ms - min_lat) / (max_lat - min_lat) * 100)
-    score = max(0, min(100, raw_score))
+    score = np.clip(raw_score, 0, 100)
     
     return score, latency_ms
 
 
+def p300_channel() -> str:
+    """The channel the report measures the P300 on."""
+    return next(s["ch"] for s in ANALYSIS_SECTIONS if s["comp"] == "P300")
+
+
+def measure_p300(evoked_target):
+    """P300 latency and score on the report's P300 channel, or None."""
+    channel = p300_channel()
+    peak_time = detect_p300_peak(evoked_target, channel)
+    if peak_time is None:
+        return None
+    
+    score, latency_ms = calculate_p300_score(peak_time)
+    return {'channel': channel, 'latency_ms': round(float(latency_ms), 1),
+            'score': round(float(score), 1)}
+
+
+def p300_trials(epochs, keep: np.ndarray):
+    """Kept single trials of the P300 channel inside the search window.
+
+    Returns ``(target, nontarget, times)`` with two (epochs x samples)
+    arrays, or None if the channel is missing or the window is empty.
+    """
+    channel = p300_channel()
+    if channel not in epochs.ch_names:
+        return None
+    search = time_window_slice(epochs.times, *CONFIG['p300']['search_window'])
+    if search.start >= search.stop:
+        return None
+    
+    ch_idx = epochs.ch_names.index(channel)
+    data = epochs.get_data(copy=False)
+    trials = []
+    for condition in ('Target', 'Non-Target'):
+        code = epochs.event_id.get(condition)
+        selected = np.flatnonzero(keep & (epochs.events[:, 2] == code) if code is not None else [])
+        # Only this small slab is read from the (memory-mapped) epochs
+        trials.append(np.asarray(data[selected, ch_idx, search], dtype=np.float64))
+    return trials[0], trials[1], epochs.times[search]
+
+
+def p300_statistics(trials, timings: StageTimings = None):
+    """Bootstrap confidence intervals of the P300 and the cluster test.
+
+    ``trials`` comes from p300_trials(). Returns a dict with "bootstrap"
+    (latency and score estimate, interval and standard deviation over
+    CONFIG['statistics']['bootstrap_resamples'] resamples of the Target
+    epochs) and "cluster_test" (Target vs Non-Target clusters in the search
+    window with permutation p-values); either is None when disabled or when
+    a condition has fewer than two epochs.
+    """
+    timings = timings or StageTimings()
+    settings = CONFIG['statistics']
+    result = {'channel': p300_channel(), 'bootstrap': None, 'cluster_test': None}
+    if trials is None:
+        return result
+    target, nontarget, times = trials
+    
+    if settings['bootstrap_resamples'] and len(target) >= 2:
+        with timings.probe('bootstrap'):
+            latencies = reliability.bootstrap_peak_latencies(
+                target, times, settings['bootstrap_resamples'],
+                CONFIG['p300']['peak_prominence'], seed=settings['seed'],
+                n_jobs=statistics_n_jobs()
+            )
+        estimate = times[peak_index(target.mean(axis=0), CONFIG['p300']['peak_prominence'])]
+        
+        def interval(values, point):
+            low, high = reliability.percentile_interval(values, settings['confidence'])
+            return {'estimate': round(float(point), 1), 'low': round(low, 1),
+                    'high': round(high, 1), 'std': round(float(np.std(values)), 1)}
+        
+        scores, latencies_ms = calculate_p300_score(latencies)
+        score, latency_ms = calculate_p300_score(estimate)
+        result['bootstrap'] = {
+            'resamples': settings['bootstrap_resamples'],
+            'confidence': settings['confidence'],
+            'target_epochs': len(target),
+            'latency_ms': interval(latencies_ms, latency_ms),
+            'score': interval(scores, score)
+        }
+    
+    if settings['permutations'] and len(target) >= 2 and len(nontarget) >= 2:
+        with timings.probe('permutation_test'):
+            test = reliability.cluster_permutation_test(
+                target, nontarget, times, settings['permutations'],
+                alpha=settings['cluster_alpha'], seed=settings['seed']
+            )
+        clusters = [
+            {'start_ms': round(c['start'] * 1000, 1), 'end_ms': round(c['end'] * 1000, 1),
+             'sign': c['sign'], 'mass': round(c['mass'], 2), 'p_value': round(c['p_value'], 4)}
+            for c in test['clusters']
+        ]
+        result['cluster_test'] = {
+            'permutations': settings['permutations'],
+            'cluster_alpha': settings['cluster_alpha'],
+            'threshold_t': round(test['threshold_t'], 3),
+            'window_ms': [round(float(times[0]) * 1000, 1), round(float(times[-1]) * 1000, 1)],
+            'clusters': clusters,
+            # Smallest cluster p-value; 1.0 when no cluster formed
+            'p_value': min((c['p_value'] for c in clusters), default=1.0)
+        }
+    return result
+
+
+# Keys of the conditions in component tables and the JSON series
+CONDITION_KEYS = {'Target': 'target', 'Non-Target': 'nontarget'}
+
+
+def component_measures(waveforms: np.ndarray, times: np.ndarray, sections) -> dict:
+    """peaks.measure_components() over the windows of ``sections``.
+
+    ``waveforms`` is (... x conditions x channels x times) with conditions
+    ordered as CONDITIONS; the results are (... x conditions x channels x
+    sections).
+    """
+    return measure_components(
+        waveforms, times,
+        [section['window'] for section in sections],
+        [-1 if section['polarity'] == 'negative' else 1 for section in sections],
+        CONFIG['components']['fractional_area']
+    )
+
+
+def _rounded(value, scale: float, digits: int = 1):
+    return None if np.isnan(value) else round(float(value) * scale, digits)
+
+
+def component_table(measures: dict, ch_names, sections):
+    """JSON rows of one (conditions x channels x sections) component_measures().
+
+    Each section is measured on its own channel; a missing channel gives
+    None for both conditions.
+    """
+    rows = []
+    for k, section in enumerate(sections):
+        row = {
+            'comp': section['comp'],
+            'ch': section['ch'],
+            'window_ms': [round(t * 1000, 1) for t in section['window']],
+            'polarity': section['polarity'],
+            **{key: None for key in CONDITION_KEYS.values()}
+        }
+        if section['ch'] in ch_names:
+            ch_idx = list(ch_names).index(section['ch'])
+            for c, condition in enumerate(CONDITIONS):
+                row[CONDITION_KEYS[condition]] = {
+                    'peak_latency_ms': _rounded(measures['peak_latency'][c, ch_idx, k], 1e3),
+                    'peak_amplitude_uv': _rounded(measures['peak_amplitude'][c, ch_idx, k], 1e6, 3),
+                    'mean_amplitude_uv': _rounded(measures['mean_amplitude'][c, ch_idx, k], 1e6, 3),
+                    'fractional_area_latency_ms': _rounded(
+                        measures['fractional_area_latency'][c, ch_idx, k], 1e3
+                    )
+                }
+        rows.append(row)
+    return rows
+
+
 def create_header_section(ax, title: str, summary: str):
     """Render the report header with title and description."""
     ax.axis('off')
@@ -313,17 +1013,20 @@ def create_section_text(ax, section: dict):
 
 
 def plot_erp_comparison(ax, evoked_target, evoked_nontarget, section: dict,
-                        highlight_window: tuple, p300_info: dict = None):
-    """Plot ERP comparison with highlighting and optional P300 scoring."""
-    channel = section['ch']
+                        highlight_window: tuple, p300_info: dict = None, std_errors=None):
+    """Plot ERP comparison with highlighting and optional P300 scoring.
     
-    # CRITICAL FIX: Scale data to microvolts BEFORE plotting
-    evoked_target_uv = evoked_target.copy()
-    evoked_nontarget_uv = evoked_nontarget.copy()
+    Pass single-channel views (EvokedViews.channel): plot_compare_evokeds
+    deep-copies its inputs, and it scales to microvolts on its own.
+    ``std_errors`` holds the Target/Non-Target standard errors of this
+    channel in volts (either may be None), drawn as ±1 SE bands.
+    """
+    from matplotlib.ticker import FuncFormatter
+
+    channel = section['ch']
     
-    # Plot ERPs with scaled data
     mne.viz.plot_compare_evokeds(
-        {'Target': evoked_target_uv, 'Non-Target': evoked_nontarget_uv},
+        {'Target': evoked_target, 'Non-Target': evoked_nontarget},
         picks=channel,
         axes=ax,
         show=False,
@@ -332,6 +1035,17 @@ def plot_erp_comparison(ax, evoked_target, evoked_nontarget, section: dict,
         title=None
     )
     
+    # Standard error bands around the traces, in each trace's colour
+    if std_errors is not None:
+        lines = {line.get_label(): line for line in ax.get_lines()}
+        for condition, std_error in zip(('Target', 'Non-Target'), std_errors):
+            line = lines.get(condition)
+            if std_error is None or line is None:
+                continue
+            mean_uv = np.asarray(line.get_ydata())
+            ax.fill_between(line.get_xdata(), mean_uv - std_error * 1e6, mean_uv + std_error * 1e6,
+                            color=line.get_color(), alpha=0.2, linewidth=0)
+    
     # Highlight analysis window
     ax.axvspan(highlight_window[0], highlight_window[1],
                color=section['color'], alpha=0.15,
@@ -350,7 +1064,7 @@ def plot_erp_comparison(ax, evoked_target, evoked_nontarget, section: dict,
     ax.ticklabel_format(style='plain', axis='y', useOffset=False)
     
     # Get the auto-generated ticks and just format them as integers
-    formatter = plt.FuncFormatter(lambda x, p: f'{int(x)}')
+    formatter = FuncFormatter(lambda x, p: f'{int(x)}')
     ax.yaxis.set_major_formatter(formatter)
     
     ax.set_ylabel("Amplitude (µV)", fontsize=12, weight='bold')
@@ -364,10 +1078,17 @@ def plot_erp_comparison(ax, evoked_target, evoked_nontarget, section: dict,
     
     # Add P300 score box if provided
     if p300_info and section['comp'] == 'P300':
-        score_text = (
-            f"P300 Latency: {p300_info['latency_ms']:.0f} ms\n"
-            f"Neural Confidence Score: {p300_info['score']:.0f}%"
-        )
+        latency_txt = f"P300 Latency: {p300_info['latency_ms']:.0f} ms"
+        score_txt = f"Neural Confidence Score: {p300_info['score']:.0f}%"
+        if 'latency_ci_ms' in p300_info:
+            ci_label = f"{p300_info['confidence'] * 100:.0f}% CI"
+            latency_txt += (f" ({ci_label} {p300_info['latency_ci_ms'][0]:.0f}"
+                            f"–{p300_info['latency_ci_ms'][1]:.0f})")
+            score_txt += (f" ({ci_label} {p300_info['score_ci'][0]:.0f}"
+                          f"–{p300_info['score_ci'][1]:.0f})")
+        score_text = f"{latency_txt}\n{score_txt}"
+        if 'cluster_p_value' in p300_info:
+            score_text += f"\nTarget vs Non-Target: p = {p300_info['cluster_p_value']:.3f}"
         ax.text(0.98, 0.05, score_text,
                 transform=ax.transAxes, ha='right', va='bottom',
                 fontsize=11, color='black',
@@ -388,75 +1109,128 @@ def plot_erp_comparison(ax, evoked_target, evoked_nontarget, section: dict,
                 bbox=dict(boxstyle='round,pad=0.7', fc='#fff5f5', alpha=0.8))
 
 
-def create_report_figure(evoked_target, evoked_nontarget, sections,
-                         rejection_stats, target_count, nontarget_count):
-    """Generate complete visualization report with all sections."""
-    fig = plt.figure(figsize=CONFIG['figure']['size'])
-    
-    gs = gridspec.GridSpec(
-        7, 1,
-        height_ratios=[1.2, 1.0, 2.5, 1.0, 2.5, 1.0, 2.5],
-        hspace=CONFIG['figure']['hspace']
-    )
-    
-    # Header
-    ax_header = fig.add_subplot(gs[0])
-    main_title = "Neuro-UX: B2B Dashboard Analysis"
-    summary_text = (
-        "We analyze your business dashboard versions (Current vs. New) by showing them to users "
-        "while they complete common management tasks, like \"Spot the revenue drop.\" Using an "
-        "objective brain activity monitor (EEG), we perform a neurological stress test that bypasses "
-        "unreliable subjective opinions.\n\n"
-        "The results show how the design performs across three key stages of comprehension: the P100 "
-        "reveals if the initial visual design is instantly effective; the N200 pinpoints exactly where "
-        "the user gets mentally stuck or confused by complex charts; and the P300 proves how quickly "
-        "the new design allows them to spot the right answer and confidently act on it. This provides "
-        "you with quantifiable, biological data to validate your design choices."
+# Output formats accepted by POST /analyze
+REPORT_FORMATS = ('png', 'preview', 'svg', 'json')
+
+REPORT_TITLE = "Neuro-UX: B2B Dashboard Analysis"
+REPORT_SUMMARY = (
+    "We analyze your business dashboard versions (Current vs. New) by showing them to users "
+    "while they complete common management tasks, like \"Spot the revenue drop.\" Using an "
+    "objective brain activity monitor (EEG), we perform a neurological stress test that bypasses "
+    "unreliable subjective opinions.\n\n"
+    "The results show how the design performs across three key stages of comprehension: the P100 "
+    "reveals if the initial visual design is instantly effective; the N200 pinpoints exactly where "
+    "the user gets mentally stuck or confused by complex charts; and the P300 proves how quickly "
+    "the new design allows them to spot the right answer and confidently act on it. This provides "
+    "you with quantifiable, biological data to validate your design choices."
+)
+
+
+class EvokedViews:
+    """The report's channels sliced out of a target/non-target evoked pair.
+
+    Each plotted channel becomes a one-channel Evoked sharing the parent's
+    data buffer, so the full arrays are never copied while a report is built.
+    The P300 search window's index range is computed once and shared by
+    every scoring call. ``std_errors`` is the optional ``(target, nontarget)``
+    pair of standard-error arrays aligned with the evokeds' channels.
+    """
+
+    def __init__(self, evoked_target, evoked_nontarget, sections, std_errors=None):
+        self.times = evoked_target.times
+        self.p300_search = time_window_slice(self.times, *CONFIG['p300']['search_window'])
+        std_errors = std_errors or (None, None)
+        self._views = {}
+        self._std_errors = {}
+        for section in sections:
+            channel = section['ch']
+            if channel in evoked_target.ch_names and channel not in self._views:
+                self._views[channel] = (channel_view(evoked_target, channel),
+                                        channel_view(evoked_nontarget, channel))
+                idx = evoked_target.ch_names.index(channel)
+                self._std_errors[channel] = tuple(
+                    None if std_error is None else std_error[idx] for std_error in std_errors
+                )
+
+    def has_channel(self, channel: str) -> bool:
+        return channel in self._views
+
+    def channel(self, channel: str):
+        """``(target, nontarget)`` one-channel views of ``channel``."""
+        return self._views[channel]
+
+    def std_errors(self, channel: str):
+        """``(target, nontarget)`` standard-error rows of ``channel``; either may be None."""
+        return self._std_errors[channel]
+
+
+def channel_view(evoked, channel: str):
+    """One-channel Evoked whose data is a view into ``evoked.data``."""
+    idx = evoked.ch_names.index(channel)
+    return mne.EvokedArray(
+        evoked.data[idx:idx + 1],
+        mne.pick_info(evoked.info, [idx]),
+        tmin=evoked.times[0],
+        nave=evoked.nave,
+        comment=evoked.comment,
+        verbose=False
     )
-    create_header_section(ax_header, main_title, summary_text)
-    
-    # Section rows
-    row_indices = [(1, 2), (3, 4), (5, 6)]
+
+
+def report_rows(views: EvokedViews, sections, statistics: dict = None, components=None):
+    """Per-section highlight window and P300 result, shared by every format.
+
+    ``statistics`` (see p300_statistics) adds the confidence intervals and
+    the cluster test p-value to the P300 result; ``components`` are the
+    sections' component_table() rows.
+    Returns the rows and the Neural Confidence Score text.
+    """
+    rows = []
     p300_score_txt = "N/A"
     
     for i, section in enumerate(sections):
-        text_row, graph_row = row_indices[i]
         channel = section["ch"]
+        row = {
+            'section': section,
+            'available': views.has_channel(channel),
+            'window': section["window"],
+            'p300': None,
+            'components': components[i] if components is not None else None
+        }
         
-        # Render text section
-        ax_text = fig.add_subplot(gs[text_row])
-        create_section_text(ax_text, section)
-        
-        # Render graph section
-        if channel in evoked_target.ch_names:
-            ax_graph = fig.add_subplot(gs[graph_row])
-            
-            # Handle dynamic P300 window
-            highlight_window = section["window"]
-            p300_info = None
+        # Handle dynamic P300 window
+        if row['available'] and section["comp"] == "P300":
+            target, _ = views.channel(channel)
+            p300_peak_time = detect_p300_peak(target, channel, views.p300_search)
             
-            if section["comp"] == "P300":
-                p300_peak_time = detect_p300_peak(evoked_target, channel)
+            if p300_peak_time is not None:
+                row['window'] = (
+                    p300_peak_time,
+                    p300_peak_time + CONFIG['p300']['window_duration']
+                )
                 
-                if p300_peak_time is not None:
-                    highlight_window = (
-                        p300_peak_time,
-                        p300_peak_time + CONFIG['p300']['window_duration']
-                    )
-                    
-                    score, latency_ms = calculate_p300_score(p300_peak_time)
-                    p300_score_txt = f"{score:.0f}%"
-                    p300_info = {'score': score, 'latency_ms': latency_ms}
-            
-            plot_erp_comparison(ax_graph, evoked_target, evoked_nontarget,
-                              section, highlight_window, p300_info)
-        else:
-            ax_graph = fig.add_subplot(gs[graph_row])
-            ax_graph.text(0.5, 0.5, f'Channel {channel} not found',
-                         ha='center', fontsize=14, color='red')
-            ax_graph.axis('off')
+                score, latency_ms = calculate_p300_score(p300_peak_time)
+                p300_score_txt = f"{score:.0f}%"
+                row['p300'] = {'score': score, 'latency_ms': latency_ms}
+                bootstrap = (statistics or {}).get('bootstrap')
+                if bootstrap is not None:
+                    row['p300']['confidence'] = bootstrap['confidence']
+                    row['p300']['latency_ci_ms'] = [bootstrap['latency_ms']['low'],
+                                                    bootstrap['latency_ms']['high']]
+                    row['p300']['score_ci'] = [bootstrap['score']['low'],
+                                               bootstrap['score']['high']]
+                cluster_test = (statistics or {}).get('cluster_test')
+                if cluster_test is not None:
+                    row['p300']['cluster_p_value'] = cluster_test['p_value']
+        
+        rows.append(row)
     
-    # Footer metadata - FIXED: Use passed counts instead of nave
+    return rows, p300_score_txt
+
+
+def report_footer(rejection_stats, target_count, nontarget_count):
+    """The two footer lines summarizing trial counts and settings."""
+    # FIXED: Use passed counts instead of nave
     balance_note = " ⚠️ Low trial count" if (target_count < 10 or nontarget_count < 10) else ""
     
     footer_line1 = (
@@ -470,18 +1244,204 @@ def create_report_figure(evoked_target, evoked_nontarget, sections,
         f'Threshold: {CONFIG["rejection"]["eeg"]*1e6:.0f}µV | '
         f'Filter: {CONFIG["filter"]["low"]}-{CONFIG["filter"]["high"]}Hz'
     )
+    return footer_line1, footer_line2
+
+
+class ReportTemplate:
+    """The report figure with its static parts rasterized once.
+
+    Header and section text are identical for every request, so they are
+    drawn a single time into a background buffer. A render restores that
+    buffer and draws only the three ERP axes and the footer on top of it.
+    """
+
+    def __init__(self, sections, dpi: int):
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+        from matplotlib.gridspec import GridSpec
+
+        # A bare Figure is not tracked by pyplot, so plt.close('all') in
+        # cleanup_resources() leaves it alone
+        self.fig = Figure(figsize=CONFIG['figure']['size'], dpi=dpi)
+        self.canvas = FigureCanvasAgg(self.fig)
+        self.dpi = dpi
+        
+        gs = GridSpec(
+            7, 1,
+            figure=self.fig,
+            height_ratios=[1.2, 1.0, 2.5, 1.0, 2.5, 1.0, 2.5],
+            hspace=CONFIG['figure']['hspace']
+        )
+        create_header_section(self.fig.add_subplot(gs[0]), REPORT_TITLE, REPORT_SUMMARY)
+        
+        # Section rows
+        row_indices = [(1, 2), (3, 4), (5, 6)]
+        self.graph_axes = []
+        for i, section in enumerate(sections):
+            text_row, graph_row = row_indices[i]
+            create_section_text(self.fig.add_subplot(gs[text_row]), section)
+            ax_graph = self.fig.add_subplot(gs[graph_row])
+            ax_graph.set_visible(False)
+            self.graph_axes.append(ax_graph)
+        
+        self.footers = [
+            self.fig.text(0.5, 0.02, '', ha='center', fontsize=10, color='#7f8c8d'),
+            self.fig.text(0.5, 0.005, '', ha='center', fontsize=9,
+                          style='italic', color='#95a5a6')
+        ]
+        
+        self.canvas.draw()
+        self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+        self.lock = threading.Lock()
+
+    def render(self, views: EvokedViews, rows, footer_lines, output_format: str,
+               timings: StageTimings = None) -> bytes:
+        """Draw the per-request parts and return the encoded image."""
+        timings = timings or StageTimings()
+        with self.lock:
+            try:
+                with timings.probe('render'):
+                    for ax_graph, row in zip(self.graph_axes, rows):
+                        ax_graph.set_visible(True)
+                        if row['available']:
+                            target, nontarget = views.channel(row['section']['ch'])
+                            plot_erp_comparison(ax_graph, target, nontarget,
+                                                row['section'], row['window'], row['p300'],
+                                                views.std_errors(row['section']['ch']))
+                        else:
+                            ax_graph.text(0.5, 0.5, f'Channel {row["section"]["ch"]} not found',
+                                          ha='center', fontsize=14, color='red')
+                            ax_graph.axis('off')
+                    for text, line in zip(self.footers, footer_lines):
+                        text.set_text(line)
+                
+                if output_format == 'svg':
+                    # SVG output draws and encodes in one savefig call
+                    with timings.probe('encode'):
+                        buf = BytesIO()
+                        self.fig.savefig(buf, format='svg', bbox_inches='tight')
+                        return buf.getvalue()
+                
+                with timings.probe('render'):
+                    self.canvas.restore_region(self.background)
+                    for artist in self.graph_axes + self.footers:
+                        self.fig.draw_artist(artist)
+                with timings.probe('encode'):
+                    return self._encode_png()
+            finally:
+                for ax_graph in self.graph_axes:
+                    ax_graph.cla()
+                    ax_graph.axis('on')
+                    ax_graph.set_visible(False)
+                for text in self.footers:
+                    text.set_text('')
+
+    def _encode_png(self) -> bytes:
+        """PNG of the canvas cropped to its content, like bbox_inches='tight'."""
+        from PIL import Image
+
+        buffer = self.canvas.buffer_rgba()
+        # One uint32 per pixel; opaque white is all bits set
+        pixels = np.asarray(buffer).view(np.uint32)[:, :, 0]
+        inked = pixels != 0xFFFFFFFF
+        rows = np.flatnonzero(inked.any(axis=1))
+        cols = np.flatnonzero(inked.any(axis=0))
+        pad = int(round(0.1 * self.dpi))
+        height, width = pixels.shape
+        box = (max(cols[0] - pad, 0), max(rows[0] - pad, 0),
+               min(cols[-1] + pad + 1, width), min(rows[-1] + pad + 1, height))
+        
+        image = Image.frombuffer('RGBA', (width, height), buffer, 'raw', 'RGBA', 0, 1)
+        buf = BytesIO()
+        # The figure is opaque, so the alpha channel carries nothing
+        image.crop(box).convert('RGB').save(buf, format='png', dpi=(self.dpi, self.dpi))
+        return buf.getvalue()
+
+
+_report_templates = {}
+_report_templates_lock = threading.Lock()
+
+
+def get_report_template(sections, dpi: int) -> ReportTemplate:
+    """Return the process-wide template for the current figure settings."""
+    key = canonical_digest(CONFIG['figure'], CONFIG['text'], sections, dpi)
+    with _report_templates_lock:
+        template = _report_templates.get(key)
+        if template is None:
+            template = ReportTemplate(sections, dpi)
+            _report_templates[key] = template
+    return template
+
+
+def create_report_series(views: EvokedViews, rows, footer_lines):
+    """Report content as JSON time series for client-side plotting."""
+    sections = []
+    for row in rows:
+        section = row['section']
+        entry = {
+            'comp': section['comp'],
+            'ch': section['ch'],
+            'title': section['title'],
+            'desc': section['desc'],
+            'color': section['color'],
+            'window': [float(t) for t in row['window']],
+            'p300': row['p300'],
+            'measures': row['components'],
+            'target_uv': None,
+            'nontarget_uv': None,
+            'target_sem_uv': None,
+            'nontarget_sem_uv': None
+        }
+        if row['available']:
+            target, nontarget = views.channel(section['ch'])
+            entry['target_uv'] = np.round(target.data[0] * 1e6, 3).tolist()
+            entry['nontarget_uv'] = np.round(nontarget.data[0] * 1e6, 3).tolist()
+            target_sem, nontarget_sem = views.std_errors(section['ch'])
+            if target_sem is not None:
+                entry['target_sem_uv'] = np.round(target_sem * 1e6, 3).tolist()
+            if nontarget_sem is not None:
+                entry['nontarget_sem_uv'] = np.round(nontarget_sem * 1e6, 3).tolist()
+        sections.append(entry)
+    
+    return {
+        'title': REPORT_TITLE,
+        'summary': REPORT_SUMMARY,
+        'times': np.round(views.times, 4).tolist(),
+        'sections': sections,
+        'footer': list(footer_lines)
+    }
+
+
+def create_report_figure(evoked_target, evoked_nontarget, sections,
+                         rejection_stats, target_count, nontarget_count,
+                         output_format: str = 'png', timings: StageTimings = None,
+                         std_errors=None, statistics: dict = None, components=None):
+    """Generate the report in one of REPORT_FORMATS.
+
+    ``std_errors`` is the optional ``(target, nontarget)`` standard error
+    of each average, plotted as bands; ``statistics`` the optional
+    p300_statistics() shown with the P300 score; ``components`` the optional
+    component_table() added to the JSON series. Returns ``(payload, p300_score_txt)``:
+    the base64 image for 'png', 'preview' and 'svg', or the time series dict
+    for 'json'.
+    """
+    timings = timings or StageTimings()
+    with timings.probe('peak_detection'):
+        views = EvokedViews(evoked_target, evoked_nontarget, sections, std_errors)
+        rows, p300_score_txt = report_rows(views, sections, statistics, components)
+    footer_lines = report_footer(rejection_stats, target_count, nontarget_count)
     
-    fig.text(0.5, 0.02, footer_line1, ha='center', fontsize=10, color='#7f8c8d')
-    fig.text(0.5, 0.005, footer_line2, ha='center', fontsize=9,
-             style='italic', color='#95a5a6')
+    if output_format == 'json':
+        with timings.probe('encode'):
+            return create_report_series(views, rows, footer_lines), p300_score_txt
     
-    # Export to base64
-    buf = BytesIO()
-    plt.savefig(buf, format="png", bbox_inches='tight',
-                dpi=CONFIG['figure']['dpi'])
-    plt.close(fig)
-    buf.seek(0)
-    img_str = base64.b64encode(buf.read()).decode("utf-8")
+    dpi = CONFIG['figure']['preview_dpi'] if output_format == 'preview' else CONFIG['figure']['dpi']
+    with timings.probe('render'):
+        template = get_report_template(sections, dpi)
+    image = template.render(views, rows, footer_lines,
+                            'svg' if output_format == 'svg' else 'png', timings)
+    with timings.probe('encode'):
+        img_str = base64.b64encode(image).decode("utf-8")
     
     return img_str, p300_score_txt
 
@@ -490,68 +1450,314 @@ def cleanup_resources(raw, epochs, evoked_target, evoked_nontarget):
     """Clean up memory resources after analysis."""
     try:
         del raw, epochs, evoked_target, evoked_nontarget
-        plt.close('all')
+        # Only a process that plotted has pyplot (and figures to close)
+        if 'matplotlib.pyplot' in sys.modules:
+            sys.modules['matplotlib.pyplot'].close('all')
         gc.collect()
     except:
         pass
 
 # ============================================================================
-# API ENDPOINTS
+# STAGED PIPELINE CACHE
 # ============================================================================
 
-@app.get("/")
-def read_root():
-    return {"status": "EEG Server is Running!"}
+def streaming_enabled() -> bool:
+    """Whether epochs are filtered block by block; only the FIR filter streams."""
+    return CONFIG['streaming']['enabled'] and CONFIG['filter']['method'] == 'fir'
 
 
-@app.post("/analyze")
-def analyze_eeg(cnt_file: UploadFile = File(...), exp_file: UploadFile = File(...)):
-    """Analyze EEG data and generate Neuro-UX report."""
-    tmp_cnt_path = None
-    tmp_exp_path = None
-    raw = None
-    epochs = None
-    evoked_target = None
-    evoked_nontarget = None
+def stage_config(stage: str):
+    """CONFIG slice that determines the output of a pipeline stage."""
+    if stage == 'raw':
+        return [PIPELINE_VERSION, CONFIG['channels']]
+    if stage == 'filtered':
+        # n_jobs and chunk size change speed, not output
+        return {'low': CONFIG['filter']['low'], 'high': CONFIG['filter']['high'],
+                'method': CONFIG['filter']['method'],
+                'precision': CONFIG['filter']['precision'],
+                'streaming': streaming_enabled()}
+    if stage == 'epochs':
+        return CONFIG['epoch']
+    if stage == 'evokeds':
+        return CONFIG['rejection']
+    if stage == 'statistics':
+        # n_jobs changes speed, not output (chunks are seeded independently)
+        settings = {k: v for k, v in CONFIG['statistics'].items() if k != 'n_jobs'}
+        return [settings, CONFIG['p300'], p300_channel()]
+    return [CONFIG['p300'], CONFIG['components'], CONFIG['figure'], CONFIG['text'],
+            CONFIG['thresholds'], ANALYSIS_SECTIONS]
+
+
+def stage_keys(cnt_digest: str, exp_digest: str, output_format: str = 'png') -> dict:
+    """Cache key of every pipeline stage for the current CONFIG."""
+    keys = {}
+    keys['raw'] = StageCache.key('raw', cnt_digest, stage_config('raw'))
+    keys['filtered'] = StageCache.key('filtered', keys['raw'], stage_config('filtered'))
+    keys['epochs'] = StageCache.key('epochs', combine_digests(keys['filtered'], exp_digest),
+                                    stage_config('epochs'))
+    keys['evokeds'] = StageCache.key('evokeds', keys['epochs'], stage_config('evokeds'))
+    keys['statistics'] = StageCache.key('statistics', keys['evokeds'],
+                                        stage_config('statistics'))
+    keys['report'] = StageCache.key('report', keys['statistics'],
+                                    [stage_config('report'), output_format])
+    return keys
+
+
+def _write_json(path: str, payload):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(payload, f)
+
+
+def _read_json(path: str):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_raw_stage(entry: str, raw):
+    """Store continuous data as .npy next to its info and annotations."""
+    # raw._data avoids the full copy raw.get_data() would make
+    np.save(os.path.join(entry, 'data.npy'), raw._data)
+    mne.io.write_info(os.path.join(entry, 'raw-info.fif'), raw.info)
     
-    try:
-        # Validate inputs
-        validate_uploaded_files(cnt_file, exp_file)
+    annot = raw.annotations
+    np.savez(os.path.join(entry, 'annotations.npz'),
+             onset=annot.onset,
+             duration=annot.duration,
+             description=np.asarray(annot.description, dtype=str))
+    orig_time = annot.orig_time.timestamp() if annot.orig_time is not None else None
+    _write_json(os.path.join(entry, 'meta.json'), {'orig_time': orig_time})
+
+
+def load_raw_stage(entry: str, writable: bool = False):
+    """Rebuild a Raw from a stored stage with its data memory-mapped.
+
+    ``writable`` maps the data copy-on-write so in-place filtering works
+    without touching the cached file.
+    """
+    data = np.load(os.path.join(entry, 'data.npy'), mmap_mode='c' if writable else 'r')
+    info = mne.io.read_info(os.path.join(entry, 'raw-info.fif'), verbose=False)
+    raw = mne.io.RawArray(data, info, verbose=False)
+    
+    annot = np.load(os.path.join(entry, 'annotations.npz'))
+    meta = _read_json(os.path.join(entry, 'meta.json'))
+    raw.set_annotations(mne.Annotations(
+        onset=annot['onset'],
+        duration=annot['duration'],
+        description=annot['description'],
+        orig_time=meta['orig_time']
+    ))
+    return raw
+
+
+def save_evokeds_stage(entry: str, averages: EvokedAccumulator, summary: dict):
+    """Store the running condition statistics and the rejection summary."""
+    averages.save(entry)
+    _write_json(os.path.join(entry, 'meta.json'), summary)
+
+
+def load_evokeds_stage(entry: str, mmap_mode: str = None):
+    """Rebuild stored condition statistics and the rejection summary."""
+    return (EvokedAccumulator.load(entry, mmap_mode=mmap_mode),
+            _read_json(os.path.join(entry, 'meta.json')))
+
+
+def save_statistics_stage(entry: str, statistics: dict):
+    _write_json(os.path.join(entry, 'statistics.json'), statistics)
+
+
+def load_statistics_stage(entry: str):
+    return _read_json(os.path.join(entry, 'statistics.json'))
+
+# ============================================================================
+# ANALYSIS PIPELINE
+# ============================================================================
+
+def lookup_stage(stage: str, keys: dict, reused: list):
+    """Return the cache entry for a stage, recording it in ``reused`` on a hit."""
+    stages = get_stage_cache()
+    entry = stages.lookup(stage, keys[stage]) if stages is not None else None
+    if entry is not None:
+        reused.append(stage)
+    return entry
+
+
+@contextmanager
+def storing_stage(stage: str, keys: dict):
+    """Yield a directory to write a stage into, or None if caching is off."""
+    stages = get_stage_cache()
+    if stages is None:
+        yield None
+        return
+    with stages.writing(stage, keys[stage]) as entry:
+        yield entry
+
+
+def compute_evokeds(cnt_path: str, exp_path: str, keys: dict, reused: list,
+                    progress=None, timings: StageTimings = None):
+    """Run the pipeline up to the condition averages.
+
+    Each stage (decoded raw, filtered raw, epochs, evokeds) is looked up in
+    the stage cache under a key built from its inputs and the CONFIG slice
+    it depends on, so only stages downstream of a changed setting are
+    recomputed.
+
+    Independent work overlaps on a small thread pool: the .exp file is
+    parsed while the recording loads, events are mapped while the data is
+    filtered, and cache writes run alongside the following stages.
+
+    Returns the Target and Non-Target running statistics (an
+    EvokedAccumulator), the rejection summary with the P300 reliability
+    statistics under "statistics" (see p300_statistics), and the parsed .exp
+    file as ``(trials, stats)``. Stage durations and memory are recorded in
+    ``timings``.
+    """
+    timings = timings or StageTimings()
+    
+    def report(stage: str):
+        if progress is not None:
+            progress(stage)
+
+    background = ThreadPoolExecutor(max_workers=3)
+    pending_writes = []
+
+    def store_in_background(stage: str, save, *args):
+        """Write a stage whose data is no longer modified, off the main path."""
+        def write():
+            try:
+                with timings.probe('cache_write'), storing_stage(stage, keys) as entry:
+                    if entry is not None:
+                        save(entry, *args)
+            except OSError as e:
+                logger.warning("Could not cache %s stage: %s", stage, e)
         
-        # Save uploads to temporary files
-        tmp_cnt_path = save_upload_to_temp(cnt_file, ".cnt")
-        tmp_exp_path = save_upload_to_temp(exp_file, ".exp")
+        if get_stage_cache() is not None:
+            pending_writes.append(background.submit(write))
+
+    def parse_exp():
+        with timings.probe('exp_parse'):
+            return parse_experiment_file(exp_path)
+
+    def map_events(raw):
+        """map_events_to_codes() plus each event's .exp trial row."""
+        trials = exp_future.result()[0]
+        with timings.probe('event_mapping'):
+            return (*map_events_to_codes(raw, trials), event_trial_rows(raw, trials))
+
+    def open_cnt(preload: bool):
+        report('loading')
+        with timings.probe('cnt_decode'):
+            try:
+                from cntreader import read_cnt
+                # Reads the header and events only; samples stay memory-mapped
+                raw = read_cnt(cnt_path, preload=False)
+            except Exception as e:
+                raise AnalysisError(f"Failed to load .cnt file: {str(e)}")
+            
+            # Pick before loading so unused channels are never held in memory
+            raw = pick_analysis_channels(raw)
+            if preload:
+                raw.load_data(verbose=False)
+        return raw
+
+    def get_raw():
+        entry = lookup_stage('raw', keys, reused)
+        if entry is not None:
+            report('loading')
+            with timings.probe('cache_load'):
+                return load_raw_stage(entry, writable=True)
         
-        # Load EEG data
-        try:
-            raw = mne.io.read_raw_cnt(tmp_cnt_path, preload=True, verbose=False)
-        except Exception as e:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Failed to load .cnt file: {str(e)}"
+        raw = open_cnt(preload=True)
+        with timings.probe('cache_write'), storing_stage('raw', keys) as entry:
+            if entry is not None:
+                save_raw_stage(entry, raw)
+        return raw
+
+    def get_filtered_raw():
+        """Return the filtered Raw and, if already started, its event mapping."""
+        entry = lookup_stage('filtered', keys, reused)
+        if entry is not None:
+            with timings.probe('cache_load'):
+                return load_raw_stage(entry), None
+        
+        raw = get_raw()
+        
+        # Event mapping only reads the annotations, so it runs while filtering
+        events_future = background.submit(map_events, raw)
+        
+        # Apply bandpass filter
+        report('filtering')
+        with timings.probe('filter'):
+            filter_raw(
+                raw,
+                CONFIG['filter']['low'],
+                CONFIG['filter']['high'],
+                method=CONFIG['filter']['method'],
+                precision=CONFIG['filter']['precision'],
+                n_jobs=filter_n_jobs()
             )
+        store_in_background('filtered', save_raw_stage, raw)
+        return raw, events_future
+
+    def get_epochs():
+        """Return the EpochStore, memory-mapped from the stage cache when enabled."""
+        entry = lookup_stage('epochs', keys, reused)
+        if entry is not None:
+            with timings.probe('cache_load'):
+                return EpochStore.open(entry)
         
-        # Parse experiment file
-        trial_type_map, reaction_times = parse_experiment_file(tmp_exp_path)
-        easiest_txt, toughest_txt = calculate_task_extremes(reaction_times)
+        streaming = streaming_enabled()
+        if CONFIG['streaming']['enabled'] and not streaming:
+            logger.warning("Streaming needs the FIR filter; filtering the preloaded "
+                           "recording with '%s' instead", CONFIG['filter']['method'])
+        if streaming:
+            # Filtering happens inside the epoching pass below
+            raw = open_cnt(preload=False)
+            events_future = None
+        else:
+            raw, events_future = get_filtered_raw()
         
         # Map events to codes
-        custom_events, event_ids = map_events_to_codes(raw, trial_type_map)
+        report('mapping_events')
+        if events_future is not None:
+            custom_events, event_ids, unmatched, trial_rows = events_future.result()
+        else:
+            custom_events, event_ids, unmatched, trial_rows = map_events(raw)
         
         if custom_events is None:
-            return {"error": "No matching events found in .exp file. Check server logs for details."}
+            raise AnalysisError("No matching events found in .exp file. Check server logs for details.")
         
-        # Apply bandpass filter
-        raw.filter(
-            CONFIG['filter']['low'],
-            CONFIG['filter']['high'],
-            picks='eeg',
-            n_jobs=CONFIG['filter']['n_jobs'],
-            verbose=False
-        )
-        
-        # Create epochs with artifact rejection
-        epochs = mne.Epochs(
+        # Create epochs; rejection runs in the next stage so the threshold
+        # can change without re-epoching
+        report('epoching')
+        # In streaming mode this stage includes the filtering
+        with timings.probe('epoching'):
+            epochs = epoch_raw(raw, custom_events, event_ids, streaming)
+        del raw
+        with timings.probe('rejection'):
+            features = epoch_features(epochs.get_data(copy=False), epochs.info['sfreq'])
+        index = epoch_index(epochs, exp_future.result()[0], trial_rows, features)
+        meta = {'total_events': len(custom_events), 'unmatched_events': unmatched}
+        # The float64 epochs are dropped once the float32 store is written
+        with timings.probe('cache_write'), storing_stage('epochs', keys) as entry:
+            store = EpochStore.from_epochs(epochs, index, meta, directory=entry)
+        del epochs
+        return store
+
+    def epoch_raw(raw, custom_events, event_ids, streaming: bool):
+        if streaming:
+            return stream_epochs(
+                raw,
+                custom_events,
+                event_ids,
+                low=CONFIG['filter']['low'],
+                high=CONFIG['filter']['high'],
+                tmin=CONFIG['epoch']['tmin'],
+                tmax=CONFIG['epoch']['tmax'],
+                baseline=CONFIG['epoch']['baseline'],
+                chunk_samples=int(CONFIG['streaming']['chunk_seconds'] * raw.info['sfreq']),
+                n_jobs=filter_n_jobs()
+            )
+        return mne.Epochs(
             raw,
             custom_events,
             event_ids,
@@ -559,49 +1765,364 @@ def analyze_eeg(cnt_file: UploadFile = File(...), exp_file: UploadFile = File(..
             tmax=CONFIG['epoch']['tmax'],
             baseline=CONFIG['epoch']['baseline'],
             picks='eeg',
-            reject=CONFIG['rejection'],
+            reject=None,
             preload=True,
             verbose=False
         )
+
+    def get_evokeds():
+        """Return the averages, the summary and, if computed, p300_trials()."""
+        entry = lookup_stage('evokeds', keys, reused)
+        if entry is not None:
+            with timings.probe('cache_load'):
+                return (*load_evokeds_stage(entry), None)
+        
+        epochs = get_epochs()
+        total_events = epochs.meta['total_events']
+        unmatched = epochs.meta['unmatched_events']
+        
+        # Artifact rejection decides on the cached features; no epoch is copied
+        with timings.probe('rejection'):
+            keep, diagnostics = reject_epochs(epochs.features, epochs.ch_names,
+                                              CONFIG['rejection'])
         
         # Calculate rejection statistics
-        rejection_stats = calculate_rejection_stats(len(custom_events), epochs)
+        rejection_stats = calculate_rejection_stats(total_events, int(keep.sum()))
+        for worst in diagnostics['worst_channels'][:1]:
+            if worst['only_cause'] * 2 >= total_events:
+                logger.warning("Channel %s alone rejected %d/%d epochs", worst['channel'],
+                               worst['only_cause'], total_events)
         
         # Check if any epochs survived
-        if len(epochs) == 0:
-            return {"error": "All trials were rejected due to artifacts (too much noise)."}
+        if not keep.any():
+            raise AnalysisError("All trials were rejected due to artifacts (too much noise).")
+        
+        # Average epochs to get ERPs, keeping their spread for the SE bands
+        report('averaging')
+        with timings.probe('averaging'):
+            averages = EvokedAccumulator.from_epochs(epochs, keep=keep)
+        trials = p300_trials(epochs, keep)
+        del epochs
         
         # Check trial balance
-        target_count = len(epochs['Target'])
-        nontarget_count = len(epochs['Non-Target'])
+        target_count = averages.count('Target')
+        nontarget_count = averages.count('Non-Target')
+        for condition in ('Target', 'Non-Target'):
+            if averages.count(condition) == 0:
+                raise AnalysisError(f"No clean {condition} epochs left after artifact rejection.")
         
-        if (target_count < CONFIG['thresholds']['low_trial_warning'] or
-            nontarget_count < CONFIG['thresholds']['low_trial_warning']):
-            print(f"WARNING: Low trial count (Target: {target_count}, Non-Target: {nontarget_count}) may affect reliability")
+        summary = {
+            'rejection_stats': rejection_stats,
+            'target_count': target_count,
+            'nontarget_count': nontarget_count,
+            'unmatched_events': unmatched,
+            'rejection_diagnostics': diagnostics
+        }
+        store_in_background('evokeds', save_evokeds_stage, averages, summary)
+        return averages, summary, trials
+
+    def get_statistics(trials):
+        entry = lookup_stage('statistics', keys, reused)
+        if entry is not None:
+            with timings.probe('cache_load'):
+                return load_statistics_stage(entry)
+        
+        if trials is None:
+            # Averages came from the cache; the single trials are re-read
+            # from the (memory-mapped) epochs stage
+            epochs = get_epochs()
+            keep, _ = reject_epochs(epochs.features, epochs.ch_names, CONFIG['rejection'])
+            trials = p300_trials(epochs, keep)
+            del epochs
         
-        # Average epochs to get ERPs
-        evoked_target = epochs['Target'].average()
-        evoked_nontarget = epochs['Non-Target'].average()
+        report('statistics')
+        statistics = p300_statistics(trials, timings)
+        store_in_background('statistics', save_statistics_stage, statistics)
+        return statistics
+
+    try:
+        # Parse experiment file
+        report('parsing')
+        exp_future = background.submit(parse_exp)
         
-        # Generate report figure
+        averages, summary, trials = get_evokeds()
+        # A copy, so the summary being cached in the background is not touched
+        summary = dict(summary, statistics=get_statistics(trials))
+        experiment = exp_future.result()
+        
+        for write in pending_writes:
+            write.result()
+        
+        return averages, summary, experiment
+    
+    finally:
+        background.shutdown(wait=True)
+
+
+def run_analysis(cnt_path: str, exp_path: str, cnt_digest: str = None,
+                 exp_digest: str = None, progress=None, output_format: str = 'png',
+                 timings: StageTimings = None):
+    """Run the full pipeline on saved uploads and return the response payload.
+
+    The finished report is itself a cached stage; on a miss the evokeds come
+    from compute_evokeds() and only the report is rendered here, in one of
+    REPORT_FORMATS ('json' returns time series under "series", no image).
+    Per-stage durations and memory are returned in ``metadata.timings``.
+    """
+    timings = timings or StageTimings()
+    if cnt_digest is None or exp_digest is None:
+        with timings.probe('hashing'):
+            cnt_digest = cnt_digest or file_digest(cnt_path)
+            exp_digest = exp_digest or file_digest(exp_path)
+    keys = stage_keys(cnt_digest, exp_digest, output_format)
+    reused = []
+
+    evoked_target = None
+    evoked_nontarget = None
+
+    try:
+        entry = lookup_stage('report', keys, reused)
+        if entry is not None:
+            if progress is not None:
+                progress('rendering')
+            with timings.probe('cache_load'):
+                result = _read_json(os.path.join(entry, 'payload.json'))
+        else:
+            averages, summary, experiment = compute_evokeds(
+                cnt_path, exp_path, keys, reused, progress=progress, timings=timings
+            )
+            evoked_target = averages.evoked('Target')
+            evoked_nontarget = averages.evoked('Non-Target')
+            rejection_stats = summary['rejection_stats']
+            target_count = summary['target_count']
+            nontarget_count = summary['nontarget_count']
+            trials, exp_stats = experiment
+            easiest_txt, toughest_txt = calculate_task_extremes(trials)
+            
+            if (target_count < CONFIG['thresholds']['low_trial_warning'] or
+                nontarget_count < CONFIG['thresholds']['low_trial_warning']):
+                logger.warning("Low trial count (Target: %d, Non-Target: %d) may affect "
+                               "reliability", target_count, nontarget_count)
+            
+            with timings.probe('peak_detection'):
+                components = component_table(
+                    component_measures(averages.stacked_means(CONDITIONS), averages.times,
+                                       ANALYSIS_SECTIONS),
+                    averages.ch_names, ANALYSIS_SECTIONS
+                )
+            
+            # Generate report figure
+            if progress is not None:
+                progress('rendering')
+            report, p300_score_txt = create_report_figure(
+                evoked_target,
+                evoked_nontarget,
+                ANALYSIS_SECTIONS,
+                rejection_stats,
+                target_count,
+                nontarget_count,
+                output_format,
+                timings,
+                std_errors=(averages.std_error('Target'), averages.std_error('Non-Target')),
+                statistics=summary['statistics'],
+                components=components
+            )
+            
+            result = {
+                "status": "success",
+                "format": output_format,
+                "image": None if output_format == 'json' else report,
+                "series": report if output_format == 'json' else None,
+                "easiest": easiest_txt,
+                "toughest": toughest_txt,
+                "neural_confidence_score": p300_score_txt,
+                "metadata": {
+                    "total_events_found": rejection_stats['total_events'],
+                    "clean_epochs_kept": rejection_stats['good_epochs'],
+                    "rejected_epochs": rejection_stats['dropped_epochs'],
+                    "drop_percentage": round(rejection_stats['drop_percentage'], 2),
+                    "target_epochs": target_count,
+                    "nontarget_epochs": nontarget_count,
+                    "rejection_threshold": f"{CONFIG['rejection']['eeg']*1e6:.0f}µV",
+                    "filter_range": f"{CONFIG['filter']['low']}-{CONFIG['filter']['high']}Hz",
+                    "channel_mode": CONFIG['channels']['mode'],
+                    "analyzed_channels": len(evoked_target.ch_names),
+                    "unmatched_events": summary['unmatched_events'],
+                    "rejection_diagnostics": summary['rejection_diagnostics'],
+                    "p300_statistics": summary['statistics'],
+                    "components": components,
+                    # Names the cached epochs for POST /trials/query
+                    "analysis_id": keys['epochs'],
+                    "exp_trials": exp_stats['trials'],
+                    "exp_unparseable_rows": exp_stats['unparseable_rows'],
+                    "exp_invalid_latencies": exp_stats['invalid_latencies']
+                }
+            }
+            with storing_stage('report', keys) as entry:
+                if entry is not None:
+                    _write_json(os.path.join(entry, 'payload.json'), result)
+        
+        result["metadata"]["stages_reused"] = reused
+        result["metadata"]["timings"] = timings.as_dict()
+        return result
+    
+    finally:
+        # Clean up resources
+        cleanup_resources(None, None, evoked_target, evoked_nontarget)
+
+
+def analysis_job(cnt_path: str, exp_path: str, cnt_digest: str = None,
+                 exp_digest: str = None, overrides: dict = None,
+                 output_format: str = 'png', upload_timings: dict = None, progress=None):
+    """Job-runner entry point: analyze spooled uploads, then delete them.
+
+    ``upload_timings`` carries the stages measured in the API process
+    (receiving the upload) into the result's ``metadata.timings``.
+    """
+    try:
+        with config_overrides_applied(overrides or {}):
+            result = run_analysis(cnt_path, exp_path, cnt_digest, exp_digest,
+                                  progress=progress, output_format=output_format,
+                                  timings=StageTimings(upload_timings))
+        if overrides:
+            result["metadata"]["config_overrides"] = overrides
+        
+        # Store under the base CONFIG namespace, outside the overrides
+        cache = get_result_cache()
+        if cache is not None and cnt_digest is not None and exp_digest is not None:
+            try:
+                cache.put(result_cache_key(cnt_digest, exp_digest, overrides, output_format),
+                          result)
+            except OSError as e:
+                logger.warning("Could not store result in cache: %s", e)
+        
+        return result
+    except AnalysisError:
+        raise
+    except Exception:
+        logger.exception("Analysis failed")
+        raise
+    finally:
+        remove_request_dirs(cnt_path, exp_path)
+
+# ============================================================================
+# COHORT BATCHES
+# ============================================================================
+
+_batch_threads = {}
+_batch_lock = threading.Lock()
+
+
+def subject_job(cnt_path: str, exp_path: str, output_dir: str, progress=None):
+    """Job-runner entry point for one cohort subject.
+
+    Writes the subject's condition statistics to ``output_dir`` and returns
+    its epoch counts and P300 measures.
+    """
+    timings = StageTimings()
+    with timings.probe('hashing'):
+        keys = stage_keys(file_digest(cnt_path), file_digest(exp_path))
+    reused = []
+    evoked_target = None
+    try:
+        averages, summary, _ = compute_evokeds(
+            cnt_path, exp_path, keys, reused, progress=progress, timings=timings
+        )
+        evoked_target = averages.evoked('Target')
+        os.makedirs(output_dir, exist_ok=True)
+        save_evokeds_stage(output_dir, averages, {
+            'rejection_stats': summary['rejection_stats'],
+            'target_count': summary['target_count'],
+            'nontarget_count': summary['nontarget_count']
+        })
+        return {
+            'target_epochs': summary['target_count'],
+            'nontarget_epochs': summary['nontarget_count'],
+            'drop_percentage': round(summary['rejection_stats']['drop_percentage'], 2),
+            'rejection_diagnostics': summary['rejection_diagnostics'],
+            'p300': measure_p300(evoked_target),
+            'p300_statistics': summary['statistics'],
+            'analysis_id': keys['epochs'],
+            'stages_reused': reused,
+            'timings': timings.as_dict()
+        }
+    finally:
+        cleanup_resources(None, None, evoked_target, None)
+
+
+def cohort_job(subject_dirs, progress=None):
+    """Job-runner entry point: grand-average stored subjects into a report.
+
+    Component measures of every subject are taken in one pass over the
+    stacked subject averages and returned under "subject_components".
+    """
+    if progress is not None:
+        progress('averaging')
+    timings = StageTimings()
+    subjects, summaries = [], []
+    with timings.probe('cache_load'):
+        # Memory-mapped, so only the rows the grand average reads are paged in
+        for subject_dir in subject_dirs:
+            averages, summary = load_evokeds_stage(subject_dir, mmap_mode='r')
+            subjects.append(averages)
+            summaries.append(summary)
+    
+    with timings.probe('grand_average'):
+        grand = cohort.grand_average(subjects)
+        grand_target = grand.evoked('Target')
+        grand_nontarget = grand.evoked('Non-Target')
+    
+    with timings.probe('peak_detection'):
+        # Every subject, condition and channel in one vectorized pass
+        measures = component_measures(
+            cohort.stack_subject_means(subjects, grand.ch_names, CONDITIONS),
+            grand.times, ANALYSIS_SECTIONS
+        )
+        subject_components = {
+            os.path.basename(os.path.normpath(subject_dir)):
+                component_table({name: values[i] for name, values in measures.items()},
+                                grand.ch_names, ANALYSIS_SECTIONS)
+            for i, subject_dir in enumerate(subject_dirs)
+        }
+        spread_mean, spread_sd = cohort.measure_spread(measures)
+        components = component_table(
+            component_measures(grand.stacked_means(CONDITIONS), grand.times, ANALYSIS_SECTIONS),
+            grand.ch_names, ANALYSIS_SECTIONS
+        )
+    del subjects, measures
+    
+    rejection_stats = cohort.pool_rejection_stats(summaries)
+    target_count = sum(s['target_count'] for s in summaries)
+    nontarget_count = sum(s['nontarget_count'] for s in summaries)
+    
+    if progress is not None:
+        progress('rendering')
+    try:
         img_str, p300_score_txt = create_report_figure(
-            evoked_target,
-            evoked_nontarget,
+            grand_target,
+            grand_nontarget,
             ANALYSIS_SECTIONS,
             rejection_stats,
             target_count,
-            nontarget_count
+            nontarget_count,
+            timings=timings,
+            std_errors=(grand.std_error('Target'), grand.std_error('Non-Target')),
+            components=components
         )
-        
-        # Clean up resources
-        cleanup_resources(raw, epochs, evoked_target, evoked_nontarget)
-        
         return {
             "status": "success",
             "image": img_str,
-            "easiest": easiest_txt,
-            "toughest": toughest_txt,
             "neural_confidence_score": p300_score_txt,
+            "grand_average_p300": measure_p300(grand_target),
+            # Measured on the grand average
+            "components": components,
+            # Mean and SD of the per-subject measures
+            "component_summary": {
+                "mean": component_table(spread_mean, grand.ch_names, ANALYSIS_SECTIONS),
+                "sd": (component_table(spread_sd, grand.ch_names, ANALYSIS_SECTIONS)
+                       if spread_sd is not None else None)
+            },
+            "subject_components": subject_components,
             "metadata": {
                 "total_events_found": rejection_stats['total_events'],
                 "clean_epochs_kept": rejection_stats['good_epochs'],
@@ -610,34 +2131,857 @@ def analyze_eeg(cnt_file: UploadFile = File(...), exp_file: UploadFile = File(..
                 "target_epochs": target_count,
                 "nontarget_epochs": nontarget_count,
                 "rejection_threshold": f"{CONFIG['rejection']['eeg']*1e6:.0f}µV",
-                "filter_range": f"{CONFIG['filter']['low']}-{CONFIG['filter']['high']}Hz"
+                "filter_range": f"{CONFIG['filter']['low']}-{CONFIG['filter']['high']}Hz",
+                "channel_mode": CONFIG['channels']['mode'],
+                "analyzed_channels": len(grand_target.ch_names),
+                "timings": timings.as_dict()
             }
         }
+    finally:
+        cleanup_resources(None, None, grand_target, grand_nontarget)
+
+
+def submit_to_runner(func, *args) -> Future:
+    """Submit a job to the shared runner and return a Future for its result."""
+    future = Future()
+    kind = func.__name__.replace('_job', '')
+    
+    def done(task):
+        # The pooled cohort drop rate would count every subject twice
+        metrics.observe_job(kind, task, record_rejection=kind != 'cohort')
+        if task['status'] == 'done':
+            future.set_result(task['result'])
+        else:
+            future.set_exception(AnalysisError(task['error']))
     
+    future.task_id = get_job_runner().submit(func, *args, on_done=done)
+    return future
+
+
+def batch_directory(batch_id: str) -> str:
+    """Directory of a batch; rejects ids that are not plain hex."""
+    if not batch_id or not all(c in '0123456789abcdef' for c in batch_id):
+        raise HTTPException(status_code=404, detail="Unknown batch id")
+    return os.path.join(CONFIG['batch']['directory'], batch_id)
+
+
+def start_batch(store: cohort.BatchStore):
+    """Run a batch on a coordinator thread unless it is already running."""
+    batch_id = os.path.basename(store.directory)
+    
+    def coordinate():
+        try:
+            manifest = cohort.run_batch(store, submit_to_runner, subject_job, cohort_job,
+                                        CONFIG['jobs']['max_workers'])
+            # Uploads are only needed to retry failed subjects
+            if manifest['status'] == 'done':
+                shutil.rmtree(os.path.join(store.directory, 'inputs'), ignore_errors=True)
+        except Exception:
+            logger.exception("Batch %s coordinator crashed", batch_id)
+            store.update(status='failed', error="Batch coordinator crashed")
+        finally:
+            with _batch_lock:
+                _batch_threads.pop(batch_id, None)
+    
+    with _batch_lock:
+        if batch_id in _batch_threads:
+            return False
+        thread = threading.Thread(target=coordinate, daemon=True)
+        _batch_threads[batch_id] = thread
+    thread.start()
+    return True
+
+# ============================================================================
+# TRIAL QUERIES
+# ============================================================================
+#
+# POST /trials/query re-averages subsets of an analysis's cached epochs,
+# e.g. the fastest vs the slowest 20% of responses, without a new upload.
+# An analysis is named by the "analysis_id" in its result metadata (the key
+# of its epochs stage); the query opens that EpochStore memory-mapped,
+# selects epochs with trialquery filters and averages only those, so it
+# takes milliseconds. Request body:
+#   {"analysis_id": "...",
+#    "subsets": {"easiest": {"rt_quantile": [0, 0.2]},
+#                "toughest": {"rt_quantile": [0.8, 1]}},
+#    "config_overrides": {"rejection": {"eeg": 8e-5}}}   (optional)
+# Every subset gets its epoch counts, reaction times, P300 score, component
+# measures and Target/Non-Target ERPs (µV) of the report channels.
+
+TRIAL_QUERY_MAX_SUBSETS = 8
+
+ANALYSIS_ID_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+
+def query_trials(store: EpochStore, subsets: dict, thresholds: dict) -> dict:
+    """Averages and P300 measures of each named trial filter of ``subsets``.
+
+    ``thresholds`` are the rejection settings (see reject_epochs); rejected
+    epochs are left out of every subset.
+    """
+    started = time.perf_counter()
+    keep, _ = reject_epochs(store.features, store.ch_names, thresholds)
+    reaction_time = store.index['reaction_time']
+    channels = [ch for ch in report_channels() if ch in store.ch_names]
+    
+    results = {}
+    for name, spec in subsets.items():
+        matched = trialquery.trial_mask(store, spec)
+        selected = matched & keep
+        averages = EvokedAccumulator(store.info, store.tmin, len(store.times))
+        averages.add_epochs(store, keep=selected)
+        evoked_target = averages.evoked('Target')
+        
+        rts = reaction_time[selected]
+        rts = rts[np.isfinite(rts)]
+        means = averages.stacked_means(CONDITIONS)
+        results[name] = {
+            'filter': spec,
+            'matched_epochs': int(matched.sum()),
+            'rejected_epochs': int((matched & ~keep).sum()),
+            'target_epochs': averages.count('Target'),
+            'nontarget_epochs': averages.count('Non-Target'),
+            'reaction_time_ms': {
+                'mean': round(float(rts.mean()), 1),
+                'median': round(float(np.median(rts)), 1)
+            } if len(rts) else None,
+            'p300': measure_p300(evoked_target) if evoked_target is not None else None,
+            'components': component_table(
+                component_measures(means, averages.times, ANALYSIS_SECTIONS),
+                averages.ch_names, ANALYSIS_SECTIONS
+            ),
+            'erp': {
+                ch: {
+                    condition: (np.round(means[c, store.ch_names.index(ch)] * 1e6, 3).tolist()
+                                if averages.count(condition) else None)
+                    for c, condition in enumerate(CONDITIONS)
+                }
+                for ch in channels
+            }
+        }
+    
+    return {
+        'times': np.round(store.times, 6).tolist(),
+        'subsets': results,
+        'duration_ms': round((time.perf_counter() - started) * 1000, 1)
+    }
+
+
+def run_trial_query(body) -> dict:
+    """Validate a POST /trials/query body and run it on the cached epochs."""
+    if not isinstance(body, dict):
+        raise HTTPException(status_code=400, detail="Request body must be a JSON object")
+    analysis_id = body.get('analysis_id')
+    if not isinstance(analysis_id, str) or not ANALYSIS_ID_PATTERN.match(analysis_id):
+        raise HTTPException(status_code=400, detail="analysis_id must be a 64-character hex key")
+    
+    subsets = body.get('subsets')
+    if not isinstance(subsets, dict) or not subsets:
+        raise HTTPException(status_code=400, detail="subsets must map names to trial filters")
+    if len(subsets) > TRIAL_QUERY_MAX_SUBSETS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {TRIAL_QUERY_MAX_SUBSETS} subsets per query"
+        )
+    for name, spec in subsets.items():
+        try:
+            trialquery.validate_filter(spec)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Subset '{name}': {e}")
+    
+    overrides = validate_config_overrides(body.get('config_overrides') or {},
+                                          sections=('rejection',))
+    thresholds = dict(CONFIG['rejection'], **overrides.get('rejection', {}))
+    
+    stages = get_stage_cache()
+    entry = stages.lookup('epochs', analysis_id) if stages is not None else None
+    if entry is None:
+        raise HTTPException(
+            status_code=404,
+            detail="No cached epochs for this analysis_id; run the analysis again"
+        )
+    store = EpochStore.open(entry)
+    return {"analysis_id": analysis_id, **query_trials(store, subsets, thresholds)}
+
+# ============================================================================
+# REAL-TIME SESSIONS
+# ============================================================================
+#
+# GET /realtime (WebSocket) watches ERPs build up during a recording; the
+# signal processing lives in realtime.py. Protocol, JSON unless noted:
+#   client: {"type": "start", "sfreq": 500, "ch_names": [...], "units": "uV",
+#            "update_interval": 1.0, "conditions": {"12001": "Target", ...}}
+#   server: {"type": "ready", "channels", "times", "delay_seconds", ...}
+#   client: binary frames of little-endian float32 samples, interleaved
+#           (sample by sample, all channels each), and
+#           {"type": "events", "events": [{"sample": 1234, "code": "12001"}]}
+#           where an event names either a "condition" or a "code" listed in
+#           the start message's "conditions"
+#   server: {"type": "update", ...} at most once per update interval, when
+#           epochs were added or rejected; "erp" and "sem" hold the running
+#           averages and their standard errors in µV per report channel
+#   client: {"type": "stop"}; server: {"type": "final", ...} and closes
+
+REALTIME_UNITS = {'V': 1.0, 'uV': 1e-6, 'µV': 1e-6}
+
+_realtime_sessions = 0
+_realtime_lock = threading.Lock()
+
+
+def acquire_realtime_slot() -> bool:
+    global _realtime_sessions
+    with _realtime_lock:
+        if _realtime_sessions >= CONFIG['realtime']['max_sessions']:
+            return False
+        _realtime_sessions += 1
+        return True
+
+
+def release_realtime_slot():
+    global _realtime_sessions
+    with _realtime_lock:
+        _realtime_sessions -= 1
+
+
+class RealtimeStream:
+    """Protocol state of one /realtime connection around a RealtimeSession."""
+
+    def __init__(self, message: dict):
+        """Set up from the client's start message; raises ValueError if invalid."""
+        if not isinstance(message, dict):
+            raise ValueError("The start message must be a JSON object")
+        ch_names = message.get('ch_names')
+        if not isinstance(ch_names, list) or not ch_names:
+            raise ValueError("'ch_names' must be a non-empty list")
+        self.ch_names = [str(ch) for ch in ch_names]
+        try:
+            sfreq = float(message.get('sfreq'))
+            interval = float(message.get('update_interval',
+                                         CONFIG['realtime']['update_interval']))
+        except (TypeError, ValueError):
+            raise ValueError("'sfreq' and 'update_interval' must be numbers")
+        if not sfreq > 0:
+            raise ValueError("'sfreq' must be positive")
+        units = message.get('units', 'V')
+        if units not in REALTIME_UNITS:
+            raise ValueError(f"'units' must be one of {sorted(REALTIME_UNITS)}")
+        self.scale = REALTIME_UNITS[units]
+        self.update_interval = max(interval, CONFIG['realtime']['min_update_interval'])
+
+        conditions = message.get('conditions') or {}
+        if not isinstance(conditions, dict):
+            raise ValueError("'conditions' must map event codes to conditions")
+        self.conditions = {}
+        for code, condition in conditions.items():
+            if condition not in realtime.CONDITIONS:
+                raise ValueError(f"Condition must be one of {list(realtime.CONDITIONS)}")
+            self.conditions[normalize_annotation_code(str(code))] = condition
+        self.unmatched = {}
+
+        # Same channel selection as pick_analysis_channels()
+        picks = list(range(len(self.ch_names)))
+        if CONFIG['channels']['mode'] == 'report':
+            wanted = [self.ch_names.index(ch) for ch in report_channels() if ch in self.ch_names]
+            if wanted:
+                picks = wanted
+            else:
+                logger.warning("None of %s streamed, using all channels", report_channels())
+
+        try:
+            self.session = realtime.RealtimeSession(
+                self.ch_names, picks, sfreq,
+                CONFIG['filter']['low'], CONFIG['filter']['high'],
+                CONFIG['epoch']['tmin'], CONFIG['epoch']['tmax'], CONFIG['epoch']['baseline'],
+                reject=CONFIG['rejection'],
+                event_lag=CONFIG['realtime']['event_lag_seconds']
+            )
+        except ValueError as e:
+            raise ValueError(f"Cannot filter at this sampling rate: {e}")
+
+    def ready_message(self) -> dict:
+        session = self.session
+        return {
+            "type": "ready",
+            "channels": session.info.ch_names,
+            "times": np.round(session.times, 6).tolist(),
+            "delay_seconds": round(session.delay_seconds, 3),
+            "update_interval": self.update_interval,
+            "rejection_threshold_uv": CONFIG['rejection']['eeg'] * 1e6
+        }
+
+    def decode_block(self, data: bytes) -> np.ndarray:
+        """(channels x samples) block in volts from one binary frame."""
+        n_channels = len(self.ch_names)
+        if len(data) % (4 * n_channels):
+            raise ValueError(f"Frame of {len(data)} bytes is not a whole number of "
+                             f"{n_channels}-channel float32 samples")
+        samples = np.frombuffer(data, dtype='<f4').reshape(-1, n_channels)
+        return samples.T * self.scale
+
+    def add_events(self, events) -> int:
+        """Queue the events of an 'events' message; raises ValueError if malformed."""
+        if not isinstance(events, list):
+            raise ValueError("'events' must be a list")
+        pairs = []
+        for event in events:
+            try:
+                sample = int(event['sample'])
+            except (KeyError, TypeError, ValueError):
+                raise ValueError("Every event needs an integer 'sample'")
+            condition = event.get('condition')
+            if condition is None:
+                code = normalize_annotation_code(str(event.get('code', '')))
+                condition = self.conditions.get(code)
+                if condition is None:
+                    self.unmatched[code] = self.unmatched.get(code, 0) + 1
+                    continue
+            pairs.append((sample, condition))
+        return self.session.add_events(pairs)
+
+    def epochs_seen(self) -> int:
+        """Epochs averaged or rejected so far."""
+        session = self.session
+        return sum(session.counts.values()) + sum(session.rejected.values())
+
+    def update_message(self, kind: str = 'update') -> dict:
+        session = self.session
+        evoked_target = session.evoked('Target')
+        evoked_nontarget = session.evoked('Non-Target')
+        erp, sem = {}, {}
+        for section in ANALYSIS_SECTIONS:
+            ch = section['ch']
+            if ch not in session.info.ch_names:
+                continue
+            idx = session.info.ch_names.index(ch)
+            erp[ch] = {
+                name: (np.round(evoked.data[idx] * 1e6, 3).tolist()
+                       if evoked is not None else None)
+                for name, evoked in (('Target', evoked_target),
+                                     ('Non-Target', evoked_nontarget))
+            }
+            sem[ch] = {}
+            for name in realtime.CONDITIONS:
+                std_error = session.std_error(name)
+                sem[ch][name] = (np.round(std_error[idx] * 1e6, 3).tolist()
+                                 if std_error is not None else None)
+        total = self.epochs_seen()
+        return {
+            "type": kind,
+            "samples": session.received,
+            "seconds": round(session.received / session.sfreq, 3),
+            "epochs": dict(session.counts),
+            "rejected": dict(session.rejected),
+            "rejected_channels": dict(session.rejected_channels),
+            "drop_percentage": round(100 * sum(session.rejected.values()) / total, 1)
+                               if total else 0.0,
+            "dropped_events": dict(session.dropped),
+            "unmatched_events": dict(self.unmatched),
+            "p300": measure_p300(evoked_target) if evoked_target is not None else None,
+            "erp": erp,
+            "sem": sem
+        }
+
+
+async def close_with_error(websocket: WebSocket, detail: str, code: int = 1008):
+    await websocket.send_json({"type": "error", "detail": detail})
+    await websocket.close(code=code)
+
+
+async def serve_realtime(websocket: WebSocket):
+    """Run the /realtime protocol until the client stops or disconnects."""
+    try:
+        stream = RealtimeStream(await websocket.receive_json())
+    except (ValueError, json.JSONDecodeError) as e:
+        await close_with_error(websocket, f"Invalid start message: {e}")
+        return
+    await websocket.send_json(stream.ready_message())
+
+    last_update = time.monotonic()
+    last_seen = stream.epochs_seen()
+    while True:
+        message = await websocket.receive()
+        if message['type'] == 'websocket.disconnect':
+            return
+        try:
+            if message.get('bytes') is not None:
+                block = stream.decode_block(message['bytes'])
+                await run_in_threadpool(stream.session.feed, block)
+            else:
+                payload = json.loads(message.get('text') or '{}')
+                if not isinstance(payload, dict):
+                    raise ValueError("Control messages must be JSON objects")
+                kind = payload.get('type')
+                if kind == 'events':
+                    stream.add_events(payload.get('events'))
+                elif kind == 'stop':
+                    await run_in_threadpool(stream.session.finish)
+                    await websocket.send_json(stream.update_message('final'))
+                    await websocket.close()
+                    return
+                else:
+                    raise ValueError(f"Unknown message type '{kind}'")
+        except (ValueError, json.JSONDecodeError) as e:
+            await close_with_error(websocket, str(e))
+            return
+
+        now = time.monotonic()
+        if stream.epochs_seen() != last_seen and now - last_update >= stream.update_interval:
+            await websocket.send_json(stream.update_message())
+            last_update = now
+            last_seen = stream.epochs_seen()
+
+
+# ============================================================================
+# WARM-UP
+# ============================================================================
+#
+# A fresh process pays for the scientific stack on its first request: the
+# imports, matplotlib's font cache (built from scratch in a new container),
+# the filter design and the report template. Workers pay all of it before
+# their first job by analyzing a short synthetic recording. The API process
+# imports what its own endpoints use (live sessions, trial queries) on a
+# background thread. GET /ready reports when both are done.
+
+WARMUP_MODULES = ('mne.io', 'mne.epochs', 'mne.evoked', 'mne.filter', 'mne.viz',
+                  'scipy.signal', 'scipy.stats', 'scipy.fft', 'matplotlib.pyplot',
+                  'PIL.Image', 'cntreader')
+
+_api_warmup = {'done': False, 'seconds': None, 'error': None}
+
+
+def warm_up_worker() -> dict:
+    """Worker warm-up: imports, font cache and one small synthetic analysis."""
+    steps = {}
+    start = time.perf_counter()
+    for name in WARMUP_MODULES:
+        importlib.import_module(name)
+    steps['imports_s'] = round(time.perf_counter() - start, 3)
+
+    start = time.perf_counter()
+    from matplotlib import font_manager
+    # Finding a font loads, or on first use builds, matplotlib's font cache
+    font_manager.findfont(font_manager.FontProperties())
+    steps['fonts_s'] = round(time.perf_counter() - start, 3)
+
+    start = time.perf_counter()
+    # Every worker analyzes the same recording, so no cache may serve it
+    with tempfile.TemporaryDirectory() as directory, \
+            config_overrides_applied({'cache': {'enabled': False}}):
+        cnt_path = os.path.join(directory, 'warmup.cnt')
+        exp_path = os.path.join(directory, 'warmup.exp')
+        make_recording(cnt_path, exp_path, n_channels=16, duration=30.0, n_trials=80)
+        run_analysis(cnt_path, exp_path)
+    steps['analysis_s'] = round(time.perf_counter() - start, 3)
+    return steps
+
+
+def warm_up_api():
+    """Import the modules the API process itself uses, in the background."""
+    start = time.perf_counter()
+    try:
+        for name in WARMUP_MODULES:
+            importlib.import_module(name)
     except Exception as e:
-        import traceback
-        error_details = traceback.format_exc()
-        print(f"ERROR: {error_details}")
+        _api_warmup['error'] = f"{type(e).__name__}: {e}"
+        logger.warning("API warm-up failed: %s", _api_warmup['error'])
+    _api_warmup['seconds'] = round(time.perf_counter() - start, 3)
+    _api_warmup['done'] = True
+
+
+@app.on_event("startup")
+def start_warm_up():
+    threading.Thread(target=warm_up_api, daemon=True).start()
+    if CONFIG['jobs']['warmup']:
+        # Starts the workers, which warm up before taking jobs
+        get_job_runner()
+
+# ============================================================================
+# API ENDPOINTS
+# ============================================================================
+
+@app.get("/")
+def read_root():
+    return {"status": "EEG Server is Running!"}
+
+
+@app.get("/health")
+def get_health():
+    """Liveness: answers as soon as the server is up."""
+    return {"status": "ok"}
+
+
+@app.get("/ready")
+def get_ready(response: Response):
+    """Readiness: 200 once warm-up has succeeded, 503 before or if it failed."""
+    workers = None
+    workers_ready = True
+    if _job_runner is not None:
+        stats = _job_runner.worker_stats()
+        workers_ready = _job_runner.ready()
+        workers = {'ready': workers_ready, 'warm': stats['warm'], 'running': stats['workers'],
+                   'target': CONFIG['jobs']['max_workers'], 'last_warmup': stats['last_warmup'],
+                   'warmup_failures': stats['warmup_failed']}
+    ready = _api_warmup['done'] and _api_warmup['error'] is None and workers_ready
+    if not ready:
+        response.status_code = 503
+    return {"ready": ready, "api": dict(_api_warmup), "workers": workers}
+
+
+@app.post("/analyze", status_code=202)
+async def analyze_eeg(request: Request):
+    """Queue an EEG analysis and return the task id to poll.
+
+    Multipart fields: ``cnt_file``, ``exp_file`` and optionally
+    ``config_overrides``, a JSON object overriding keys listed in
+    OVERRIDABLE_CONFIG (e.g. ``{"rejection": {"eeg": 8e-5}}``), and
+    ``format``, one of REPORT_FORMATS (default 'png').
+    """
+    cnt_dir, exp_dir = request_spool_dirs(uuid.uuid4().hex)
+    max_body_bytes = (CONFIG['uploads']['max_cnt_bytes'] +
+                      CONFIG['uploads']['max_exp_bytes'] + 1024 * 1024)
+    timings = StageTimings()
+    try:
+        files, fields = await receive_or_reject(request, upload_rules(cnt_dir, exp_dir),
+                                                max_body_bytes, timings)
+    except BaseException:
+        for directory in (cnt_dir, exp_dir):
+            shutil.rmtree(directory, ignore_errors=True)
+        raise
+    
+    return await run_in_threadpool(queue_analysis, files['cnt_file'], files['exp_file'],
+                                   fields.get('config_overrides'), fields.get('format'),
+                                   timings.as_dict())
+
+
+def record_analysis(task: dict):
+    """Runner callback: feed a finished analysis into the metrics."""
+    # The upload was observed when it was received
+    metrics.observe_job('analysis', task, skip_stages=('upload_spool',))
+
+
+def queue_analysis(cnt_files, exp_files, config_overrides: str, output_format: str = None,
+                   upload_timings: dict = None):
+    """Serve spooled uploads from the result cache or queue them for analysis."""
+    cnt_path = cnt_files[0]['path']
+    exp_path = exp_files[0]['path']
+    paths = [f['path'] for f in cnt_files + exp_files]
+    
+    try:
+        if len(cnt_files) > 1 or len(exp_files) > 1:
+            raise HTTPException(status_code=400, detail="Expected one .cnt and one .exp file")
+        overrides = parse_config_overrides(config_overrides)
+        output_format = output_format or 'png'
+        if output_format not in REPORT_FORMATS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"format must be one of: {', '.join(REPORT_FORMATS)}"
+            )
+        cnt_digest = cnt_files[0]['sha256']
+        exp_digest = exp_files[0]['sha256']
+        runner = get_job_runner()
         
-        # Clean up on error
-        if raw is not None or epochs is not None:
-            cleanup_resources(raw, epochs, evoked_target, evoked_nontarget)
+        # Serve identical uploads analyzed under the same CONFIG from cache
+        cache = get_result_cache()
+        if cache is not None:
+            cached = cache.get(result_cache_key(cnt_digest, exp_digest, overrides,
+                                                output_format))
+            if cached is not None:
+                remove_request_dirs(*paths)
+                metadata = cached.setdefault("metadata", {})
+                metadata["cache_hit"] = True
+                # The stored timings belong to the run that produced the result
+                metadata["timings"] = upload_timings or {}
+                task_id = runner.add_completed(cached)
+                return {
+                    "task_id": task_id,
+                    "status": "done",
+                    "status_url": f"/status/{task_id}",
+                    "results_url": f"/results/{task_id}"
+                }
         
-        return {"error": str(e), "details": error_details}
+        # The job reads the spooled files in place and deletes them when done
+        task_id = runner.submit(analysis_job, cnt_path, exp_path,
+                                cnt_digest, exp_digest, overrides, output_format,
+                                upload_timings, on_done=record_analysis)
+    except QueueFullError as e:
+        remove_request_dirs(*paths)
+        raise HTTPException(status_code=503, detail=str(e),
+                            headers={"Retry-After": "30"})
+    except Exception:
+        remove_request_dirs(*paths)
+        raise
     
+    return {
+        "task_id": task_id,
+        "status": "queued",
+        "status_url": f"/status/{task_id}",
+        "results_url": f"/results/{task_id}"
+    }
+
+
+@app.get("/status/{task_id}")
+def get_status(task_id: str):
+    """Report queue state and pipeline stage for an analysis task."""
+    status = get_job_runner().status(task_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Unknown task id")
+    return status
+
+
+@app.get("/results/{task_id}")
+def get_results(task_id: str):
+    """Return the finished analysis payload for a task."""
+    task = get_job_runner().result(task_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail="Unknown task id")
+    
+    if task['status'] == 'failed':
+        response = {"error": task['error'], "details": task.get('details')}
+        if task.get('failure'):
+            # Stopped by the job supervisor (memory limit, timeout, crash)
+            response["failure"] = task['failure']
+        return response
+    if task['status'] != 'done':
+        raise HTTPException(
+            status_code=409,
+            detail=f"Task is still {task['status']} (stage: {task['stage']})"
+        )
+    
+    return task['result']
+
+
+@app.post("/batch", status_code=202)
+async def analyze_batch(request: Request):
+    """Queue a cohort batch from multipart ``cnt_files`` and ``exp_files``.
+
+    Files are paired by name (subject01.cnt + subject01.exp).
+    """
+    batch_id = uuid.uuid4().hex
+    directory = batch_directory(batch_id)
+    inputs = os.path.join(directory, 'inputs')
+    max_subjects = CONFIG['batch']['max_subjects']
+    # Every subject at its per-file maxima, capped by the batch limit
+    max_body_bytes = min(
+        CONFIG['batch']['max_bytes'],
+        max_subjects * (CONFIG['uploads']['max_cnt_bytes'] + CONFIG['uploads']['max_exp_bytes'])
+        + 1024 * 1024
+    )
+    try:
+        files, _ = await receive_or_reject(
+            request, upload_rules(inputs, inputs, 'cnt_files', 'exp_files', max_subjects),
+            max_body_bytes
+        )
+        return await run_in_threadpool(queue_batch, batch_id, directory, files)
+    except BaseException:
+        shutil.rmtree(directory, ignore_errors=True)
+        raise
+
+
+def queue_batch(batch_id: str, directory: str, files: dict):
+    """Create the manifest for spooled batch inputs and start the batch."""
+    try:
+        pairs = cohort.pair_subject_files([f['path'] for f in files['cnt_files']],
+                                          [f['path'] for f in files['exp_files']])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    store = cohort.BatchStore.create(directory, batch_id, pairs)
+    start_batch(store)
+    return {
+        "batch_id": batch_id,
+        "status": "queued",
+        "subjects": [s for s, _, _ in pairs],
+        "status_url": f"/batch/{batch_id}",
+        "results_url": f"/batch/{batch_id}/results"
+    }
+
+
+def load_batch(batch_id: str) -> cohort.BatchStore:
+    store = cohort.BatchStore.load(batch_directory(batch_id))
+    if store is None:
+        raise HTTPException(status_code=404, detail="Unknown batch id")
+    return store
+
+
+@app.get("/batch/{batch_id}")
+def get_batch_status(batch_id: str):
+    """Report batch state and the status of every subject."""
+    manifest = load_batch(batch_id).snapshot()
+    runner = get_job_runner()
+    subjects = {}
+    for subject, record in manifest['subjects'].items():
+        entry = {'status': record['status'], 'error': record['error']}
+        if record['status'] == 'running' and record['task_id']:
+            task = runner.status(record['task_id'])
+            if task is not None:
+                entry['stage'] = task['stage']
+        subjects[subject] = entry
+    
+    counts = {}
+    for entry in subjects.values():
+        counts[entry['status']] = counts.get(entry['status'], 0) + 1
+    return {
+        "batch_id": batch_id,
+        "status": manifest['status'],
+        "error": manifest['error'],
+        "counts": counts,
+        "subjects": subjects
+    }
+
+
+@app.get("/batch/{batch_id}/results")
+def get_batch_results(batch_id: str):
+    """Return the cohort report with per-subject P300 scores."""
+    store = load_batch(batch_id)
+    status = store.snapshot()['status']
+    result = store.read_result() if status in ('done', 'partial') else None
+    if result is None:
+        raise HTTPException(status_code=409, detail=f"Batch is {status}")
+    return result
+
+
+@app.post("/batch/{batch_id}/resume", status_code=202)
+def resume_batch(batch_id: str):
+    """Retry the failed or unfinished subjects of a batch and rebuild the report."""
+    store = load_batch(batch_id)
+    if store.snapshot()['status'] == 'done':
+        raise HTTPException(status_code=409, detail="Batch is already complete")
+    if not start_batch(store):
+        raise HTTPException(status_code=409, detail="Batch is already running")
+    return {"batch_id": batch_id, "status": "running",
+            "status_url": f"/batch/{batch_id}"}
+
+
+@app.post("/trials/query")
+async def query_trial_subsets(request: Request):
+    """Re-average subsets of a finished analysis's trials (see TRIAL QUERIES)."""
+    try:
+        body = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Request body must be valid JSON")
+    return await run_in_threadpool(run_trial_query, body)
+
+
+@app.websocket("/realtime")
+async def realtime_stream(websocket: WebSocket):
+    """Live ERPs from a streamed recording (protocol under REAL-TIME SESSIONS)."""
+    await websocket.accept()
+    if not acquire_realtime_slot():
+        await close_with_error(websocket, "Too many live sessions, try again later", code=1013)
+        return
+    try:
+        await serve_realtime(websocket)
+    except WebSocketDisconnect:
+        pass
     finally:
-        # Clean up temporary files
-        if tmp_cnt_path and os.path.exists(tmp_cnt_path):
-            try:
-                os.remove(tmp_cnt_path)
-            except:
-                pass
-        if tmp_exp_path and os.path.exists(tmp_exp_path):
-            try:
-                os.remove(tmp_exp_path)
-            except:
-                pass
+        release_realtime_slot()
+
+
+@app.get("/uploads/stats")
+def get_upload_stats():
+    """Report disk (and memory) held by spooled uploads, per in-flight request."""
+    spool_dir = CONFIG['uploads']['spool_dir']
+    memory_dir = CONFIG['uploads']['memory_dir']
+    stats = {
+        "max_cnt_bytes": CONFIG['uploads']['max_cnt_bytes'],
+        "max_exp_bytes": CONFIG['uploads']['max_exp_bytes'],
+        "spool": spool_usage(spool_dir)
+    }
+    if memory_dir and memory_dir != spool_dir:
+        stats["memory"] = spool_usage(memory_dir)
+    return stats
+
+
+def service_snapshot() -> dict:
+    """Queue, cache and spool figures exported on /metrics at scrape time."""
+    snapshot = {}
+    if _job_runner is not None:
+        counts = _job_runner.counts()
+        snapshot['eeg_jobs'] = ('gauge', 'Tracked analysis jobs by status', [
+            ({'status': status}, count) for status, count in counts.items()
+        ])
+        snapshot['eeg_job_capacity'] = ('gauge', 'Jobs the runner accepts at once', [
+            ({}, _job_runner.capacity)
+        ])
+        workers = _job_runner.worker_stats()
+        snapshot['eeg_workers'] = ('gauge', 'Analysis worker processes by state', [
+            ({'state': 'busy'}, workers['busy']),
+            ({'state': 'idle'}, workers['workers'] - workers['busy'])
+        ])
+        snapshot['eeg_worker_rss_bytes'] = ('gauge', 'Resident memory of all analysis workers', [
+            ({}, workers['rss_bytes'])
+        ])
+        memory = [({'kind': kind.replace('_bytes', '')}, value)
+                  for kind, value in workers['memory'].items() if value is not None]
+        if memory:
+            snapshot['eeg_job_memory_bytes'] = (
+                'gauge', 'Memory available, reserved by running jobs, and headroom for the next',
+                memory
+            )
+        snapshot['eeg_workers_recycled'] = ('counter', 'Workers replaced after a job', [
+            ({'reason': reason}, count) for reason, count in workers['recycled'].items()
+        ])
+        snapshot['eeg_jobs_killed'] = ('counter', 'Jobs stopped by the supervisor', [
+            ({'reason': reason}, count) for reason, count in workers['killed'].items()
+        ] + [({'reason': 'worker_exited'}, workers['exited'])])
+        snapshot['eeg_worker_warmup_failures'] = ('counter', 'Worker warm-ups that failed', [
+            ({}, workers['warmup_failed'])
+        ])
+    with _batch_lock:
+        running_batches = len(_batch_threads)
+    snapshot['eeg_batches_running'] = ('gauge', 'Cohort batches being coordinated', [
+        ({}, running_batches)
+    ])
+    
+    with _realtime_lock:
+        live_sessions = _realtime_sessions
+    snapshot['eeg_realtime_sessions'] = ('gauge', 'Open /realtime streams', [
+        ({}, live_sessions)
+    ])
+    
+    spool = spool_usage(CONFIG['uploads']['spool_dir'])
+    snapshot['eeg_spool_bytes'] = ('gauge', 'Bytes of uploads held in the spool', [
+        ({}, spool['bytes'])
+    ])
+    
+    cache = get_result_cache()
+    if cache is not None:
+        stats = cache.stats()
+        snapshot['eeg_result_cache_hits'] = ('counter', 'Result cache hits', [({}, stats['hits'])])
+        snapshot['eeg_result_cache_misses'] = ('counter', 'Result cache misses', [
+            ({}, stats['misses'])
+        ])
+        stage_stats = get_stage_cache().stats()
+        snapshot['eeg_cache_bytes'] = ('gauge', 'Bytes stored per cache', [
+            ({'cache': 'results'}, stats['bytes']),
+            ({'cache': 'stages'}, stage_stats['bytes'])
+        ])
+        snapshot['eeg_cache_entries'] = ('gauge', 'Entries stored per cache', [
+            ({'cache': 'results'}, stats['entries']),
+            ({'cache': 'stages'}, stage_stats['entries'])
+        ])
+    return snapshot
+
+
+metrics.register_snapshot(service_snapshot)
+
+
+@app.get("/metrics")
+def get_metrics():
+    """Prometheus metrics: stage timing/memory histograms, queue and cache state."""
+    body, content_type = metrics.render_metrics()
+    # content_type already carries the charset, which media_type would repeat
+    return Response(content=body, headers={"Content-Type": content_type})
+
+
+@app.get("/cache/stats")
+def get_cache_stats():
+    """Report result cache hit/miss counters and disk usage."""
+    cache = get_result_cache()
+    if cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **cache.stats(), "stages": get_stage_cache().stats()}
 
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=8000)
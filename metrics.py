@@ -0,0 +1,174 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from prometheus_client import (CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge,
+                               Histogram, generate_latest)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+# ============================================================================
+# STAGE PROBES AND METRICS
+# ============================================================================
+#
+# Pipeline stages run in job worker processes, where an in-process Prometheus
+# registry would never be scraped. Each request therefore records its stages
+# into a StageTimings, the timings travel back in the result's metadata, and
+# the API process observes them into the histograms below. Stages that run in
+# the API process itself (receiving the upload) are observed directly.
+
+REGISTRY = CollectorRegistry()
+
+_MB = 1024 * 1024
+
+STAGE_SECONDS = Histogram(
+    'eeg_stage_duration_seconds', 'Wall time of one pipeline stage', ['stage'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+    registry=REGISTRY
+)
+STAGE_RSS = Histogram(
+    'eeg_stage_rss_bytes', 'Resident memory of the process when a stage ends', ['stage'],
+    buckets=tuple(2 ** i * _MB for i in range(6, 15)),
+    registry=REGISTRY
+)
+STAGE_RSS_GROWTH = Histogram(
+    'eeg_stage_rss_growth_bytes', 'Resident memory a stage added (0 if it shrank)', ['stage'],
+    buckets=tuple(2 ** i * _MB for i in range(0, 13)),
+    registry=REGISTRY
+)
+REJECTION_RATIO = Histogram(
+    'eeg_rejection_ratio', 'Fraction of epochs rejected as artifacts per recording',
+    buckets=(0.01, 0.05, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.8, 0.9, 1.0),
+    registry=REGISTRY
+)
+JOBS_FINISHED = Counter(
+    'eeg_jobs_finished_total', 'Finished jobs by kind and outcome', ['kind', 'status'],
+    registry=REGISTRY
+)
+STAGES_REUSED = Counter(
+    'eeg_stage_cache_reused_total', 'Pipeline stages served from the stage cache', ['stage'],
+    registry=REGISTRY
+)
+EVENTS_UNMATCHED = Counter(
+    'eeg_events_unmatched_total', 'Annotations whose code the .exp file does not list',
+    registry=REGISTRY
+)
+UPLOADS_IN_FLIGHT = Gauge(
+    'eeg_uploads_in_flight', 'Upload requests currently being received',
+    registry=REGISTRY
+)
+UPLOADS_REJECTED = Counter(
+    'eeg_uploads_rejected_total', 'Uploads refused by a spooling rule', ['status_code'],
+    registry=REGISTRY
+)
+
+try:
+    _PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):
+    _PAGE_SIZE = None
+
+
+def current_rss() -> int:
+    """Resident set size of this process in bytes, or None if unavailable."""
+    if _PAGE_SIZE is None:
+        return None
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class StageTimings:
+    """Wall time and memory of each stage of one request.
+
+    A stage probed more than once (e.g. 'encode' for several images)
+    accumulates its time. Probes may run on several threads at once.
+    """
+
+    def __init__(self, initial: dict = None):
+        self.stages = {name: dict(values) for name, values in (initial or {}).items()}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def probe(self, stage: str):
+        rss_before = current_rss()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start, rss_before, current_rss())
+
+    def add(self, stage: str, seconds: float, rss_before: int = None, rss_after: int = None):
+        with self._lock:
+            entry = self.stages.setdefault(stage, {'seconds': 0.0})
+            entry['seconds'] = round(entry['seconds'] + seconds, 4)
+            if rss_after is not None:
+                entry['rss_mb'] = round(rss_after / _MB, 1)
+                if rss_before is not None:
+                    growth = max(0, rss_after - rss_before) / _MB
+                    entry['rss_growth_mb'] = round(entry.get('rss_growth_mb', 0.0) + growth, 1)
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {name: dict(values) for name, values in self.stages.items()}
+
+
+def observe_stage(stage: str, values: dict):
+    """Feed one stage's measurements into the stage histograms."""
+    STAGE_SECONDS.labels(stage).observe(values['seconds'])
+    if 'rss_mb' in values:
+        STAGE_RSS.labels(stage).observe(values['rss_mb'] * _MB)
+    if 'rss_growth_mb' in values:
+        STAGE_RSS_GROWTH.labels(stage).observe(values['rss_growth_mb'] * _MB)
+
+
+def observe_job(kind: str, task: dict, skip_stages=(), record_rejection: bool = True):
+    """Record a finished job record (see JobRunner) and the timings it returned.
+
+    ``skip_stages`` names stages already observed in the API process.
+    """
+    JOBS_FINISHED.labels(kind, task['status']).inc()
+    if task['status'] != 'done' or not isinstance(task.get('result'), dict):
+        return
+    result = task['result']
+    metadata = result.get('metadata', result)
+    for stage, values in (metadata.get('timings') or {}).items():
+        if stage not in skip_stages:
+            observe_stage(stage, values)
+    for stage in metadata.get('stages_reused') or []:
+        STAGES_REUSED.labels(stage).inc()
+    if metadata.get('unmatched_events'):
+        EVENTS_UNMATCHED.inc(sum(metadata['unmatched_events'].values()))
+    if record_rejection and metadata.get('drop_percentage') is not None:
+        REJECTION_RATIO.observe(metadata['drop_percentage'] / 100)
+
+
+class SnapshotCollector:
+    """Exports values read at scrape time from ``snapshot()``.
+
+    ``snapshot`` returns ``{name: (kind, documentation, samples)}`` where
+    kind is 'gauge' or 'counter' and samples is a list of
+    ``(labels dict, value)``.
+    """
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+
+    def collect(self):
+        for name, (kind, documentation, samples) in self.snapshot().items():
+            labels = sorted(samples[0][0]) if samples else []
+            family_class = CounterMetricFamily if kind == 'counter' else GaugeMetricFamily
+            family = family_class(name, documentation, labels=labels)
+            for sample_labels, value in samples:
+                family.add_metric([str(sample_labels[k]) for k in labels], value)
+            yield family
+
+
+def register_snapshot(snapshot):
+    REGISTRY.register(SnapshotCollector(snapshot))
+
+
+def render_metrics():
+    """``(body, content_type)`` of the Prometheus text exposition."""
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -0,0 +1,179 @@
+import mne
+import numpy as np
+
+from averaging import CONDITIONS, EvokedAccumulator
+from rejection import epoch_features, reject_epochs
+from streaming import StreamingFIRFilter, design_bandpass
+
+# ============================================================================
+# REAL-TIME ERP SESSION
+# ============================================================================
+#
+# A live recording arrives as blocks of samples plus trigger events. Each
+# block goes through the same FIR bandpass as the offline pipeline, run as an
+# open-ended StreamingFIRFilter, so the filtered signal trails the input by
+# half the filter length. Filtered samples are kept only as long as a pending
+# (or late-arriving) event may still need them. An epoch is cut as soon as
+# its window has been filtered, baseline-corrected, checked against the
+# rejection thresholds (rejection.py) and added to its condition's running
+# statistics (EvokedAccumulator). State is a running mean and M2 per condition
+# (channels x epoch samples) plus a bounded window of filtered samples,
+# independent of session length.
+
+
+class RealtimeSession:
+    """Incremental filtering, epoching and averaging of one live stream.
+
+    ``picks`` are indices into the streamed channels; ``reject`` holds the
+    thresholds of CONFIG['rejection'] (or None). Events may arrive up to
+    ``event_lag`` seconds after their sample has been streamed.
+    """
+
+    def __init__(self, ch_names, picks, sfreq: float, low: float, high: float,
+                 tmin: float, tmax: float, baseline, reject: dict = None,
+                 event_lag: float = 2.0):
+        self.picks = np.asarray(picks, dtype=int)
+        self.info = mne.create_info([ch_names[i] for i in self.picks], sfreq, 'eeg')
+        self.sfreq = float(sfreq)
+        self.tmin = tmin
+        self.baseline = baseline
+        self.reject = reject
+
+        self.fir = StreamingFIRFilter(design_bandpass(self.sfreq, low, high))
+        # Window offsets as mne.Epochs computes them
+        self.start_offset = int(round(tmin * self.sfreq))
+        self.n_samples = int(round(tmax * self.sfreq)) - self.start_offset + 1
+        self.times = (self.start_offset + np.arange(self.n_samples)) / self.sfreq
+        self.lag_samples = int(round(event_lag * self.sfreq))
+
+        n_picks = len(self.picks)
+        self._pending_raw = []
+        self._pending_raw_samples = 0
+        # Filtered samples from absolute sample _buffer_start onwards
+        self._buffer = np.empty((n_picks, 0))
+        self._buffer_start = 0
+        self._events = []
+
+        self.received = 0
+        self.averages = EvokedAccumulator(self.info, self.times[0], self.n_samples, CONDITIONS)
+        self.rejected = dict.fromkeys(CONDITIONS, 0)
+        # Rejected epochs in which each channel failed a threshold
+        self.rejected_channels = {}
+        self.dropped = {'late': 0, 'out_of_range': 0}
+        self.finished = False
+
+    @property
+    def delay_seconds(self) -> float:
+        """How far filtered output trails the newest sample."""
+        return self.fir.delay / self.sfreq
+
+    @property
+    def counts(self) -> dict:
+        """Epochs averaged so far per condition."""
+        return {c: self.averages.count(c) for c in CONDITIONS}
+
+    @property
+    def filtered(self) -> int:
+        """Absolute index one past the last filtered sample."""
+        return self._buffer_start + self._buffer.shape[1]
+
+    def add_events(self, events):
+        """Queue ``(sample, condition)`` pairs; returns how many were accepted."""
+        accepted = 0
+        oldest = self._buffer_start
+        for sample, condition in events:
+            sample = int(sample)
+            if condition not in CONDITIONS:
+                raise ValueError(f"Unknown condition '{condition}'")
+            start = sample + self.start_offset
+            if start < 0:
+                self.dropped['out_of_range'] += 1
+            elif start < oldest or sample < self.received - self.lag_samples:
+                self.dropped['late'] += 1
+            else:
+                self._events.append((start, condition))
+                accepted += 1
+        self._events.sort()
+        self._cut_epochs()
+        return accepted
+
+    def feed(self, block: np.ndarray) -> int:
+        """Filter a (channels x samples) block of all streamed channels, in volts.
+
+        Returns the number of epochs completed by this block.
+        """
+        if self.finished:
+            raise ValueError("Session already finished")
+        block = np.asarray(block[self.picks], dtype=np.float64)
+        self.received += block.shape[1]
+        self._pending_raw.append(block)
+        self._pending_raw_samples += block.shape[1]
+        # The filter's left-edge padding needs a minimum first block
+        if not self.fir.started and self._pending_raw_samples < self.fir.min_block:
+            return 0
+        block = np.concatenate(self._pending_raw, axis=1)
+        self._pending_raw = []
+        self._pending_raw_samples = 0
+        return self._append(*self.fir.process(block))
+
+    def finish(self) -> int:
+        """Flush the filter at the end of the stream and cut the last epochs.
+
+        Events whose window runs past the end are counted as out of range.
+        """
+        if self.finished:
+            return 0
+        completed = 0
+        if self.fir.started:
+            completed = self._append(*self.fir.finish())
+        self.finished = True
+        self.dropped['out_of_range'] += len(self._events)
+        self._events = []
+        return completed
+
+    def _append(self, start: int, filtered: np.ndarray) -> int:
+        if filtered.shape[1]:
+            self._buffer = np.concatenate([self._buffer, filtered], axis=1)
+        completed = self._cut_epochs()
+
+        # Keep what pending events need plus room for late events
+        keep_from = self.received - self.lag_samples + self.start_offset
+        if self._events:
+            keep_from = min(keep_from, self._events[0][0])
+        drop = min(max(0, keep_from - self._buffer_start), self._buffer.shape[1])
+        if drop:
+            self._buffer = self._buffer[:, drop:]
+            self._buffer_start += drop
+        return completed
+
+    def _cut_epochs(self) -> int:
+        """Average every pending event whose window is fully filtered."""
+        completed = 0
+        end = self.filtered
+        while self._events and self._events[0][0] + self.n_samples <= end:
+            start, condition = self._events.pop(0)
+            offset = start - self._buffer_start
+            epoch = self._buffer[:, offset:offset + self.n_samples].copy()
+            if self.baseline is not None:
+                mne.baseline.rescale(epoch, self.times, self.baseline, mode='mean',
+                                     copy=False, verbose=False)
+            if self.reject is not None:
+                keep, diagnostics = reject_epochs(
+                    epoch_features(epoch[np.newaxis], self.sfreq), self.info.ch_names, self.reject
+                )
+                if not keep[0]:
+                    self.rejected[condition] += 1
+                    for ch, count in diagnostics['channel_counts'].items():
+                        self.rejected_channels[ch] = self.rejected_channels.get(ch, 0) + count
+                    continue
+            self.averages.add(condition, epoch)
+            completed += 1
+        return completed
+
+    def evoked(self, condition: str):
+        """Running average of one condition as an EvokedArray, or None if empty."""
+        return self.averages.evoked(condition)
+
+    def std_error(self, condition: str):
+        """Standard error of one condition's average, or None below two epochs."""
+        return self.averages.std_error(condition)
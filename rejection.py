@@ -0,0 +1,86 @@
+import numpy as np
+
+# ============================================================================
+# ARTIFACT REJECTION
+# ============================================================================
+#
+# Rejection is decided on two small (epochs x channels) feature arrays,
+# computed in one vectorized pass over the epochs array: the peak-to-peak
+# amplitude and the steepest sample-to-sample step. The features are stored
+# with the cached epochs, so a different threshold only compares these
+# arrays again, without re-reading or re-cutting the epochs. Besides the
+# keep-mask, the diagnostics tell which channels caused the drops, e.g. one
+# loose electrode that alone rejects most trials.
+
+# Epochs per vectorized chunk, bounding the temporaries of np.diff
+FEATURE_CHUNK = 256
+
+# Channels listed under "worst_channels" in the diagnostics
+WORST_CHANNELS = 5
+
+
+def epoch_features(data: np.ndarray, sfreq: float) -> dict:
+    """Per-epoch, per-channel ``ptp`` (V) and ``gradient`` (max step, V/s).
+
+    ``data`` is (epochs x channels x times) and may be memory-mapped.
+    """
+    n_epochs, n_channels = data.shape[:2]
+    ptp = np.empty((n_epochs, n_channels))
+    gradient = np.empty((n_epochs, n_channels))
+    for start in range(0, n_epochs, FEATURE_CHUNK):
+        chunk = data[start:start + FEATURE_CHUNK]
+        stop = start + len(chunk)
+        ptp[start:stop] = chunk.max(axis=2) - chunk.min(axis=2)
+        if chunk.shape[2] > 1:
+            gradient[start:stop] = np.abs(np.diff(chunk, axis=2)).max(axis=2) * sfreq
+        else:
+            gradient[start:stop] = 0.0
+    return {'ptp': ptp, 'gradient': gradient}
+
+
+def reject_epochs(features: dict, ch_names, thresholds: dict):
+    """Apply rejection thresholds to epoch_features().
+
+    ``thresholds`` is CONFIG['rejection']: ``eeg`` (maximum peak-to-peak,
+    V), ``flat`` (minimum peak-to-peak, V) and ``gradient`` (maximum step,
+    V/s); None disables a criterion. An epoch is dropped if any channel
+    fails any criterion.
+
+    Returns ``(keep, diagnostics)``: a boolean mask of the epochs to keep,
+    and epochs dropped per criterion, per channel, and the worst channels
+    with how many epochs each one rejected on its own.
+    """
+    ptp = features['ptp']
+    failing = {}
+    if thresholds.get('eeg') is not None:
+        failing['peak_to_peak'] = ptp > thresholds['eeg']
+    if thresholds.get('flat') is not None:
+        failing['flat'] = ptp < thresholds['flat']
+    if thresholds.get('gradient') is not None:
+        failing['gradient'] = features['gradient'] > thresholds['gradient']
+
+    offending = np.zeros(ptp.shape, dtype=bool)
+    for mask in failing.values():
+        offending |= mask
+    keep = ~offending.any(axis=1)
+
+    n_epochs = len(ptp)
+    per_channel = offending.sum(axis=0)
+    # Epochs this channel rejected with no other channel failing
+    only_cause = (offending & (offending.sum(axis=1, keepdims=True) == 1)).sum(axis=0)
+    worst = [
+        {
+            'channel': ch_names[i],
+            'rejected_epochs': int(per_channel[i]),
+            'percentage': round(100 * per_channel[i] / n_epochs, 1),
+            'only_cause': int(only_cause[i])
+        }
+        for i in np.argsort(-per_channel, kind='stable')[:WORST_CHANNELS]
+        if per_channel[i] > 0
+    ]
+    diagnostics = {
+        'criteria': {name: int(mask.any(axis=1).sum()) for name, mask in failing.items()},
+        'channel_counts': {ch: int(count) for ch, count in zip(ch_names, per_channel) if count},
+        'worst_channels': worst
+    }
+    return keep, diagnostics
@@ -0,0 +1,151 @@
+import numpy as np
+import scipy
+
+from filtering import get_helper_pool
+from peaks import peak_indices
+
+# ============================================================================
+# P300 RELIABILITY STATISTICS
+# ============================================================================
+#
+# Both tests work on the P300 channel's single trials inside the search
+# window, an (epochs x samples) array per condition, and are computed in bulk:
+#
+# - Bootstrap: every resample is a row of multinomial weights over the Target
+#   epochs, so a chunk of resampled averages is one (resamples x epochs) @
+#   (epochs x samples) product. Each resampled average is peak-picked like the
+#   report's average, giving a latency (and score) distribution. Chunks are
+#   seeded independently, so the result is the same whether they run in this
+#   process or are spread over the helper pool.
+# - Cluster permutation test (Maris & Oostenveld): every permutation is a row
+#   of a 0/1 label matrix, so all group sums and sums of squares, and with them
+#   the t-values of every permutation and sample, come from two matrix
+#   products. The largest cluster mass of each row forms the null distribution
+#   of the observed clusters.
+
+# Resamples or permutations per vectorized chunk, bounding the temporaries
+RESAMPLE_CHUNK = 1000
+
+
+def _chunk_sizes(total: int):
+    return [min(RESAMPLE_CHUNK, total - start) for start in range(0, total, RESAMPLE_CHUNK)]
+
+
+def _bootstrap_chunk(trials: np.ndarray, seed, n_resamples: int, prominence: float) -> np.ndarray:
+    """Peak indices of ``n_resamples`` bootstrap averages of ``trials``."""
+    rng = np.random.default_rng(seed)
+    n_trials = len(trials)
+    weights = rng.multinomial(n_trials, np.full(n_trials, 1 / n_trials), size=n_resamples)
+    averages = (weights / n_trials) @ trials
+    return peak_indices(averages, prominence)
+
+
+def bootstrap_peak_latencies(trials: np.ndarray, times: np.ndarray, n_resamples: int,
+                             prominence: float, seed: int = 0, n_jobs: int = 1) -> np.ndarray:
+    """Peak latency (s) of each bootstrap resample of the average of ``trials``.
+
+    ``trials`` is (epochs x samples) over the search window whose time axis
+    is ``times``. With ``n_jobs > 1`` the chunks run on the helper pool.
+    """
+    sizes = _chunk_sizes(n_resamples)
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    if n_jobs > 1 and len(sizes) > 1:
+        pool = get_helper_pool(n_jobs)
+        futures = [pool.submit(_bootstrap_chunk, trials, chunk_seed, size, prominence)
+                   for chunk_seed, size in zip(seeds, sizes)]
+        indices = [future.result() for future in futures]
+    else:
+        indices = [_bootstrap_chunk(trials, chunk_seed, size, prominence)
+                   for chunk_seed, size in zip(seeds, sizes)]
+    return times[np.concatenate(indices)]
+
+
+def percentile_interval(values: np.ndarray, confidence: float):
+    """Central ``confidence`` percentile interval of ``values``."""
+    tail = (1 - confidence) / 2 * 100
+    low, high = np.percentile(values, [tail, 100 - tail])
+    return float(low), float(high)
+
+
+def _t_values(labels: np.ndarray, data: np.ndarray, squares: np.ndarray) -> np.ndarray:
+    """Pooled-variance t of group 1 vs the rest, one row per label row.
+
+    ``labels`` is a (rows x trials) 0/1 matrix marking group 1.
+    """
+    n_total = data.shape[0]
+    n1 = labels[0].sum()
+    n2 = n_total - n1
+    sum1 = labels @ data
+    sum2 = data.sum(axis=0) - sum1
+    squares1 = labels @ squares
+    squares2 = squares.sum(axis=0) - squares1
+    mean1, mean2 = sum1 / n1, sum2 / n2
+    deviations = (squares1 - sum1 * mean1) + (squares2 - sum2 * mean2)
+    pooled = np.maximum(deviations, 0) / (n_total - 2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = (mean1 - mean2) / np.sqrt(pooled * (1 / n1 + 1 / n2))
+    return np.nan_to_num(t)
+
+
+def _max_cluster_mass(t: np.ndarray, threshold: float) -> np.ndarray:
+    """Largest summed |t| of a run of supra-threshold samples, per row."""
+    largest = np.zeros(len(t))
+    for sign in (1, -1):
+        mass = np.where(sign * t > threshold, sign * t, 0.0)
+        running = np.cumsum(mass, axis=1)
+        # Restart the running sum after every sub-threshold sample
+        restart = np.maximum.accumulate(np.where(mass == 0, running, 0.0), axis=1)
+        largest = np.maximum(largest, (running - restart).max(axis=1))
+    return largest
+
+
+def _clusters(t: np.ndarray, threshold: float):
+    """``(start, stop, sign, mass)`` of the supra-threshold runs of one t row."""
+    signs = np.where(t > threshold, 1, np.where(t < -threshold, -1, 0))
+    clusters = []
+    start = 0
+    for stop in range(1, len(t) + 1):
+        if stop == len(t) or signs[stop] != signs[start]:
+            if signs[start] != 0:
+                clusters.append((start, stop, int(signs[start]),
+                                 float(np.abs(t[start:stop]).sum())))
+            start = stop
+    return clusters
+
+
+def cluster_permutation_test(group1: np.ndarray, group2: np.ndarray, times: np.ndarray,
+                             n_permutations: int, alpha: float = 0.05, seed: int = 0) -> dict:
+    """Two-sided cluster permutation test of two (epochs x samples) groups.
+
+    Returns the cluster-forming t threshold and every observed cluster with
+    its time span (s), sign, mass and permutation p-value.
+    """
+    data = np.concatenate([group1, group2])
+    squares = np.square(data)
+    n1, n_total = len(group1), len(data)
+    threshold = float(scipy.stats.t.ppf(1 - alpha / 2, n_total - 2))
+
+    observed = np.zeros((1, n_total))
+    observed[0, :n1] = 1
+    clusters = _clusters(_t_values(observed, data, squares)[0], threshold)
+
+    rng = np.random.default_rng(seed)
+    null_masses = []
+    for size in _chunk_sizes(n_permutations):
+        labels = rng.permuted(np.repeat(observed, size, axis=0), axis=1)
+        null_masses.append(_max_cluster_mass(_t_values(labels, data, squares), threshold))
+    null_masses = np.concatenate(null_masses)
+
+    return {
+        'threshold_t': threshold,
+        'clusters': [
+            {
+                'start': float(times[start]),
+                'end': float(times[stop - 1]),
+                'sign': 'positive' if sign > 0 else 'negative',
+                'mass': mass,
+                'p_value': float((np.sum(null_masses >= mass) + 1) / (n_permutations + 1))
+            }
+            for start, stop, sign, mass in clusters
+        ]
+    }
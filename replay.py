@@ -0,0 +1,123 @@
+"""Stream a recorded .cnt file to the /realtime endpoint as if it were live.
+
+Samples are sent in blocks at the recording's pace (or ``--speed`` times
+faster), each block preceded by the trigger events that fall inside it, so
+the live ERP view can be tried without an amplifier:
+
+    python replay.py recording.cnt recording.exp --speed 4
+"""
+import argparse
+import json
+import threading
+import time
+
+import mne
+import numpy as np
+from websockets.sync.client import connect
+
+from cntreader import read_cnt
+
+
+def recording_events(raw, trials, trial_type_lookup, normalize_annotation_code):
+    """``(samples, codes)`` of the annotations and the code -> condition table."""
+    lookup = trial_type_lookup(trials)
+    codes = [normalize_annotation_code(d) for d in raw.annotations.description]
+    samples = raw.time_as_index(raw.annotations.onset)
+    conditions = {code: 'Target' if lookup[code] == 'R' else 'Non-Target'
+                  for code in set(codes) if code in lookup}
+    order = np.argsort(samples, kind='stable')
+    return samples[order], [codes[i] for i in order], conditions
+
+
+def print_update(message: dict):
+    p300 = message.get('p300')
+    latency = f"P300 {p300['latency_ms']:.0f} ms, score {p300['score']:.0f}" if p300 else "no P300 yet"
+    print(f"{message['type']:>6} {message['seconds']:8.1f} s  "
+          f"Target {message['epochs']['Target']:4d}  Non-Target {message['epochs']['Non-Target']:4d}  "
+          f"rejected {sum(message['rejected'].values()):4d}  {latency}")
+
+
+def receive_updates(websocket, done: threading.Event):
+    try:
+        for frame in websocket:
+            message = json.loads(frame)
+            if message['type'] in ('update', 'final'):
+                print_update(message)
+            elif message['type'] == 'error':
+                print(f"ERROR: {message['detail']}")
+    finally:
+        done.set()
+
+
+def replay(cnt_path: str, exp_path: str, url: str, speed: float, block_seconds: float,
+           update_interval: float):
+    # main imports the API; load it only when run as a tool
+    from main import normalize_annotation_code, parse_experiment_file, trial_type_lookup
+
+    raw = read_cnt(cnt_path, preload=False)
+    picks = mne.pick_types(raw.info, eeg=True, exclude=[])
+    ch_names = [raw.ch_names[i] for i in picks]
+    sfreq = raw.info['sfreq']
+    trials, _ = parse_experiment_file(exp_path)
+    samples, codes, conditions = recording_events(raw, trials, trial_type_lookup,
+                                                  normalize_annotation_code)
+    block_samples = max(1, int(round(block_seconds * sfreq)))
+    print(f"Replaying {raw.n_times / sfreq:.0f} s of {len(ch_names)} channels at "
+          f"{sfreq:g} Hz with {len(samples)} events to {url}")
+
+    with connect(url, max_size=None) as websocket:
+        websocket.send(json.dumps({
+            "type": "start", "sfreq": sfreq, "ch_names": ch_names, "units": "uV",
+            "update_interval": update_interval, "conditions": conditions
+        }))
+        ready = json.loads(websocket.recv())
+        if ready['type'] != 'ready':
+            print(f"ERROR: {ready.get('detail', ready)}")
+            return
+        print(f"Server averages {ready['channels']}; output trails input by "
+              f"{ready['delay_seconds']:.2f} s")
+
+        done = threading.Event()
+        receiver = threading.Thread(target=receive_updates, args=(websocket, done), daemon=True)
+        receiver.start()
+
+        started = time.monotonic()
+        next_event = 0
+        for start in range(0, raw.n_times, block_samples):
+            stop = min(start + block_samples, raw.n_times)
+            if speed > 0:
+                delay = started + stop / sfreq / speed - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            end_event = int(np.searchsorted(samples, stop))
+            if end_event > next_event:
+                websocket.send(json.dumps({"type": "events", "events": [
+                    {"sample": int(samples[i]), "code": codes[i]}
+                    for i in range(next_event, end_event)
+                ]}))
+                next_event = end_event
+            block = raw.get_data(picks=picks, start=start, stop=stop) * 1e6
+            websocket.send(np.ascontiguousarray(block.T, dtype='<f4').tobytes())
+
+        websocket.send(json.dumps({"type": "stop"}))
+        done.wait()
+
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('cnt_file')
+    parser.add_argument('exp_file', help="experiment log that maps trigger codes to conditions")
+    parser.add_argument('--url', default='ws://localhost:8000/realtime')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help="playback speed; 0 sends as fast as possible")
+    parser.add_argument('--block', type=float, default=0.1,
+                        help="seconds of data per frame (default 0.1)")
+    parser.add_argument('--update-interval', type=float, default=1.0,
+                        help="seconds between server updates")
+    args = parser.parse_args(argv)
+    replay(args.cnt_file, args.exp_file, args.url, args.speed, args.block,
+           args.update_interval)
+
+
+if __name__ == '__main__':
+    cli()
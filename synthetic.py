@@ -0,0 +1,149 @@
+import struct
+
+import numpy as np
+
+# ============================================================================
+# SYNTHETIC RECORDINGS
+# ============================================================================
+#
+# Writes Neuroscan .cnt files (32-bit samples by default) and matching .exp
+# logs so the pipeline can be exercised without participant data: worker
+# warm-up, the benchmarks and the tests use them. Every trial is a stimulus
+# event with its own trigger code; target trials ('R' rows) carry a
+# P300-like positive deflection peaking 350 ms after the event on every
+# channel, on top of Gaussian noise.
+
+CNT_SETUP_BYTES = 900
+CNT_ELECTRODE_BYTES = 75
+
+# 10-10 montage, ordered so any prefix holds the channels the report and
+# artifact rejection need (FP1, FP2, FZ, PZ, OZ)
+CHANNELS_10_10 = [
+    'FP1', 'FP2', 'FZ', 'PZ', 'OZ', 'F3', 'F4', 'CZ', 'C3', 'C4', 'P3', 'P4',
+    'O1', 'O2', 'T7', 'T8', 'F7', 'F8', 'P7', 'P8', 'FPZ', 'AFZ', 'FCZ', 'CPZ',
+    'POZ', 'IZ', 'AF3', 'AF4', 'AF7', 'AF8', 'F1', 'F2', 'F5', 'F6', 'FC1', 'FC2',
+    'FC3', 'FC4', 'FC5', 'FC6', 'FT7', 'FT8', 'C1', 'C2', 'C5', 'C6', 'CP1', 'CP2',
+    'CP3', 'CP4', 'CP5', 'CP6', 'TP7', 'TP8', 'P1', 'P2', 'P5', 'P6', 'PO3', 'PO4',
+    'PO7', 'PO8', 'T9', 'T10'
+]
+
+FIRST_TRIGGER_CODE = 12001
+
+
+def channel_names(n_channels: int):
+    """Names for ``n_channels`` channels: the 10-10 montage, then E1, E2, ..."""
+    extra = [f'E{i + 1}' for i in range(max(0, n_channels - len(CHANNELS_10_10)))]
+    return (CHANNELS_10_10 + extra)[:n_channels]
+
+
+def write_cnt(path: str, data_uv: np.ndarray, ch_names, sfreq: float, events,
+              lsb_uv: float = 0.1, n_bytes: int = 4, channel_offset: int = 1,
+              baselines=None):
+    """Write a Neuroscan .cnt file with ``n_bytes`` (2 or 4) per sample.
+
+    ``data_uv`` is ``(n_channels, n_samples)`` in microvolts and ``events``
+    a sequence of ``(sample, stim_code)`` or ``(sample, stim_code,
+    keypad_accept)`` tuples (0xc0 rejects, starting a bad span, 0xd0
+    accepts). With ``channel_offset`` > 1 the samples are stored in blocks
+    of that many samples per channel, which needs a whole number of blocks.
+    ``baselines`` are per-channel counts added to every sample.
+    """
+    n_channels, n_samples = data_uv.shape
+    if n_samples % channel_offset:
+        raise ValueError("n_samples must be a multiple of channel_offset")
+    baselines = np.zeros(n_channels, dtype=int) if baselines is None else np.asarray(baselines)
+    header = bytearray(CNT_SETUP_BYTES)
+    header[0:12] = b'Version 3.0\0'
+    header[225:233] = b'01/01/26'
+    header[235:243] = b'12:00:00'
+    struct.pack_into('<H', header, 370, n_channels)
+    struct.pack_into('<H', header, 376, int(sfreq))
+    struct.pack_into('<i', header, 864, n_samples)
+    data_start = CNT_SETUP_BYTES + CNT_ELECTRODE_BYTES * n_channels
+    event_table = data_start + n_bytes * n_channels * n_samples
+    struct.pack_into('<i', header, 886, event_table)
+    struct.pack_into('<f', header, 890, n_samples / sfreq)
+    # Stored in bytes; 0 means multiplexed samples
+    struct.pack_into('<i', header, 894, channel_offset * n_bytes if channel_offset > 1 else 0)
+
+    electrodes = bytearray(CNT_ELECTRODE_BYTES * n_channels)
+    for i, name in enumerate(ch_names):
+        offset = CNT_ELECTRODE_BYTES * i
+        electrodes[offset:offset + len(name)] = name.encode()
+        theta = 2 * np.pi * i / n_channels
+        struct.pack_into('<ff', electrodes, offset + 19, np.cos(theta), np.sin(theta))
+        struct.pack_into('<h', electrodes, offset + 47, int(baselines[i]))
+        struct.pack_into('<f', electrodes, offset + 59, 204.8)
+        struct.pack_into('<f', electrodes, offset + 71, lsb_uv)
+
+    # Event table type 2: 19-byte records holding the byte offset of the sample
+    table = bytearray()
+    for sample, code, *accept in events:
+        offset = data_start + (sample + 1) * n_channels * n_bytes
+        table += struct.pack('<HBBlhhfccc', int(code), 0, accept[0] if accept else 0, offset,
+                             0, 0, 0.0, b'\x00', b'\x00', b'\x00')
+
+    dtype = '<i4' if n_bytes == 4 else '<i2'
+    step = 100_000 // channel_offset * channel_offset or channel_offset
+    with open(path, 'wb') as f:
+        f.write(header)
+        f.write(electrodes)
+        for start in range(0, n_samples, step):
+            block = np.round(data_uv[:, start:start + step] / lsb_uv) + baselines[:, np.newaxis]
+            block = block.astype(dtype)
+            if channel_offset == 1:
+                # Multiplexed: all channels of sample 0, then sample 1, ...
+                f.write(block.T.tobytes())
+            else:
+                # Blocks of channel_offset samples per channel
+                n_blocks = block.shape[1] // channel_offset
+                f.write(block.reshape(n_channels, n_blocks, channel_offset)
+                        .transpose(1, 0, 2).tobytes())
+        f.write(struct.pack('<Bll', 2, len(table), 0))
+        f.write(table)
+
+
+def write_exp(path: str, trials):
+    """Write an .exp log with ``(trial_id, code, is_target, latency_ms)`` rows."""
+    lines = [f'Synthetic experiment log line {i}' for i in range(8)]
+    for trial_id, code, is_target, latency in trials:
+        lines.append('\t'.join([
+            str(trial_id), f'Task{trial_id}', 'stim', 'R' if is_target else 'N',
+            '1', str(code), str(latency)
+        ]))
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def make_recording(cnt_path: str, exp_path: str, n_channels: int = 16,
+                   duration: float = 120.0, sfreq: int = 500, n_trials: int = 120,
+                   target_ratio: float = 0.25, noise_uv: float = 5.0, seed: int = 0) -> dict:
+    """Write a synthetic .cnt/.exp pair and return a description of it."""
+    rng = np.random.default_rng(seed)
+    n_samples = int(duration * sfreq)
+    margin = 2 * sfreq
+    if n_samples <= 2 * margin:
+        raise ValueError("duration must be longer than 4 seconds")
+
+    data = rng.normal(0, noise_uv, (n_channels, n_samples))
+    onsets = np.linspace(margin, n_samples - margin, n_trials).astype(int)
+    targets = rng.random(n_trials) < target_ratio
+
+    t = np.arange(int(0.6 * sfreq)) / sfreq
+    p300 = 8 * np.exp(-((t - 0.35) ** 2) / (2 * 0.05 ** 2))
+    for onset in onsets[targets]:
+        data[:, onset:onset + len(t)] += p300
+
+    codes = FIRST_TRIGGER_CODE + np.arange(n_trials)
+    write_cnt(cnt_path, data, channel_names(n_channels), sfreq,
+              zip(onsets.tolist(), codes.tolist()))
+    latencies = 300 + (np.arange(n_trials) * 37) % 600
+    write_exp(exp_path, zip(range(n_trials), codes.tolist(), targets.tolist(),
+                            latencies.tolist()))
+    return {
+        'n_channels': n_channels,
+        'duration': duration,
+        'sfreq': sfreq,
+        'n_trials': n_trials,
+        'n_targets': int(targets.sum())
+    }
@@ -0,0 +1,77 @@
+import mne
+import numpy as np
+import pytest
+
+from cntreader import CntFile, read_cnt
+from synthetic import channel_names, write_cnt
+
+SFREQ = 500
+N_CHANNELS = 6
+N_SAMPLES = 4000
+
+# Stimuli, and a bad span from the reject (0xc0) to the next accept (0xd0)
+EVENTS = [(250, 12001), (900, 12002), (1500, 7, 0xc0), (1700, 12003),
+          (2100, 8, 0xd0), (3000, 12004), (3400, 9, 0xc0), (3600, 10, 0xd0)]
+
+
+def write_recording(path, n_bytes=4, channel_offset=1, baselines=None, events=EVENTS):
+    rng = np.random.default_rng(0)
+    data_uv = rng.normal(0, 20, (N_CHANNELS, N_SAMPLES))
+    write_cnt(str(path), data_uv, channel_names(N_CHANNELS), SFREQ, events,
+              n_bytes=n_bytes, channel_offset=channel_offset, baselines=baselines)
+    return str(path)
+
+
+def read_reference(path, preload=True):
+    return mne.io.read_raw_cnt(path, data_format='auto', preload=preload, verbose=False)
+
+
+@pytest.mark.parametrize('n_bytes', [2, 4])
+@pytest.mark.parametrize('channel_offset', [1, 40])
+def test_matches_read_raw_cnt(tmp_path, n_bytes, channel_offset):
+    baselines = np.arange(N_CHANNELS) * 15 - 30
+    path = write_recording(tmp_path / 'rec.cnt', n_bytes, channel_offset, baselines)
+    raw = read_cnt(path, preload=True)
+    reference = read_reference(path)
+
+    assert CntFile(path).n_bytes == n_bytes
+    assert raw.ch_names == reference.ch_names
+    assert raw.info['sfreq'] == reference.info['sfreq']
+    assert raw.info['meas_date'] == reference.info['meas_date']
+    assert raw.info['bads'] == reference.info['bads']
+    np.testing.assert_allclose([ch['cal'] for ch in raw.info['chs']],
+                               [ch['cal'] for ch in reference.info['chs']])
+    np.testing.assert_array_equal(raw.get_data(), reference.get_data())
+
+
+@pytest.mark.parametrize('n_bytes', [2, 4])
+def test_annotations_match_read_raw_cnt(tmp_path, n_bytes):
+    path = write_recording(tmp_path / 'rec.cnt', n_bytes)
+    annotations = read_cnt(path).annotations
+    reference = read_reference(path, preload=False).annotations
+
+    assert any(d.startswith('BAD_') for d in annotations.description)
+    assert list(annotations.description) == list(reference.description)
+    np.testing.assert_allclose(annotations.onset, reference.onset)
+    np.testing.assert_allclose(annotations.duration, reference.duration)
+
+
+@pytest.mark.parametrize('channel_offset', [1, 40])
+def test_partial_reads_match_read_raw_cnt(tmp_path, channel_offset):
+    path = write_recording(tmp_path / 'rec.cnt', channel_offset=channel_offset,
+                           baselines=np.full(N_CHANNELS, 12))
+    raw = read_cnt(path).pick(['FZ', 'OZ'])
+    reference = read_reference(path).pick(['FZ', 'OZ'])
+
+    # Starts and stops inside the storage blocks
+    np.testing.assert_array_equal(raw.get_data(start=123, stop=2987),
+                                  reference.get_data(start=123, stop=2987))
+    raw.load_data()
+    np.testing.assert_array_equal(raw.get_data(), reference.get_data())
+
+
+def test_rejects_files_that_are_not_cnt(tmp_path):
+    path = tmp_path / 'short.cnt'
+    path.write_bytes(b'Version 3.0' + bytes(100))
+    with pytest.raises(ValueError):
+        CntFile(str(path))
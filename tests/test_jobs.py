@@ -0,0 +1,179 @@
+import os
+import time
+
+import pytest
+
+from jobs import JobRunner
+
+MB = 2**20
+
+# Jobs and warm-ups run in spawned workers, so they live at module level
+_kept = []
+
+
+def echo(value, progress):
+    return value
+
+
+def allocate(n_bytes, keep=False, progress=None):
+    block = b'x' * n_bytes
+    if keep:
+        _kept.append(block)
+        return len(block)
+    time.sleep(30)
+
+
+def sleep(seconds, progress):
+    time.sleep(seconds)
+
+
+def crash(progress):
+    os._exit(3)
+
+
+def fail_warmup():
+    raise RuntimeError('font cache unavailable')
+
+
+def crash_warmup():
+    os._exit(4)
+
+
+def hang_warmup():
+    time.sleep(60)
+
+
+def bloat_warmup():
+    _kept.append(b'x' * (300 * MB))
+    time.sleep(60)
+
+
+@pytest.fixture
+def make_runner():
+    runners = []
+
+    def make(**options):
+        options = {'max_workers': 1, 'queue_depth': 4, 'stages': ['running'],
+                   'poll_interval': 0.05, **options}
+        runners.append(JobRunner(**options))
+        return runners[-1]
+
+    yield make
+    for runner in runners:
+        runner.shutdown()
+
+
+def wait_for(condition, timeout=30):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out waiting for the runner"
+        time.sleep(0.05)
+
+
+def finished(runner, task_id) -> dict:
+    wait_for(lambda: runner.status(task_id)['status'] in ('done', 'failed'))
+    return runner.status(task_id)
+
+
+def test_job_result(make_runner):
+    runner = make_runner()
+    task_id = runner.submit(echo, 42)
+    assert finished(runner, task_id)['status'] == 'done'
+    assert runner.result(task_id)['result'] == 42
+
+
+def test_job_over_memory_limit_is_killed(make_runner):
+    runner = make_runner(max_rss=150 * MB)
+    status = finished(runner, runner.submit(allocate, 300 * MB))
+    assert status['status'] == 'failed'
+    assert status['failure']['reason'] == 'memory_limit'
+    assert status['failure']['limit_bytes'] == 150 * MB
+    assert status['failure']['rss_bytes'] > 150 * MB
+    assert runner.worker_stats()['killed']['memory_limit'] == 1
+
+
+def test_job_past_timeout_is_killed(make_runner):
+    runner = make_runner(timeout=0.5)
+    status = finished(runner, runner.submit(sleep, 30))
+    assert status['status'] == 'failed'
+    assert status['failure']['reason'] == 'timeout'
+    assert status['failure']['timeout_s'] == 0.5
+    assert runner.worker_stats()['killed']['timeout'] == 1
+
+    # A fresh worker takes the next job
+    assert finished(runner, runner.submit(echo, 1))['status'] == 'done'
+
+
+def test_worker_exit_fails_only_its_job(make_runner):
+    runner = make_runner()
+    status = finished(runner, runner.submit(crash))
+    assert status['status'] == 'failed'
+    assert status['failure'] == {'reason': 'worker_exited', 'exit_code': 3}
+    assert runner.worker_stats()['exited'] == 1
+    assert finished(runner, runner.submit(echo, 1))['status'] == 'done'
+
+
+def test_worker_recycled_after_max_jobs(make_runner):
+    runner = make_runner(worker_max_jobs=2)
+    for value in range(5):
+        assert finished(runner, runner.submit(echo, value))['status'] == 'done'
+    assert runner.worker_stats()['recycled'] == {'max_jobs': 2, 'max_rss': 0}
+
+
+def test_worker_recycled_when_holding_memory(make_runner):
+    runner = make_runner(recycle_rss=150 * MB)
+    assert finished(runner, runner.submit(allocate, 300 * MB, True))['status'] == 'done'
+    assert finished(runner, runner.submit(echo, 1))['status'] == 'done'
+    assert runner.worker_stats()['recycled'] == {'max_jobs': 0, 'max_rss': 1}
+
+
+def test_shutdown_cancels_queued_jobs(make_runner):
+    runner = make_runner()
+    running, queued = runner.submit(sleep, 30), runner.submit(echo, 1)
+    wait_for(lambda: runner.status(running)['status'] == 'running')
+    runner.shutdown()
+    for task_id in (running, queued):
+        status = runner.status(task_id)
+        assert status['status'] == 'failed'
+        assert status['failure'] == {'reason': 'cancelled'}
+
+
+def test_warmed_up_runner_is_ready(make_runner):
+    runner = make_runner(prestart=True, warmup=dict)
+    wait_for(runner.ready)
+    assert runner.worker_stats()['warm'] == 1
+
+
+@pytest.mark.parametrize('warmup, error', [
+    (fail_warmup, 'RuntimeError: font cache unavailable'),
+    (crash_warmup, 'Worker exited during warm-up (exit code 4)'),
+])
+def test_failed_warmup_is_retried_up_to_the_limit(make_runner, warmup, error):
+    runner = make_runner(prestart=True, warmup=warmup, warmup_retries=1)
+    wait_for(lambda: runner.worker_stats()['warmup_failed'] == 2)
+    # Workers stay cold and still run jobs, without further warm-ups
+    assert finished(runner, runner.submit(echo, 1))['status'] == 'done'
+    stats = runner.worker_stats()
+    assert stats['warmup_failed'] == 2
+    assert stats['last_warmup']['error'] == error
+    assert stats['warm'] == 0
+    assert not runner.ready()
+
+
+def test_hung_warmup_fails_waiting_job(make_runner):
+    runner = make_runner(warmup=hang_warmup, warmup_timeout=1)
+    status = finished(runner, runner.submit(echo, 1))
+    assert status['status'] == 'failed'
+    assert status['failure'] == {'reason': 'warmup_timeout', 'timeout_s': 1}
+    stats = runner.worker_stats()
+    assert stats['warmup_failed'] == 1
+    assert stats['killed']['warmup_timeout'] == 1
+
+
+def test_warmup_over_memory_limit_fails_waiting_job(make_runner):
+    runner = make_runner(warmup=bloat_warmup, max_rss=150 * MB)
+    status = finished(runner, runner.submit(echo, 1))
+    assert status['status'] == 'failed'
+    assert status['failure']['reason'] == 'memory_limit'
+    assert status['failure']['during'] == 'warmup'
+    assert runner.worker_stats()['warmup_failed'] == 1
@@ -0,0 +1,124 @@
+import pytest
+from fastapi import HTTPException
+
+import main
+from synthetic import make_recording
+
+ALL_STAGES = ('raw', 'filtered', 'epochs', 'evokeds', 'statistics', 'report')
+
+
+@pytest.fixture(scope='module')
+def recording(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('recording')
+    cnt_path, exp_path = str(directory / 'rec.cnt'), str(directory / 'rec.exp')
+    make_recording(cnt_path, exp_path, n_channels=8, duration=60.0, n_trials=80)
+    return cnt_path, exp_path
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    """A fresh, enabled result and stage cache for one test."""
+    monkeypatch.setitem(main.CONFIG, 'cache', dict(main.CONFIG['cache'], enabled=True,
+                                                   directory=str(tmp_path)))
+    monkeypatch.setattr(main, '_stage_cache', None)
+    monkeypatch.setattr(main, '_result_cache', None)
+    return tmp_path
+
+
+def changed_stages(overrides: dict) -> list:
+    """Stages whose cache key changes under ``overrides``."""
+    before = main.stage_keys('cnt', 'exp')
+    with main.config_overrides_applied(overrides):
+        after = main.stage_keys('cnt', 'exp')
+    return [stage for stage in ALL_STAGES if before[stage] != after[stage]]
+
+
+def analyze(recording, overrides=None) -> dict:
+    cnt_path, exp_path = recording
+    with main.config_overrides_applied(overrides or {}):
+        return main.run_analysis(cnt_path, exp_path, output_format='json')
+
+
+@pytest.mark.parametrize('overrides, first_changed', [
+    ({'filter': {'low': 1.0}}, 'filtered'),
+    ({'epoch': {'tmin': -0.1}}, 'epochs'),
+    ({'rejection': {'eeg': 8e-5}}, 'evokeds'),
+    ({'p300': {'search_window': [0.3, 0.5]}}, 'statistics'),
+])
+def test_config_slice_invalidates_stage_and_downstream(overrides, first_changed):
+    assert changed_stages(overrides) == list(ALL_STAGES[ALL_STAGES.index(first_changed):])
+
+
+def test_operational_config_keeps_every_key(monkeypatch):
+    before = main.stage_keys('cnt', 'exp')
+    digest = main.config_digest()
+    monkeypatch.setitem(main.CONFIG, 'jobs', dict(main.CONFIG['jobs'], max_workers=7))
+    monkeypatch.setitem(main.CONFIG, 'filter', dict(main.CONFIG['filter'], n_jobs=3))
+    monkeypatch.setitem(main.CONFIG, 'streaming', dict(main.CONFIG['streaming'], chunk_seconds=5))
+    assert main.stage_keys('cnt', 'exp') == before
+    assert main.config_digest() == digest
+
+
+def test_report_format_only_changes_report_key():
+    png, svg = main.stage_keys('cnt', 'exp', 'png'), main.stage_keys('cnt', 'exp', 'svg')
+    assert [stage for stage in ALL_STAGES if png[stage] != svg[stage]] == ['report']
+
+
+def test_rejection_override_reuses_epochs(recording, cache_dir):
+    assert analyze(recording)['metadata']['stages_reused'] == []
+    assert analyze(recording)['metadata']['stages_reused'] == ['report']
+
+    overrides = {'rejection': {'eeg': 8e-5}}
+    result = analyze(recording, overrides)
+    # Epochs come from the cache, so raw and filtered are not even looked up
+    assert result['metadata']['stages_reused'] == ['epochs']
+    with main.config_overrides_applied(overrides):
+        keys = main.stage_keys(main.file_digest(recording[0]), main.file_digest(recording[1]),
+                               'json')
+    stages = main.get_stage_cache()
+    for stage in ('raw', 'filtered', 'epochs', 'evokeds'):
+        assert stages.lookup(stage, keys[stage]) is not None
+
+
+def test_filter_change_recomputes_from_filtered(recording, cache_dir):
+    analyze(recording)
+    result = analyze(recording, {'filter': {'low': 1.0}})
+    assert result['metadata']['stages_reused'] == ['raw']
+
+
+def test_result_cache_namespace_follows_analysis_config(monkeypatch):
+    digest = main.config_digest()
+    monkeypatch.setitem(main.CONFIG, 'rejection', dict(main.CONFIG['rejection'], eeg=8e-5))
+    assert main.config_digest() != digest
+
+
+def test_result_cache_key_covers_overrides_and_format():
+    base = main.result_cache_key('cnt', 'exp')
+    assert main.result_cache_key('cnt', 'exp', {}) == base
+    assert main.result_cache_key('cnt', 'exp', {'rejection': {'eeg': 8e-5}}) != base
+    assert main.result_cache_key('cnt', 'exp', output_format='svg') != base
+
+
+@pytest.mark.parametrize('overrides', [
+    [],
+    {'jobs': {'max_workers': 4}},
+    {'filter': {'method': 'iir'}},
+    {'filter': 'low'},
+    {'filter': {'low': True}},
+    {'filter': {'low': '0.5'}},
+    {'filter': {'low': [0.5, 1.0]}},
+    {'epoch': {'baseline': [None]}},
+    {'p300': {'search_window': 0.3}},
+])
+def test_invalid_overrides_are_rejected(overrides):
+    with pytest.raises(HTTPException) as error:
+        main.validate_config_overrides(overrides)
+    assert error.value.status_code == 400
+
+
+def test_valid_overrides_pass():
+    overrides = {'filter': {'low': 1, 'high': 40.0}, 'epoch': {'baseline': [None, 0]},
+                 'rejection': {'eeg': 8e-5}}
+    assert main.validate_config_overrides(overrides) == overrides
+    with pytest.raises(HTTPException):
+        main.validate_config_overrides(overrides, sections=('rejection',))
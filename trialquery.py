@@ -0,0 +1,99 @@
+import numpy as np
+
+# ============================================================================
+# TRIAL QUERIES
+# ============================================================================
+#
+# A trial filter is a JSON object whose criteria all have to hold. Each
+# criterion is a vectorized test on one column of the EpochStore index
+# (reaction time, trial name, trial id, event sample), so a query is a few
+# boolean masks over a few hundred index rows and never touches the epoch
+# data itself. The selected rows are then averaged straight from the
+# memory-mapped store.
+#
+#   rt_quantile  [low, high]  reaction-time quantiles (0-1) over the epochs
+#                             of answered Target trials, e.g. [0, 0.2] =
+#                             fastest 20% of responses
+#   rt_ms        [min, max]   reaction time in ms (answered Target trials)
+#   trial_names  [...]        .exp trial names
+#   trial_ids    [first, last] numeric trial-id range
+#   time_s       [start, end] event time in the recording (s)
+#   block        [i, n]       i-th (from 1) of n equal consecutive runs of epochs
+#
+# Every range is inclusive at both ends.
+
+RANGE_FILTERS = ('rt_quantile', 'rt_ms', 'trial_ids', 'time_s', 'block')
+TRIAL_FILTERS = RANGE_FILTERS + ('trial_names',)
+
+
+def validate_filter(spec) -> dict:
+    """Check a trial filter; raises ValueError with a readable message."""
+    if not isinstance(spec, dict) or not spec:
+        raise ValueError("A trial filter must be a non-empty JSON object")
+    for name, value in spec.items():
+        if name not in TRIAL_FILTERS:
+            raise ValueError(f"Unknown trial filter '{name}' (expected one of {list(TRIAL_FILTERS)})")
+        if name == 'trial_names':
+            if (not isinstance(value, list) or not value
+                    or not all(isinstance(v, str) for v in value)):
+                raise ValueError("trial_names must be a non-empty list of strings")
+            continue
+        if (not isinstance(value, list) or len(value) != 2
+                or not all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in value)):
+            raise ValueError(f"{name} must be a [low, high] pair of numbers")
+        low, high = value
+        if low > high:
+            raise ValueError(f"{name} must have low <= high")
+        if name == 'rt_quantile' and not (0 <= low and high <= 1):
+            raise ValueError("rt_quantile bounds must be between 0 and 1")
+        if name == 'block' and not (isinstance(low, int) and isinstance(high, int)
+                                    and 1 <= low <= high):
+            raise ValueError("block must be [i, n] with 1 <= i <= n")
+    return spec
+
+
+def _numeric_ids(trial_ids: np.ndarray) -> np.ndarray:
+    """Trial ids as numbers; NaN where an id is not numeric."""
+    numbers = np.full(len(trial_ids), np.nan)
+    for i, trial_id in enumerate(trial_ids.tolist()):
+        try:
+            numbers[i] = float(trial_id)
+        except ValueError:
+            pass
+    return numbers
+
+
+def trial_mask(store, spec: dict) -> np.ndarray:
+    """Boolean mask of the store's epochs matching a validated filter."""
+    index = store.index
+    n_epochs = len(store)
+    mask = np.ones(n_epochs, dtype=bool)
+    # Only answered Target trials have a reaction time (NaN elsewhere)
+    reaction_time = index['reaction_time']
+    readable = np.isfinite(reaction_time)
+
+    for name, value in spec.items():
+        if name == 'trial_names':
+            mask &= np.isin(index['trial_name'], value)
+            continue
+        low, high = value
+        if name == 'rt_quantile':
+            if not readable.any():
+                mask[:] = False
+                continue
+            low, high = np.quantile(reaction_time[readable], [low, high])
+            mask &= readable & (reaction_time >= low) & (reaction_time <= high)
+        elif name == 'rt_ms':
+            mask &= readable & (reaction_time >= low) & (reaction_time <= high)
+        elif name == 'trial_ids':
+            ids = _numeric_ids(index['trial_id'])
+            mask &= np.isfinite(ids) & (ids >= low) & (ids <= high)
+        elif name == 'time_s':
+            seconds = index['sample'] / store.info['sfreq']
+            mask &= (seconds >= low) & (seconds <= high)
+        elif name == 'block':
+            bounds = np.linspace(0, n_epochs, high + 1).astype(int)
+            in_block = np.zeros(n_epochs, dtype=bool)
+            in_block[bounds[low - 1]:bounds[low]] = True
+            mask &= in_block
+    return mask
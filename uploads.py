@@ -0,0 +1,308 @@
+import hashlib
+import os
+import shutil
+import time
+
+from multipart.multipart import MultipartParser, parse_options_header
+from starlette.concurrency import run_in_threadpool
+
+# ============================================================================
+# UPLOAD SPOOLING
+# ============================================================================
+#
+# Multipart bodies are parsed as they arrive instead of through FastAPI's
+# UploadFile, which first copies every file into its own temporary file. Each
+# file part is written once, straight to its final path in a per-request
+# spool directory, while it is hashed and checked against a size limit and
+# the expected header magic. That path is what the analysis job opens, so
+# the bytes are never copied again. A request breaking a limit is rejected
+# as soon as the offending chunk arrives.
+
+# Neuroscan SETUP headers start with the format revision, e.g. "Version 3.0"
+CNT_MAGIC = b'Version '
+CNT_HEADER_BYTES = 900
+
+# Bytes inspected to validate a file's header
+HEAD_BYTES = 4096
+
+# Largest accepted plain form field (e.g. config_overrides)
+MAX_FIELD_BYTES = 64 * 1024
+
+
+class UploadRejected(Exception):
+    """Raised while receiving a request that breaks an upload rule."""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def check_cnt_head(head: bytes):
+    """Return an error message if ``head`` is not a Neuroscan .cnt header."""
+    if not head.startswith(CNT_MAGIC):
+        return "not a Neuroscan .cnt file (missing 'Version' header)"
+    return None
+
+
+def check_text_head(head: bytes):
+    """Return an error message if ``head`` does not look like a text file."""
+    if b'\0' in head:
+        return "not a text file"
+    return None
+
+
+def file_rule(suffix: str, max_bytes: int, check, directory: str, min_bytes: int = 1,
+              max_files: int = None) -> dict:
+    """Upload rule for one multipart file field (``max_files`` parts at most)."""
+    return {'suffix': suffix, 'max_bytes': max_bytes, 'min_bytes': min_bytes,
+            'check': check, 'directory': directory, 'max_files': max_files}
+
+
+def safe_filename(filename: str) -> str:
+    """Basename of a client-supplied filename, refusing hidden or empty names."""
+    name = os.path.basename(filename.replace('\\', '/'))
+    if not name or name.startswith('.'):
+        raise UploadRejected(400, f"Invalid file name '{filename}'")
+    return name
+
+
+class MultipartSpooler:
+    """Incremental multipart parser that writes file parts straight to disk.
+
+    ``rules`` maps file field names to file_rule() dicts; each part is
+    stored as ``<rule directory>/<filename>``.
+    """
+
+    def __init__(self, boundary: bytes, rules: dict):
+        self.rules = rules
+        self.files = {}
+        self.fields = {}
+        self._written = []
+        self._reset_part()
+        self._parser = MultipartParser(boundary, {
+            'on_part_begin': self._reset_part,
+            'on_header_field': self._on_header_field,
+            'on_header_value': self._on_header_value,
+            'on_header_end': self._on_header_end,
+            'on_headers_finished': self._on_headers_finished,
+            'on_part_data': self._on_part_data,
+            'on_part_end': self._on_part_end
+        })
+
+    def _reset_part(self):
+        self._header_field = b''
+        self._header_value = b''
+        self._headers = {}
+        self._name = None
+        self._file = None
+        self._value = b''
+
+    def _on_header_field(self, data, start, end):
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data, start, end):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b''
+        self._header_value = b''
+
+    def _on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b'content-disposition', b''))
+        self._name = options.get(b'name', b'').decode('utf-8', 'replace')
+        filename = options.get(b'filename')
+        if filename is None:
+            return
+
+        rule = self.rules.get(self._name)
+        if rule is None:
+            raise UploadRejected(400, f"Unexpected file field '{self._name}'")
+        if rule['max_files'] is not None and len(self.files.get(self._name, ())) >= rule['max_files']:
+            raise UploadRejected(413, f"Too many files in '{self._name}' "
+                                      f"(at most {rule['max_files']})")
+        filename = safe_filename(filename.decode('utf-8', 'replace'))
+        if not filename.endswith(rule['suffix']):
+            raise UploadRejected(400, f"Invalid file type. Expected {rule['suffix']} file")
+
+        os.makedirs(rule['directory'], exist_ok=True)
+        path = os.path.join(rule['directory'], filename)
+        if path in self._written:
+            raise UploadRejected(400, f"Duplicate file name '{filename}'")
+        self._written.append(path)
+        self._file = {
+            'filename': filename,
+            'path': path,
+            'size': 0,
+            'handle': open(path, 'wb'),
+            'hash': hashlib.sha256(),
+            'head': b'',
+            'checked': False
+        }
+
+    def _on_part_data(self, data, start, end):
+        chunk = data[start:end]
+        part = self._file
+        if part is None:
+            if len(self._value) + len(chunk) > MAX_FIELD_BYTES:
+                raise UploadRejected(413, f"Form field '{self._name}' is too large")
+            self._value += chunk
+            return
+
+        rule = self.rules[self._name]
+        part['size'] += len(chunk)
+        if part['size'] > rule['max_bytes']:
+            raise UploadRejected(
+                413, f"{part['filename']} exceeds the {rule['max_bytes'] // (1024 * 1024)} MB limit"
+            )
+        if not part['checked']:
+            part['head'] += chunk[:HEAD_BYTES - len(part['head'])]
+            if len(part['head']) >= HEAD_BYTES:
+                self._check_head(part, rule)
+        part['hash'].update(chunk)
+        part['handle'].write(chunk)
+
+    def _check_head(self, part: dict, rule: dict):
+        error = rule['check'](part['head'])
+        if error is not None:
+            raise UploadRejected(400, f"{part['filename']}: {error}")
+        part['checked'] = True
+        part['head'] = b''
+
+    def _on_part_end(self):
+        part = self._file
+        if part is None:
+            self.fields[self._name] = self._value.decode('utf-8', 'replace')
+            return
+
+        part['handle'].close()
+        rule = self.rules[self._name]
+        if not part['checked']:
+            self._check_head(part, rule)
+        if part['size'] < rule['min_bytes']:
+            raise UploadRejected(400, f"{part['filename']}: file is empty or truncated")
+        self.files.setdefault(self._name, []).append({
+            'filename': part['filename'],
+            'path': part['path'],
+            'size': part['size'],
+            'sha256': part['hash'].hexdigest()
+        })
+        self._file = None
+
+    def write(self, chunk: bytes):
+        self._parser.write(chunk)
+
+    def finish(self):
+        """Return ``(files, fields)``: spooled files per field and form values."""
+        self._parser.finalize()
+        return self.files, self.fields
+
+    def abort(self):
+        """Close and delete everything written so far."""
+        if self._file is not None:
+            self._file['handle'].close()
+        for path in self._written:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+async def receive_uploads(request, rules: dict, max_body_bytes: int = None):
+    """Stream a multipart request into the spool.
+
+    Returns ``(files, fields)`` where ``files`` maps each file field to a
+    list of ``{filename, path, size, sha256}`` dicts. Raises UploadRejected
+    (after removing partial files) if a rule is broken.
+    """
+    length = request.headers.get('content-length')
+    if length is not None:
+        try:
+            length = int(length)
+        except ValueError:
+            raise UploadRejected(400, "Invalid Content-Length header")
+    if max_body_bytes is not None and length is not None and length > max_body_bytes:
+        raise UploadRejected(413, f"Request body exceeds the {max_body_bytes // (1024 * 1024)} MB limit")
+
+    content_type, options = parse_options_header(request.headers.get('content-type', ''))
+    boundary = options.get(b'boundary')
+    if content_type != b'multipart/form-data' or not boundary:
+        raise UploadRejected(400, "Expected a multipart/form-data upload")
+
+    spooler = MultipartSpooler(boundary, rules)
+    try:
+        received = 0
+        async for chunk in request.stream():
+            received += len(chunk)
+            if max_body_bytes is not None and received > max_body_bytes:
+                raise UploadRejected(413, f"Request body exceeds the {max_body_bytes // (1024 * 1024)} MB limit")
+            if chunk:
+                await run_in_threadpool(spooler.write, chunk)
+        files, fields = spooler.finish()
+    except BaseException:
+        spooler.abort()
+        raise
+
+    for field in rules:
+        if field not in files:
+            spooler.abort()
+            raise UploadRejected(400, f"Missing file field '{field}'")
+    return files, fields
+
+
+def remove_request_dirs(*paths):
+    """Delete spooled files and their request directories once empty."""
+    for path in paths:
+        if not path:
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        try:
+            os.rmdir(os.path.dirname(path))
+        except OSError:
+            pass
+
+
+def purge_stale_requests(directory: str, max_age: float):
+    """Remove request directories left behind by a crashed process."""
+    cutoff = time.time() - max_age
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return
+    for name in names:
+        path = os.path.join(directory, name)
+        try:
+            if os.path.isdir(path) and os.stat(path).st_mtime < cutoff:
+                shutil.rmtree(path, ignore_errors=True)
+        except OSError:
+            continue
+
+
+def spool_usage(directory: str) -> dict:
+    """Bytes held on disk by each in-flight request in a spool directory."""
+    requests = []
+    now = time.time()
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        names = []
+    for name in names:
+        path = os.path.join(directory, name)
+        try:
+            files = os.listdir(path)
+            size = sum(os.path.getsize(os.path.join(path, f)) for f in files)
+            age = now - os.stat(path).st_ctime
+        except OSError:
+            continue
+        requests.append({'request_id': name, 'files': len(files), 'bytes': size,
+                         'age_seconds': round(age, 1)})
+    return {
+        'directory': directory,
+        'requests': len(requests),
+        'bytes': sum(r['bytes'] for r in requests),
+        'in_flight': sorted(requests, key=lambda r: -r['bytes'])
+    }